@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+# Generates realistic synthetic ledgers (config, accounts and monthly transactions)
+# as well as CSV and OFX files to import, for benchmarks and load tests.
+#
+#   $ python -m benchmarks.generate DIRECTORY [--years=2] [--transactions=200] [--accounts=3] [--storage=csv] [--seed=0]
+from budgettracker.data import Account, Transaction
+from budgettracker.storage import get_storage
+from monthdelta import monthdelta
+from getopt import gnu_getopt
+import datetime, random, os, sys, codecs, unicodecsv, yaml
+
+
+MERCHANTS = [
+    ('CB CARREFOUR', 'Groceries', 20, 150),
+    ('CB MONOPRIX', 'Groceries', 5, 60),
+    ('CB BIOCOOP', 'Groceries', 10, 80),
+    ('CB RESTAURANT LE PETIT ZINC', 'Restaurants', 25, 90),
+    ('CB SUSHI SHOP', 'Restaurants', 15, 45),
+    ('CB STARBUCKS', 'Restaurants', 3, 12),
+    ('CB UGC CINE CITE', 'Leisure', 8, 25),
+    ('CB FNAC', 'Leisure', 10, 120),
+    ('CB SPOTIFY', 'Subscriptions', 10, 10),
+    ('CB NETFLIX', 'Subscriptions', 13, 13),
+    ('CB RATP NAVIGO', 'Transport', 75, 75),
+    ('CB SNCF', 'Transport', 20, 150),
+    ('CB UBER', 'Transport', 8, 40),
+    ('CB TOTAL STATION', 'Car', 40, 80),
+    ('CB PHARMACIE CENTRALE', 'Health', 5, 40),
+    ('CB DECATHLON', 'Sport', 15, 200),
+    ('CB ZARA', 'Clothes', 20, 150),
+    ('CB AMAZON', None, 10, 200),
+    ('PRLV FREE MOBILE', 'Subscriptions', 20, 20),
+    ('RETRAIT DAB', None, 20, 100)
+]
+
+CATEGORIES = [
+    ('Groceries', '#4caf50', ['carrefour', 'monoprix', 'biocoop'], 400),
+    ('Restaurants', '#ff9800', ['restaurant', 'sushi', 'starbucks'], 250),
+    ('Leisure', '#9c27b0', ['cine', 'fnac'], 150),
+    ('Subscriptions', '#607d8b', ['spotify', 'netflix', 'free mobile'], None),
+    ('Transport', '#2196f3', ['ratp', 'sncf', 'uber'], 200),
+    ('Car', '#795548', ['total station'], None),
+    ('Health', '#f44336', ['pharmacie'], None),
+    ('Sport', '#00bcd4', ['decathlon'], None),
+    ('Clothes', '#e91e63', ['zara'], 150)
+]
+
+BUDGET_GOALS = [('Emergency fund', 6000.0), ('Holidays', 2400.0), ('New laptop', 1500.0), ('Misc', None)]
+
+
+def generate_config(storage_dir, storage='csv', imports_dir=None):
+    return {
+        'storage': storage,
+        'storage_dir': storage_dir,
+        'imports_dir': imports_dir,
+        'bank_adapter': 'csv',
+        'amount_format': '{sign}${amount}',
+        'inter_account_labels_out': r'VIR SEPA VERS \w+ REF (?P<id>\d+)',
+        'inter_account_labels_in': r'VIR SEPA DE \w+ REF (?P<id>\d+)',
+        'income_sources': [
+            {'label': 'Salary', 'amount': 3200.0, 'match': 'VIR SALAIRE'},
+            {'label': 'Side projects', 'amount': 300.0, 'match': 'VIR FREELANCE'}
+        ],
+        'planned_expenses': [
+            {'label': 'Rent', 'amount': 1100.0, 'recurrence': 'monthly', 'match': 'PRLV LOYER'},
+            {'label': 'Electricity', 'amount': 60.0, 'recurrence': 'monthly', 'match': 'PRLV EDF'},
+            {'label': 'Home insurance', 'amount': 240.0, 'recurrence': 'yearly', 'match': 'PRLV ASSURANCE'}
+        ],
+        'budget_goals': [{'label': label, 'amount': amount} for label, amount in BUDGET_GOALS],
+        'categories': [{'name': name, 'color': color, 'keywords': keywords, 'warning_threshold': threshold}
+            for name, color, keywords, threshold in CATEGORIES]
+    }
+
+
+def iter_months(years, today=None):
+    # the ledger always ends with the current month as the web interface defaults to it
+    today = today or datetime.date.today()
+    date = datetime.date(today.year - years + 1, 1, 1)
+    while date <= today:
+        yield date
+        date += monthdelta(1)
+
+
+def generate_monthly_transactions(rand, date, accounts, transactions_per_month, next_id):
+    next_month = date + monthdelta(1)
+    days = (next_month - date).days
+    day = lambda: date.replace(day=rand.randint(1, days))
+    main_account = accounts[0].id
+    transactions = []
+
+    def add(label, amount, account=main_account, tx_date=None, categories=None, goal=None):
+        transactions.append(Transaction(str(next_id()), label, tx_date or day(), round(amount, 2),
+            account, categories or [], goal))
+
+    add('VIR SALAIRE ACME CORP', 3200.0, tx_date=date.replace(day=min(28, days)))
+    if rand.random() < 0.3:
+        add('VIR FREELANCE CLIENT %d' % rand.randint(1, 20), rand.uniform(100, 600))
+    add('PRLV LOYER SCI DES LILAS', -1100.0, tx_date=date.replace(day=5))
+    add('PRLV EDF CLIENTS PARTICULIERS', -rand.uniform(40, 80), tx_date=date.replace(day=10))
+    if date.month == 3:
+        add('PRLV ASSURANCE HABITATION', -240.0, tx_date=date.replace(day=15))
+
+    # transfers between accounts are detected using inter_account_labels_*
+    for account in accounts[1:]:
+        amount = rand.choice([100, 200, 300])
+        tx_date = day()
+        ref = rand.randint(10 ** 6, 10 ** 7)
+        add('VIR SEPA VERS %s REF %s' % (account.id, ref), -amount, tx_date=tx_date)
+        add('VIR SEPA DE %s REF %s' % (main_account, ref), amount, account=account.id, tx_date=tx_date)
+
+    # day to day expenses are scaled so that the ledger keeps saving money whatever their number
+    expenses = [(rand.choice(MERCHANTS), rand.random()) for i in range(max(transactions_per_month - len(transactions), 0))]
+    amounts = [min_amount + r * (max_amount - min_amount) for (_, _, min_amount, max_amount), r in expenses]
+    scale = rand.uniform(1400, 2000) / sum(amounts) if amounts else 1
+    for ((label, category, _, _), _), amount in zip(expenses, amounts):
+        goal = None
+        if category is None and rand.random() < 0.2:
+            goal = rand.choice(BUDGET_GOALS)[0]
+        add('%s %02d/%02d' % (label, rand.randint(1, 28), date.month), -max(amount * scale, 0.5),
+            account=rand.choice(accounts).id if rand.random() < 0.1 else main_account,
+            categories=[category] if category else None, goal=goal)
+
+    return sorted(transactions, key=lambda tx: tx.date)
+
+
+def generate_ledger(directory, years=2, transactions_per_month=200, accounts=3, storage='csv', seed=0):
+    # writes config.yaml and the storage dir under directory. returns the config filename
+    rand = random.Random(seed)
+    storage_dir = os.path.join(directory, 'data')
+    imports_dir = os.path.join(directory, 'imports')
+    for path in (storage_dir, imports_dir):
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+    config = generate_config(storage_dir, storage, imports_dir)
+    config_filename = os.path.join(directory, 'config.yaml')
+    with codecs.open(config_filename, 'w') as f:
+        yaml.safe_dump(config, f, default_flow_style=False)
+
+    accounts = [Account('ACC%d' % (i + 1), 'Account %d' % (i + 1), 0) for i in range(accounts)]
+    ids = iter(xrange(1, sys.maxint))
+    store = get_storage(storage)(config)
+    balances = dict((acc.id, 1000.0) for acc in accounts)
+    for date in iter_months(years):
+        transactions = generate_monthly_transactions(rand, date, accounts, transactions_per_month, lambda: next(ids))
+        for tx in transactions:
+            balances[tx.account] += tx.amount
+        store.save_monthly_transactions(date, transactions)
+    store.save_accounts([acc.update(amount=round(balances[acc.id], 2)) for acc in accounts])
+    return config_filename
+
+
+def generate_import_transactions(date, transactions_per_month=200, accounts=3, seed=0):
+    rand = random.Random(seed)
+    accounts = [Account('ACC%d' % (i + 1), 'Account %d' % (i + 1), 0) for i in range(accounts)]
+    ids = iter(xrange(10 ** 9, sys.maxint))
+    return generate_monthly_transactions(rand, date.replace(day=1), accounts, transactions_per_month, lambda: next(ids))
+
+
+def write_csv_import(filename, transactions):
+    # same columns as expected by the CSV bank adapter
+    with codecs.open(filename, 'w') as f:
+        writer = unicodecsv.writer(f)
+        for tx in transactions:
+            writer.writerow([tx.id, tx.label, tx.date.isoformat(), tx.amount, tx.account])
+
+
+def write_ofx_import(filename, transactions):
+    # OFX 1.x SGML statement with one STMTRS per account
+    accounts = sorted(set(tx.account for tx in transactions))
+    dtstart = min(tx.date for tx in transactions).strftime('%Y%m%d')
+    dtend = max(tx.date for tx in transactions).strftime('%Y%m%d')
+    with codecs.open(filename, 'w', 'ascii') as f:
+        f.write("OFXHEADER:100\nDATA:OFXSGML\nVERSION:102\nSECURITY:NONE\nENCODING:USASCII\nCHARSET:1252\n"
+                "COMPRESSION:NONE\nOLDFILEUID:NONE\nNEWFILEUID:NONE\n\n")
+        f.write("<OFX>\n<SIGNONMSGSRSV1><SONRS><STATUS><CODE>0<SEVERITY>INFO</STATUS>"
+                "<DTSERVER>%s<LANGUAGE>ENG</SONRS></SIGNONMSGSRSV1>\n<BANKMSGSRSV1>\n" % dtend)
+        for i, account in enumerate(accounts):
+            account_transactions = [tx for tx in transactions if tx.account == account]
+            f.write("<STMTTRNRS><TRNUID>%d<STATUS><CODE>0<SEVERITY>INFO</STATUS>\n<STMTRS><CURDEF>EUR\n"
+                    "<BANKACCTFROM><BANKID>30004<BRANCHID>00001<ACCTID>%s<ACCTTYPE>CHECKING</BANKACCTFROM>\n"
+                    "<BANKTRANLIST><DTSTART>%s<DTEND>%s\n" % (i + 1, account, dtstart, dtend))
+            for tx in account_transactions:
+                name, _, memo = tx.label.partition(' ')
+                f.write("<STMTTRN><TRNTYPE>%s<DTPOSTED>%s<TRNAMT>%.2f<FITID>%s<NAME>%s<MEMO>%s</STMTTRN>\n" % (
+                    'CREDIT' if tx.amount > 0 else 'DEBIT', tx.date.strftime('%Y%m%d'), tx.amount, tx.id, name, memo))
+            f.write("</BANKTRANLIST>\n<LEDGERBAL><BALAMT>%.2f<DTASOF>%s</LEDGERBAL>\n</STMTRS></STMTTRNRS>\n" % (
+                sum(tx.amount for tx in account_transactions), dtend))
+        f.write("</BANKMSGSRSV1>\n</OFX>\n")
+
+
+def main():
+    kwargs, args = gnu_getopt(sys.argv[1:], '', ['years=', 'transactions=', 'accounts=', 'storage=', 'seed='])
+    kwargs = dict((k.strip('-'), v) for k, v in kwargs)
+    if not args:
+        print "Usage: python -m benchmarks.generate DIRECTORY [--years=2] [--transactions=200] [--accounts=3] [--storage=csv] [--seed=0]"
+        sys.exit(1)
+    print generate_ledger(args[0], int(kwargs.get('years', 2)), int(kwargs.get('transactions', 200)),
+        int(kwargs.get('accounts', 3)), kwargs.get('storage', 'csv'), int(kwargs.get('seed', 0)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+# Drives the web app with concurrent simulated users mixing page views, JSON polling,
+# transaction edits and uploads, then reports throughput, latency percentiles and
+# error rates per route.
+#
+# By default runs fully offline: a synthetic ledger is generated and the app is driven
+# in process through the Flask test client, uploads being imported by the CSV adapter.
+# With --url, an already running server is targeted instead (its ledger should have
+# been created with benchmarks.generate so that the requested pages exist).
+#
+#   $ python -m benchmarks.loadtest [--users=20] [--duration=30] [--years=2] [--transactions=200]
+#                                   [--accounts=3] [--storage=csv] [--url=URL] [--passcode=PASSCODE]
+#                                   [--dir=DIRECTORY] [--output=FILE] [--seed=0]
+from .generate import generate_ledger, generate_config, generate_import_transactions, write_csv_import, iter_months
+from getopt import getopt
+from timeit import default_timer
+from StringIO import StringIO
+import tempfile, shutil, threading, random, json, time, sys, os
+
+
+class TestClientTransport(object):
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, data=None, files=None, headers=None):
+        data = dict(data or {})
+        for name, (filename, content) in (files or {}).items():
+            data[name] = (StringIO(content), filename)
+        response = self.client.open(path, method=method, data=data, headers=headers)
+        body = response.get_data()
+        return response.status_code, body
+
+
+class HTTPTransport(object):
+    def __init__(self, url, passcode=None):
+        import requests
+        self.url = url.rstrip('/')
+        self.session = requests.Session()
+        if passcode:
+            self.session.auth = (passcode, '')
+
+    def request(self, method, path, data=None, files=None, headers=None):
+        response = self.session.request(method, self.url + path, data=data, files=files,
+            headers=headers, allow_redirects=False)
+        return response.status_code, response.content
+
+
+class Stats(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.timings = {}
+        self.errors = {}
+
+    def record(self, route, duration, error=False):
+        with self.lock:
+            self.timings.setdefault(route, []).append(duration)
+            self.errors.setdefault(route, 0)
+            if error:
+                self.errors[route] += 1
+
+    def report(self, elapsed):
+        routes = {}
+        for route, timings in sorted(self.timings.items()):
+            timings = sorted(timings)
+            routes[route] = {
+                'count': len(timings),
+                'errors': self.errors[route],
+                'error_rate': float(self.errors[route]) / len(timings),
+                'throughput': len(timings) / elapsed,
+                'mean': sum(timings) / len(timings),
+                'p50': percentile(timings, 50),
+                'p95': percentile(timings, 95),
+                'p99': percentile(timings, 99),
+                'max': timings[-1]
+            }
+        total = sum(r['count'] for r in routes.values())
+        errors = sum(r['errors'] for r in routes.values())
+        return {
+            'duration': elapsed,
+            'requests': total,
+            'errors': errors,
+            'error_rate': float(errors) / total if total else 0,
+            'throughput': total / elapsed,
+            'routes': routes
+        }
+
+
+def percentile(sorted_values, pct):
+    # nearest-rank percentile
+    index = int(round(pct / 100.0 * len(sorted_values) + 0.5)) - 1
+    return sorted_values[max(0, min(index, len(sorted_values) - 1))]
+
+
+class User(threading.Thread):
+    def __init__(self, transport, ledger, stats, deadline, seed):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.transport = transport
+        self.ledger = ledger
+        self.stats = stats
+        self.deadline = deadline
+        self.rand = random.Random(seed)
+        self.actions = [
+            (30, self.view_month),
+            (10, self.view_year),
+            (10, self.view_category),
+            (5, self.view_goal),
+            (20, self.poll_budget),
+            (10, self.poll_transactions),
+            (10, self.edit_transaction),
+            (5, self.upload)
+        ]
+
+    def request(self, route, method, path, **kwargs):
+        start = default_timer()
+        try:
+            status, body = self.transport.request(method, path, **kwargs)
+        except Exception:
+            self.stats.record(route, default_timer() - start, True)
+            return None, None
+        self.stats.record(route, default_timer() - start, status >= 400)
+        return status, body
+
+    def run(self):
+        total_weight = sum(weight for weight, _ in self.actions)
+        while time.time() < self.deadline:
+            pick = self.rand.uniform(0, total_weight)
+            for weight, action in self.actions:
+                pick -= weight
+                if pick <= 0:
+                    break
+            action()
+
+    def random_month(self):
+        return self.rand.choice(self.ledger['months'])
+
+    def view_month(self):
+        date = self.random_month()
+        self.request('month', 'GET', '/%s/%s' % (date.year, date.month))
+
+    def view_year(self):
+        self.request('year', 'GET', '/%s' % self.random_month().year)
+
+    def view_category(self):
+        self.request('category', 'GET', '/%s/categories/%s' % (self.random_month().year,
+            self.rand.choice(self.ledger['categories'])))
+
+    def view_goal(self):
+        self.request('goal', 'GET', '/%s/goals/%s' % (self.random_month().year,
+            self.rand.choice(self.ledger['goals'])))
+
+    def poll_budget(self):
+        date = self.ledger['months'][-1]
+        self.request('budget_json', 'GET', '/%s/%s/budget.json' % (date.year, date.month))
+
+    def poll_transactions(self):
+        date = self.ledger['months'][-1]
+        self.request('transactions_json', 'GET', '/%s/%s/transactions.json' % (date.year, date.month))
+
+    def edit_transaction(self):
+        date = self.ledger['months'][-1]
+        categories = [self.rand.choice(self.ledger['categories'])]
+        if self.rand.random() < 0.05:
+            # new categories go through the config rewrite path
+            categories.append('Loadtest %d' % self.rand.randint(1, 1000))
+        self.request('edit_transaction', 'POST', '/%s/%s/%s' % (date.year, date.month,
+            self.rand.choice(self.ledger['transaction_ids'])), data={'categories': categories})
+
+    def upload(self):
+        date = self.ledger['months'][-1]
+        status, body = self.request('upload', 'POST', '/%s/%s' % (date.year, date.month),
+            files={'file': ('import.csv', self.rand.choice(self.ledger['uploads']))},
+            headers={'Accept': 'application/json'})
+        if status != 202:
+            return
+        # polls the import job like the web interface does
+        job = json.loads(body)
+        start = default_timer()
+        while job['status'] not in ('done', 'failed') and time.time() < self.deadline + 30:
+            time.sleep(0.2)
+            status, body = self.request('job_status', 'GET', job['url'])
+            if status != 200:
+                return
+            job = json.loads(body)
+        self.stats.record('upload_job', default_timer() - start, job['status'] != 'done')
+
+
+def describe_ledger(directory, params, transport):
+    # what simulated users need to know about the ledger
+    config = generate_config(None)
+    months = list(iter_months(params['years']))
+
+    uploads = []
+    filename = os.path.join(directory, 'upload.csv')
+    for seed in range(5):
+        write_csv_import(filename, generate_import_transactions(months[-1], 20, params['accounts'], seed=100 + seed))
+        with open(filename) as f:
+            uploads.append(f.read())
+
+    status, body = transport.request('GET', '/%s/%s/transactions.json' % (months[-1].year, months[-1].month))
+    if status != 200:
+        raise Exception("Cannot list transactions of the current month (status %s)" % status)
+
+    return {
+        'months': months,
+        'categories': [c['name'] for c in config['categories']],
+        'goals': [g['label'] for g in config['budget_goals']],
+        'transaction_ids': [tx['id'] for tx in json.loads(body)],
+        'uploads': uploads
+    }
+
+
+def run(directory, params, users=20, duration=30, url=None, passcode=None, seed=0):
+    if url:
+        create_transport = lambda: HTTPTransport(url, passcode)
+    else:
+        # the web module loads its ledger on import, BUDGET_CONFIG must point to the generated one first
+        os.environ['BUDGET_CONFIG'] = generate_ledger(directory, params['years'], params['transactions'],
+            params['accounts'], params['storage'])
+        from budgettracker.web import app
+        create_transport = lambda: TestClientTransport(app)
+    ledger = describe_ledger(directory, params, create_transport())
+
+    stats = Stats()
+    start = time.time()
+    threads = [User(create_transport(), ledger, stats, start + duration, seed + i) for i in range(users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+
+    report = stats.report(elapsed)
+    report['params'] = dict(params, users=users, duration=duration, url=url)
+    return report
+
+
+def print_report(report, stream=sys.stderr):
+    print >>stream, '%-20s %8s %8s %10s %10s %10s %10s' % ('route', 'count', 'errors', 'p50', 'p95', 'p99', 'req/s')
+    for route, r in sorted(report['routes'].items()):
+        print >>stream, '%-20s %8d %7.1f%% %8.1fms %8.1fms %8.1fms %10.1f' % (route, r['count'],
+            r['error_rate'] * 100, r['p50'] * 1000, r['p95'] * 1000, r['p99'] * 1000, r['throughput'])
+    print >>stream, '%d requests in %.1fs (%.1f req/s), %.1f%% errors' % (report['requests'],
+        report['duration'], report['throughput'], report['error_rate'] * 100)
+
+
+def main():
+    kwargs, args = getopt(sys.argv[1:], '', ['users=', 'duration=', 'years=', 'transactions=', 'accounts=',
+        'storage=', 'url=', 'passcode=', 'dir=', 'output=', 'seed='])
+    kwargs = dict((k.strip('-'), v) for k, v in kwargs)
+    params = {
+        'years': int(kwargs.get('years', 2)),
+        'transactions': int(kwargs.get('transactions', 200)),
+        'accounts': int(kwargs.get('accounts', 3)),
+        'storage': kwargs.get('storage', 'csv')
+    }
+
+    directory = kwargs.get('dir') or tempfile.mkdtemp(prefix='budgettracker-loadtest-')
+    try:
+        report = run(directory, params, int(kwargs.get('users', 20)), float(kwargs.get('duration', 30)),
+            kwargs.get('url'), kwargs.get('passcode'), int(kwargs.get('seed', 0)))
+    finally:
+        if not kwargs.get('dir'):
+            shutil.rmtree(directory, ignore_errors=True)
+
+    print_report(report)
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if kwargs.get('output'):
+        with open(kwargs['output'], 'w') as f:
+            f.write(output)
+    else:
+        print output
+
+
+if __name__ == '__main__':
+    main()
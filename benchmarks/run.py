@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+# Runs timed scenarios against a synthetic ledger and prints the results as JSON
+# so that runs can be compared across commits.
+#
+#   $ python -m benchmarks.run [--years=2] [--transactions=200] [--accounts=3] [--storage=csv]
+#                              [--repeat=5] [--filter=REGEXP] [--dir=DIRECTORY] [--output=FILE]
+from .generate import generate_ledger, generate_import_transactions, write_csv_import, write_ofx_import
+from getopt import getopt
+from timeit import default_timer
+import datetime, tempfile, shutil, subprocess, platform, traceback, json, sys, os, re
+
+
+scenarios = []
+
+
+def scenario(name):
+    def decorator(func):
+        scenarios.append((name, func))
+        return func
+    return decorator
+
+
+class Context(object):
+    def __init__(self, directory, config_filename, params):
+        from budgettracker.helpers import load_config, get_storage_from_config
+        self.directory = directory
+        self.params = params
+        self.config = load_config(config_filename)
+        self.storage = get_storage_from_config(self.config)
+        self.date = datetime.date.today().replace(day=1)
+        self.transactions = self.storage.load_yearly_transactions(self.date)
+        self.import_transactions = generate_import_transactions(self.date,
+            params['transactions'], params['accounts'], seed=1)
+        self.csv_filename = os.path.join(directory, 'import.csv')
+        self.ofx_filename = os.path.join(directory, 'import.ofx')
+        write_csv_import(self.csv_filename, self.import_transactions)
+        write_ofx_import(self.ofx_filename, self.import_transactions)
+
+
+@scenario('load_yearly_transactions')
+def bench_load_yearly_transactions(ctx):
+    ctx.storage.load_yearly_transactions(ctx.date)
+
+
+@scenario('budgetize')
+def bench_budgetize(ctx):
+    from budgettracker.budget import budgetize
+    start_date = ctx.date.replace(month=1)
+    budgetize(ctx.transactions, start_date, start_date.replace(year=start_date.year + 1),
+        list(ctx.config.income_sources), list(ctx.config.planned_expenses), list(ctx.config.budget_goals))
+
+
+@scenario('compute_budget_goals')
+def bench_compute_budget_goals(ctx):
+    from budgettracker.helpers import load_yearly_budgets_from_config
+    from budgettracker.budget import compute_budget_goals
+    if not hasattr(ctx, 'budgets'):
+        ctx.budgets = load_yearly_budgets_from_config(ctx.config, ctx.date, False, ctx.storage)
+    compute_budget_goals(ctx.budgets, list(ctx.config.budget_goals))
+
+
+@scenario('compute_budget_goals_envelopes')
+def bench_compute_budget_goals_envelopes(ctx):
+    # hundreds of small goals, many of them completing every month
+    from budgettracker.helpers import load_yearly_budgets_from_config
+    from budgettracker.budget import compute_budget_goals, BudgetGoal
+    if not hasattr(ctx, 'budgets'):
+        ctx.budgets = load_yearly_budgets_from_config(ctx.config, ctx.date, False, ctx.storage)
+    if not hasattr(ctx, 'envelopes'):
+        ctx.envelopes = [BudgetGoal.from_dict({'label': 'Envelope %s' % i, 'amount': 5.0 + (i * 37) % 400,
+            'priority': i % 3, 'weight': 1 + i % 4}) for i in range(300)]
+    compute_budget_goals(ctx.budgets, ctx.envelopes)
+
+
+@scenario('compute_yearly_budget_goals')
+def bench_compute_yearly_budget_goals(ctx):
+    # resumes from the checkpoints saved by the first run
+    from budgettracker.helpers import compute_yearly_budget_goals_from_config
+    compute_yearly_budget_goals_from_config(ctx.config, ctx.date, ctx.storage)
+
+
+@scenario('compute_categories')
+def bench_compute_categories(ctx):
+    from budgettracker.categories import compute_categories
+    compute_categories(ctx.transactions, ctx.config.categories)
+
+
+@scenario('match_categories')
+def bench_match_categories(ctx):
+    from budgettracker.categories import match_compiled_categories
+    for tx in ctx.transactions:
+        match_compiled_categories(ctx.config.category_matchers, tx.label)
+
+
+@scenario('extract_inter_account_transactions')
+def bench_extract_inter_account_transactions(ctx):
+    from budgettracker.data import extract_inter_account_transactions
+    extract_inter_account_transactions(ctx.transactions,
+        ctx.config.inter_account_labels_out, ctx.config.inter_account_labels_in)
+
+
+def bench_import(ctx, adapter_name, filename):
+    # imports the current month in a scratch copy of the storage dir
+    from budgettracker.bank_adapters import get_bank_adapter
+    from budgettracker.helpers import update_local_data, get_storage_from_config
+    storage_dir = os.path.join(ctx.directory, 'import-data')
+    if os.path.exists(storage_dir):
+        shutil.rmtree(storage_dir)
+    shutil.copytree(ctx.config['storage_dir'], storage_dir)
+    config = dict(ctx.config.to_dict(), storage_dir=storage_dir, bank_adapter=adapter_name)
+    adapter = get_bank_adapter(adapter_name)(config, filename)
+    update_local_data(config, False, ctx.date, get_storage_from_config(config), adapter)
+
+
+@scenario('import_csv')
+def bench_import_csv(ctx):
+    bench_import(ctx, 'csv', ctx.csv_filename)
+
+
+@scenario('import_ofx')
+def bench_import_ofx(ctx):
+    bench_import(ctx, 'ofx', ctx.ofx_filename)
+
+
+def web_routes(ctx):
+    # (name, path, whether the route uses the view cache)
+    year, month = ctx.date.year, ctx.date.month
+    return [
+        ('index', '/', True),
+        ('month', '/%s/%s' % (year, month), True),
+        ('year', '/%s' % year, True),
+        ('income', '/%s/income' % year, True),
+        ('planned_expenses', '/%s/planned-expenses' % year, True),
+        ('category', '/%s/categories/%s' % (year, ctx.config.categories[0].name), True),
+        ('goal', '/%s/goals/%s' % (year, ctx.config.budget_goals[0].label), True),
+        ('budget_json', '/%s/%s/budget.json' % (year, month), False),
+        ('transactions_json', '/%s/%s/transactions.json' % (year, month), False),
+        ('transactions_csv', '/%s/%s/transactions.csv' % (year, month), False),
+        ('export', '/export?start=%s&end=%s' % (ctx.date.replace(month=1), ctx.date), False),
+        ('settings', '/settings', False)
+    ]
+
+
+def make_web_scenario(path, cached):
+    def bench(ctx):
+        from budgettracker import web
+        if not cached:
+            for ledger in web.ledgers.ledgers.values():
+                ledger.invalidate_view_cache()
+        response = ctx.web_client.get(path)
+        response.get_data()
+        if response.status_code != 200:
+            raise Exception("%s returned %s" % (path, response.status_code))
+    return bench
+
+
+def add_web_scenarios(ctx):
+    # the web module loads its ledger on import, BUDGET_CONFIG must point to the generated one first
+    from budgettracker.web import app
+    ctx.web_client = app.test_client()
+    for name, path, cached in web_routes(ctx):
+        scenarios.append(('web_%s' % name, make_web_scenario(path, False)))
+        if cached:
+            scenarios.append(('web_%s_cached' % name, make_web_scenario(path, True)))
+
+
+def run_scenario(func, ctx, repeat):
+    func(ctx) # warm up
+    timings = []
+    for i in range(repeat):
+        start = default_timer()
+        func(ctx)
+        timings.append(default_timer() - start)
+    timings.sort()
+    return {
+        'repeat': repeat,
+        'min': timings[0],
+        'max': timings[-1],
+        'mean': sum(timings) / len(timings),
+        'median': timings[len(timings) // 2]
+    }
+
+
+def get_git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.STDOUT).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(directory, params, repeat=5, filter=None):
+    config_filename = generate_ledger(directory, params['years'], params['transactions'],
+        params['accounts'], params['storage'])
+    os.environ['BUDGET_CONFIG'] = config_filename
+    ctx = Context(directory, config_filename, params)
+    add_web_scenarios(ctx)
+
+    results = {}
+    for name, func in scenarios:
+        if filter and not re.search(filter, name):
+            continue
+        try:
+            results[name] = run_scenario(func, ctx, repeat)
+        except Exception as e:
+            traceback.print_exc()
+            results[name] = {'error': '%s: %s' % (e.__class__.__name__, e)}
+        print >>sys.stderr, '%-45s %s' % (name, '%.2fms' % (results[name]['median'] * 1000)
+            if 'median' in results[name] else results[name]['error'])
+
+    return {
+        'commit': get_git_commit(),
+        'python': platform.python_version(),
+        'date': datetime.datetime.now().isoformat(),
+        'params': dict(params, repeat=repeat),
+        'results': results
+    }
+
+
+def main():
+    kwargs, args = getopt(sys.argv[1:], '', ['years=', 'transactions=', 'accounts=', 'storage=',
+        'repeat=', 'filter=', 'dir=', 'output='])
+    kwargs = dict((k.strip('-'), v) for k, v in kwargs)
+    params = {
+        'years': int(kwargs.get('years', 2)),
+        'transactions': int(kwargs.get('transactions', 200)),
+        'accounts': int(kwargs.get('accounts', 3)),
+        'storage': kwargs.get('storage', 'csv')
+    }
+
+    directory = kwargs.get('dir') or tempfile.mkdtemp(prefix='budgettracker-bench-')
+    try:
+        report = run(directory, params, int(kwargs.get('repeat', 5)), kwargs.get('filter'))
+    finally:
+        if not kwargs.get('dir'):
+            shutil.rmtree(directory, ignore_errors=True)
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if kwargs.get('output'):
+        with open(kwargs['output'], 'w') as f:
+            f.write(output)
+    else:
+        print output
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,247 @@
+from .config import compile_config, get_config_hash
+from .budget import filter_period
+from .notifications import notify_using_config, digest
+from monthdelta import monthdelta
+import datetime, copy, re
+
+
+# config keys the running totals depend on. when one of them changes, totals are rebuilt
+BUDGET_CONFIG_KEYS = ['income_sources', 'planned_expenses', 'budget_goals', 'categories',
+                      'inter_account_labels_out', 'inter_account_labels_in', 'income_delay']
+
+KINDS = ('income', 'planned_expenses', 'expenses')
+
+
+def get_budget_config_hash(config):
+    return get_config_hash(config, BUDGET_CONFIG_KEYS)
+
+
+def get_transaction_signature(tx):
+    return u"%s|%s|%s|%s" % (tx.date.isoformat(), tx.amount, tx.label, u",".join(sorted(tx.categories or [])))
+
+
+def compute_expected_remaining(budget):
+    # same as budgetize_month()
+    expected_savings = max(budget['income'], budget['expected_income']) - budget['expected_planned_expenses'] - budget['expenses']
+    return max(expected_savings - budget['savings_goal'], 0)
+
+
+class AlertEngine(object):
+    # keeps running totals of the budgets of the current and previous months (income, planned
+    # expenses, expenses and amounts per category) in the storage state. each evaluation only
+    # applies what changed since the previous one, then rules compare totals before and after.
+    # the first evaluation (or the first after a budget related config change) only builds the
+    # totals from storage. syncs build them before writing anything (see prepare_budget_alerts())
+    # so that their own changes are still reported
+    def __init__(self, config, storage, today=None):
+        self.config = compile_config(config)
+        self.storage = storage
+        self.current_month = (today or datetime.date.today()).replace(day=1)
+        self.tracked_months = [self.current_month - monthdelta(1), self.current_month]
+        self.alerts = []
+        self.new_transactions = []
+        self.budgets_before = {}
+        self.categories_before = {}
+        self.planned_expenses_labels = {}
+        self.rebuilt = False
+
+        config_hash = get_budget_config_hash(self.config)
+        self.state = storage.load_state('alerts')
+        if self.state.get('config_hash') != config_hash:
+            self.state = {'config_hash': config_hash, 'months': {}, 'budgets': {}, 'accounts': None}
+            for date in self.tracked_months:
+                self.update_month(date, storage.load_monthly_transactions(date))
+            self.state['accounts'] = {acc.id: acc.amount for acc in storage.load_accounts()}
+            self.new_transactions = []
+            self.budgets_before = {}
+            self.categories_before = {}
+            self.rebuilt = True
+
+        # older months are dropped, transactions of the tracked months counted in them are kept untracked
+        tracked = [date.isoformat() for date in self.tracked_months]
+        for key in ('months', 'budgets'):
+            self.state[key] = {k: v for k, v in self.state[key].items() if k in tracked}
+        for month in self.state['months'].values():
+            for record in month['transactions'].values():
+                if record['month'] not in tracked:
+                    record.update(kind='untracked', transfer=None)
+
+    def get_budget(self, month):
+        key = month.isoformat()
+        if key not in self.state['budgets']:
+            # expected income and planned expenses only depend on the config, they are computed once per month
+            from .helpers import load_monthly_budget_from_config
+            budget = load_monthly_budget_from_config(self.config, month, self.storage)
+            self.state['budgets'][key] = {'income': 0, 'planned_expenses': 0, 'expenses': 0, 'transfers': {},
+                'expected_income': budget.expected_income, 'savings_goal': budget.savings_goal,
+                'expected_planned_expenses': budget.expected_planned_expenses}
+        if key not in self.budgets_before:
+            self.budgets_before[key] = copy.deepcopy(self.state['budgets'][key])
+        return self.state['budgets'][key]
+
+    def compute_savings_goal(self, month):
+        # what goals still need moves with the savings of every month, it is computed again on each
+        # evaluation (past months of goals are checkpointed, see goals.py)
+        from .goals import compute_yearly_budget_goals
+        if not self.config.budget_goals:
+            return 0
+        goals, _ = compute_yearly_budget_goals(self.config, month, self.storage)
+        return sum([g.savings_per_month for g in filter_period(goals, month, month + monthdelta(1))])
+
+    def get_budget_month(self, tx):
+        if tx.amount > 0 and self.config.get('income_delay'):
+            return (tx.date - datetime.timedelta(days=self.config['income_delay'])).replace(day=1)
+        return tx.date.replace(day=1)
+
+    def match_transfer(self, label):
+        if not self.config.inter_account_labels_out:
+            return None
+        for direction, regexp in (('out', self.config.inter_account_labels_out), ('in', self.config.inter_account_labels_in)):
+            m = re.match(regexp, label)
+            if m:
+                return [m.group('id'), direction]
+
+    def classify(self, record):
+        if record['amount'] > 0:
+            return 'income'
+        month = record['month']
+        if month not in self.planned_expenses_labels:
+            start_date = datetime.datetime.strptime(month, '%Y-%m-%d').date()
+            self.planned_expenses_labels[month] = [exp.match for exp in filter_period(
+                self.config.planned_expenses, start_date, start_date + monthdelta(1)) if exp.match]
+        for label in self.planned_expenses_labels[month]:
+            if re.match(label, record['label']):
+                return 'planned_expenses'
+        return 'expenses'
+
+    def count(self, record, sign):
+        if record['kind'] in KINDS:
+            self.state['budgets'][record['month']][record['kind']] += sign * abs(record['amount'])
+
+    def get_record(self, location):
+        if location:
+            return self.state['months'].get(location[0], {}).get('transactions', {}).get(location[1])
+
+    def add(self, month, tx):
+        budget_month = self.get_budget_month(tx)
+        record = {'month': budget_month.isoformat(), 'label': tx.label, 'amount': tx.amount, 'kind': None,
+                  'categories': sorted(tx.categories or []), 'transfer': self.match_transfer(tx.label),
+                  'signature': get_transaction_signature(tx)}
+        if budget_month not in self.tracked_months:
+            # eg. income of an older month received during the income delay
+            record.update(kind='untracked', transfer=None)
+            return record
+        budget = self.get_budget(budget_month)
+        if record['transfer']:
+            # transfers between accounts are ignored once both sides are known
+            ref, direction = record['transfer']
+            pair = budget['transfers'].setdefault(ref, {})
+            pair[direction] = [month, tx.id]
+            other_record = self.get_record(pair.get('in' if direction == 'out' else 'out'))
+            if other_record:
+                self.count(other_record, -1)
+                other_record['kind'] = record['kind'] = 'transfer'
+        if not record['kind']:
+            record['kind'] = self.classify(record)
+        self.count(record, 1)
+        return record
+
+    def remove(self, month, id):
+        record = self.state['months'][month]['transactions'].pop(id)
+        if record['kind'] == 'untracked':
+            return record
+        self.get_budget(datetime.datetime.strptime(record['month'], '%Y-%m-%d').date())
+        self.count(record, -1)
+        if record['transfer']:
+            ref, direction = record['transfer']
+            pair = self.state['budgets'][record['month']]['transfers'].get(ref, {})
+            pair.pop(direction, None)
+            other_record = self.get_record(pair.get('in' if direction == 'out' else 'out'))
+            if other_record and record['kind'] == 'transfer':
+                other_record['kind'] = self.classify(other_record)
+                self.count(other_record, 1)
+        return record
+
+    def count_categories(self, month, record, sign):
+        if record['amount'] >= 0:
+            return
+        categories = self.state['months'][month]['categories']
+        for name in record['categories']:
+            categories[name] = categories.get(name, 0) + sign * abs(record['amount'])
+
+    def update_month(self, date, transactions):
+        # applies the difference between the transactions of a month and the ones of the previous evaluation
+        date = date.replace(day=1)
+        if date not in self.tracked_months:
+            return
+        key = date.isoformat()
+        month = self.state['months'].setdefault(key, {'transactions': {}, 'categories': {}})
+        if key not in self.categories_before:
+            self.categories_before[key] = dict(month['categories'])
+        records = month['transactions']
+        ids = set()
+        for tx in transactions:
+            ids.add(tx.id)
+            record = records.get(tx.id)
+            if record and record['signature'] == get_transaction_signature(tx):
+                continue
+            if record:
+                self.count_categories(key, self.remove(key, tx.id), -1)
+            else:
+                self.new_transactions.append(tx)
+            records[tx.id] = self.add(key, tx)
+            self.count_categories(key, records[tx.id], 1)
+        for id in set(records) - ids:
+            self.count_categories(key, self.remove(key, id), -1)
+
+    def update_accounts(self, accounts):
+        thresholds = self.config.get('notify_balance')
+        previous = self.state['accounts'] or {}
+        for acc in accounts:
+            threshold = thresholds.get(acc.id) if isinstance(thresholds, dict) else thresholds
+            if threshold is not None and acc.id in previous and previous[acc.id] >= threshold > acc.amount:
+                self.alerts.append('BUDGET: /!\ LOW BALANCE: %s (%s)' % (acc.title, acc.amount))
+        self.state['accounts'] = {acc.id: acc.amount for acc in accounts}
+
+    def evaluate(self):
+        key = self.current_month.isoformat()
+        budget = self.state['budgets'].get(key)
+        before = self.budgets_before.get(key)
+        if budget:
+            # compared to the savings goal of the previous evaluation
+            budget['savings_goal'] = self.compute_savings_goal(self.current_month)
+        if budget and before:
+            prev_remaining = compute_expected_remaining(before)
+            remaining = compute_expected_remaining(budget)
+            if self.config.get('notify_remaining') and prev_remaining > self.config['notify_remaining'] and remaining <= self.config['notify_remaining']:
+                self.alerts.append('BUDGET: /!\ LOW SAFE TO SPEND: %s' % remaining)
+            elif self.config.get('notify_delta') and (prev_remaining - remaining) > self.config['notify_delta']:
+                self.alerts.append('BUDGET: Remaining funds: %s' % remaining)
+
+        if key in self.categories_before:
+            amounts = self.state['months'][key]['categories']
+            for category in self.config.categories:
+                amount = amounts.get(category.name, 0)
+                # only categories which grew since the previous evaluation are reported
+                if category.warning_threshold and amount > category.warning_threshold \
+                  and amount > self.categories_before[key].get(category.name, 0):
+                    self.alerts.append('BUDGET: /!\ CATEGORY WARNING: %s (%s / %s)' % (
+                        category.name, amount, category.warning_threshold))
+
+        if self.config.get('notify_large_transaction'):
+            for tx in self.new_transactions:
+                if tx.date.replace(day=1) == self.current_month and tx.amount < 0 \
+                  and abs(tx.amount) >= self.config['notify_large_transaction']:
+                    self.alerts.append('BUDGET: LARGE TRANSACTION: %s (%s)' % (tx.label, tx.amount))
+        return self.alerts
+
+    def save(self):
+        self.storage.save_state('alerts', self.state)
+
+    def notify(self):
+        alerts = self.evaluate()
+        self.save()
+        with digest(self.config):
+            for message in alerts:
+                notify_using_config(self.config, message)
+        return alerts
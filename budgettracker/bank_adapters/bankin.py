@@ -8,15 +8,19 @@ BANKIN_URL = 'https://bankin.com'
 
 class BankinAdapter(BankAdapter):
     name = 'Bankin'
-    fetch_style = 'web'
+    fetch_type = 'web'
+
+    @property
+    def url(self):
+        return self.config.get('bankin_url', BANKIN_URL)
 
     def login(self, session):
-        r = session.get(BANKIN_URL + '/inscription?login=true')
+        r = session.get(self.url + '/inscription?login=true')
         r.raise_for_status()
         html = bs4.BeautifulSoup(r.text, "html.parser")
         token = html.select('#login > input[name="authenticityToken"]')[0].get('value')
 
-        r = session.post(BANKIN_URL + '/Application/authenticate', data={
+        r = session.post(self.url + '/Application/authenticate', data={
             'email': self.config.get('bankin_email', ''),
             'password': self.config.get('bankin_password', ''),
             'authenticityToken': token
@@ -26,7 +30,7 @@ class BankinAdapter(BankAdapter):
 
     def fetch_accounts(self):
         session = self.create_request_session()
-        r = session.get(BANKIN_URL + '/Accounts/index')
+        r = session.get(self.url + '/Accounts/index')
         r.raise_for_status()
         html = bs4.BeautifulSoup(r.text, "html.parser")
         accounts = html.select('#contenu > .listecomptes > .scroool > p.on > span.item')
@@ -35,24 +39,26 @@ class BankinAdapter(BankAdapter):
                           title=unicode(span.select('span.bankAccount')[0].string),
                           amount=float(unicode(span.select('span.bankAmount')[0].string).strip(u' €').replace(u' ', u'')))
 
-    def fetch_transactions(self, account, start_date=None, end_date=None):
+    def fetch_transactions(self, account, start_date=None, end_date=None, watermark=None):
         session = self.create_request_session()
-        fetch_from = 0
-        fetch_incr = 50
         fetch_more = True
         transactions = []
         current_year = datetime.date.today().year
         month_mapping = ['JAN', 'FEV', 'MAR', 'AVR', 'MAI', 'JUIN',
                          'JUIL', 'AOUT', 'SEPT', 'OCT', 'NOV', 'DEC']
 
-        while fetch_more:
-            r = session.post(BANKIN_URL + '/AccountsAjax/listTransactions', data={
+        def fetch_page(offset, limit):
+            r = session.post(self.url + '/AccountsAjax/listTransactions', data={
                 'accountId': account.id,
-                'from': fetch_from,
-                'to': fetch_from + fetch_incr
+                'from': offset,
+                'to': offset + limit
             })
             r.raise_for_status()
-            html = bs4.BeautifulSoup(r.text, "html.parser")
+            return r.text
+
+        pages = self.iter_pages(fetch_page, 50)
+        for page in pages:
+            html = bs4.BeautifulSoup(page, "html.parser")
             items = html.find_all('div', recursive=False)
 
             if len(items) == 1 and items[0].get('align') == 'center':
@@ -69,7 +75,7 @@ class BankinAdapter(BankAdapter):
                     date_year = current_year
                 date = datetime.date(date_year, date_month, date_day)
 
-                if start_date and start_date > date:
+                if (start_date and start_date > date) or (watermark and watermark.last_date > date):
                     fetch_more = False
                     break
                 if end_date and end_date <= date:
@@ -82,6 +88,8 @@ class BankinAdapter(BankAdapter):
                     amount=float(unicode(tx.select('p.price > span')[0].string).strip(u' €').replace(u' ', u'')),
                     account=account.id))
 
-            fetch_from += fetch_incr
+            if not fetch_more:
+                break
 
+        pages.close()
         return transactions
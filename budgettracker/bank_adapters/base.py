@@ -1,7 +1,12 @@
-import json, requests, os, time, uuid, re, inspect
+import json, os, time, re, inspect, threading
 from importlib import import_module
-from ..data import Account, Transaction
-from ..categories import Category, match_categories
+from multiprocessing.pool import ThreadPool
+from collections import deque
+from ..data import Account, Transaction, make_transaction_hash
+from ..categories import match_compiled_categories
+from ..config import compile_config
+from .. import instrumentation
+import _strptime # datetime.strptime() is not thread safe until this module has been imported
 
 
 def get_bank_adapter(name):
@@ -17,41 +22,115 @@ class BankAdapter(object):
     def __init__(self, config, filename=None):
         self.config = config
         self.filename = filename
+        self.request_session_lock = threading.Lock()
+        self.transaction_hashes = {}
+
+    @property
+    def max_workers(self):
+        return self.config.get('bank_adapter_max_workers', 4)
 
     @property
     def categories(self):
-        if not self.__dict__.get('categories'):
-            self.__dict__['categories'] = map(Category.from_dict, self.config.get('categories', []))
-        return self.__dict__['categories']
+        return compile_config(self.config).categories
+
+    @property
+    def category_matchers(self):
+        if self.__dict__.get('category_matchers') is None:
+            self.__dict__['category_matchers'] = compile_config(self.config).category_matchers
+        return self.__dict__['category_matchers']
 
-    def fetch_transactions_from_all_accounts(self, start_date=None, end_date=None):
+    @instrumentation.timed('adapter_fetch')
+    def fetch_transactions_from_all_accounts(self, start_date=None, end_date=None, watermarks=None):
+        # watermarks (per account id) allow adapters to stop fetching once they reach known transactions
+        accounts = list(self.fetch_accounts())
+        fetch = lambda account: self.fetch_transactions(account, start_date, end_date,
+            (watermarks or {}).get(account.id))
+        if self.fetch_type == 'web':
+            # accounts are fetched concurrently as web adapters mostly wait on the network
+            results = self.map_concurrently(fetch, accounts)
+        else:
+            results = map(fetch, accounts)
         transactions = []
-        for account in self.fetch_accounts():
-            transactions.extend(self.fetch_transactions(account, start_date, end_date))
+        for account_transactions in results:
+            transactions.extend(account_transactions)
         return sorted(transactions, key=lambda i: i.date, reverse=True)
 
+    def fetch_monthly_transactions(self, start_date=None, end_date=None):
+        # yields (month, transactions) in chronological order. adapters which can
+        # partition their source by month while reading it should override this
+        months = {}
+        for tx in self.fetch_transactions_from_all_accounts(start_date, end_date):
+            months.setdefault(tx.date.replace(day=1), []).append(tx)
+        for month, transactions in sorted(months.items()):
+            yield month, transactions
+
+    def map_concurrently(self, func, items, max_workers=None):
+        items = list(items)
+        workers = min(max_workers or self.max_workers, len(items))
+        if workers <= 1:
+            return map(func, items)
+        pool = ThreadPool(workers)
+        try:
+            return pool.map(func, items)
+        finally:
+            pool.close()
+
+    def iter_pages(self, fetch_page, page_size, page_ahead=None):
+        # yields fetch_page(offset, limit) for consecutive pages until the generator is closed.
+        # with page_ahead, that many pages are fetched concurrently ahead of the consumed one
+        if page_ahead is None:
+            page_ahead = self.config.get('bank_adapter_page_ahead', 0)
+        offset = 0
+        if not page_ahead:
+            while True:
+                yield fetch_page(offset, page_size)
+                offset += page_size
+
+        pool = ThreadPool(page_ahead)
+        pending = deque()
+        try:
+            while True:
+                while len(pending) < page_ahead:
+                    pending.append(pool.apply_async(fetch_page, (offset, page_size)))
+                    offset += page_size
+                yield pending.popleft().get()
+        finally:
+            pool.terminate()
+
     def create_request_session(self, reuse=True, filename='session.json'):
-        if reuse and getattr(self, 'request_session_cache', None):
-            return self.request_session_cache
-
-        session = requests.Session()
-        exp = time.time() - 1800 # cookie jar expires after 30min
-        if reuse and os.path.exists(filename) and os.path.getmtime(filename) > exp:
-            with open(filename) as f:
-                cookies = json.load(f)
-            session.cookies.update(cookies)
-        else:
-            self.login(session)
-            with open(filename, 'w') as f:
-                json.dump(session.cookies.get_dict(), f)
+        with self.request_session_lock:
+            if reuse and getattr(self, 'request_session_cache', None):
+                return self.request_session_cache
+
+            import requests
+            session = requests.Session()
+            # a single pooled session is shared by all the threads fetching accounts and pages
+            http_adapter = requests.adapters.HTTPAdapter(pool_maxsize=max(self.max_workers,
+                self.config.get('bank_adapter_page_ahead', 0), 1))
+            session.mount('http://', http_adapter)
+            session.mount('https://', http_adapter)
 
-        self.request_session_cache = session
-        return session
+            exp = time.time() - 1800 # cookie jar expires after 30min
+            if reuse and os.path.exists(filename) and os.path.getmtime(filename) > exp:
+                with open(filename) as f:
+                    cookies = json.load(f)
+                session.cookies.update(cookies)
+            else:
+                self.login(session)
+                with open(filename, 'w') as f:
+                    json.dump(session.cookies.get_dict(), f)
+
+            self.request_session_cache = session
+            return session
 
     def make_transaction(self, **kwargs):
-        if not kwargs.get('id'):
-            kwargs['id'] = str(uuid.uuid4())
         kwargs['label'] = re.sub("\s+", " ", kwargs['label'].replace("\n", " ").strip())
-        kwargs.setdefault('categories', match_categories(self.categories, kwargs['label']))
+        if not kwargs.get('id'):
+            # deterministic ids so that re-importing the same source does not duplicate transactions.
+            # identical rows are told apart by their occurrence number in the source
+            content_hash = make_transaction_hash(kwargs['account'], kwargs['date'], kwargs['amount'], kwargs['label'])
+            occurrence = self.transaction_hashes[content_hash] = self.transaction_hashes.get(content_hash, 0) + 1
+            kwargs['id'] = content_hash if occurrence == 1 else '%s-%d' % (content_hash, occurrence)
+        kwargs.setdefault('categories', match_compiled_categories(self.category_matchers, kwargs['label']))
         kwargs.setdefault('goal', None)
         return Transaction(**kwargs)
\ No newline at end of file
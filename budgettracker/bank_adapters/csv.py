@@ -1,38 +1,58 @@
 from base import *
-import re, unicodecsv, uuid, datetime, codecs
+from monthdelta import monthdelta
+import re, unicodecsv, datetime, codecs
 
 
 class CSVAdapter(BankAdapter):
     name = 'CSV'
 
     def parse_csv(self):
-        if not getattr(self, 'csv', None):
+        # single pass over the file: transactions are partitioned by account and month
+        # and account balances are computed at the same time
+        if getattr(self, 'partitions', None) is None:
+            partitions = {}
+            balances = {}
+            dates = {}
             with codecs.open(self.filename) as f:
-                self.csv = list(unicodecsv.reader(f))
-        return self.csv
+                for row in unicodecsv.reader(f):
+                    account = str(row[4])
+                    amount = float(row[3])
+                    if row[2] not in dates:
+                        dates[row[2]] = datetime.datetime.strptime(row[2], '%Y-%m-%d').date()
+                    date = dates[row[2]]
+                    balances[account] = balances.get(account, 0) + amount
+                    partitions.setdefault((account, date.replace(day=1)), []).append(self.make_transaction(
+                        id=row[0].strip(),
+                        label=row[1],
+                        date=date,
+                        amount=amount,
+                        account=account))
+            self.partitions = partitions
+            self.balances = balances
+        return self.partitions
 
     def fetch_accounts(self):
-        accounts = {}
-        for row in self.parse_csv():
-            accounts.setdefault(str(row[4]), 0)
-            accounts[str(row[4])] += float(row[3])
-
-        for id, balance in accounts.items():
+        self.parse_csv()
+        for id, balance in self.balances.items():
             yield Account(id=id, title=id, amount=balance)
 
-    def fetch_transactions(self, account, start_date=None, end_date=None):
+    def fetch_transactions(self, account, start_date=None, end_date=None, watermark=None):
         transactions = []
-        for row in self.parse_csv():
-            if row[4] != account.id:
+        for (account_id, month), month_transactions in self.parse_csv().items():
+            if account_id != account.id:
                 continue
-            date = datetime.datetime.strptime(row[2], '%Y-%m-%d')
-            if (start_date and start_date > date) or (end_date and end_date <= date):
+            if (start_date and month + monthdelta(1) <= start_date) or (end_date and end_date <= month):
                 continue
-            transactions.append(self.make_transaction(
-                id=row[0].strip(),
-                label=row[1],
-                date=date,
-                amount=float(row[3]),
-                account=row[4]))
-
+            transactions.extend(tx for tx in month_transactions
+                if not (start_date and start_date > tx.date) and not (end_date and end_date <= tx.date))
         return transactions
+
+    def fetch_monthly_transactions(self, start_date=None, end_date=None):
+        months = {}
+        for (account_id, month), month_transactions in self.parse_csv().items():
+            months.setdefault(month, []).extend(month_transactions)
+        for month, transactions in sorted(months.items()):
+            transactions = [tx for tx in transactions
+                if not (start_date and start_date > tx.date) and not (end_date and end_date <= tx.date)]
+            if transactions:
+                yield month, sorted(transactions, key=lambda tx: tx.date, reverse=True)
@@ -1,5 +1,6 @@
 from base import *
-from ..data import update_accounts, update_transactions
+from ..data import update_accounts, deduplicate_transactions, filter_transactions_period
+import datetime
 
 
 class MultiAdapter(BankAdapter):
@@ -7,8 +8,15 @@ class MultiAdapter(BankAdapter):
 
     @property
     def adapters(self):
-        for name in self.config.get('bank_adapters', []):
-            yield get_bank_adapter(name)(self.config, self.filename)
+        # instances are kept so that sessions and parsed files are reused between calls
+        if self.__dict__.get('adapters') is None:
+            self.__dict__['adapters'] = [get_bank_adapter(name)(self.config, self.filename)
+                for name in self.config.get('bank_adapters', [])]
+        return self.__dict__['adapters']
+
+    @property
+    def dedup_window(self):
+        return self.config.get('bank_adapters_dedup_days', 3)
 
     @property
     def fetch_type(self):
@@ -19,12 +27,27 @@ class MultiAdapter(BankAdapter):
 
     def fetch_accounts(self):
         accounts = []
-        for adapter in self.adapters:
-            accounts = update_accounts(accounts, list(adapter.fetch_accounts()))
+        for adapter_accounts in self.map_concurrently(lambda a: list(a.fetch_accounts()), self.adapters):
+            accounts = update_accounts(accounts, adapter_accounts)
         return accounts
 
-    def fetch_transactions(self, account, start_date=None, end_date=None):
-        transactions = []
-        for adapter in self.adapters:
-            transactions = update_transactions(transactions, adapter.fetch_transactions(account, start_date, end_date))
-        return transactions
\ No newline at end of file
+    @instrumentation.timed('adapter_fetch')
+    def fetch_transactions_from_all_accounts(self, start_date=None, end_date=None, watermarks=None):
+        # each adapter fetches all its accounts at once, the adapters being queried in parallel
+        start, end = self.widen_period(start_date, end_date)
+        results = self.map_concurrently(lambda a: a.fetch_transactions_from_all_accounts(
+            start, end, watermarks), self.adapters)
+        return sorted(filter_transactions_period(deduplicate_transactions(results, self.dedup_window),
+            start_date, end_date), key=lambda i: i.date, reverse=True)
+
+    def fetch_transactions(self, account, start_date=None, end_date=None, watermark=None):
+        start, end = self.widen_period(start_date, end_date)
+        results = self.map_concurrently(lambda a: list(a.fetch_transactions(
+            account, start, end, watermark)), self.adapters)
+        return filter_transactions_period(deduplicate_transactions(results, self.dedup_window), start_date, end_date)
+
+    def widen_period(self, start_date, end_date):
+        # duplicates may be dated on both sides of a bound of the period, they are fetched
+        # as well and the period is only cut once duplicates are dropped
+        window = datetime.timedelta(days=self.dedup_window)
+        return start_date and start_date - window, end_date and end_date + window
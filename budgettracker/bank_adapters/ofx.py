@@ -1,12 +1,125 @@
 from base import *
-from ofxparse import OfxParser
-import codecs, re
+from HTMLParser import HTMLParser
+from decimal import Decimal, InvalidOperation
+import codecs, re, datetime
+
+
+def get_ofx_encoding(head):
+    # same rules as ofxparse, based on the SGML headers (OFX 2 XML files have none)
+    headers = {}
+    end = head.find('<')
+    for line in (head[:end] if end > -1 else head).splitlines():
+        if ':' in line:
+            key, value = line.split(':', 1)
+            headers[key.strip().upper()] = value.strip()
+    if headers.get('ENCODING') == 'USASCII':
+        charset = headers.get('CHARSET', '1252')
+        return 'iso-8859-1' if charset == '8859-1' else 'cp%s' % charset
+    return 'utf-8'
+
+
+def iter_ofx_elements(f, chunk_size=65536):
+    # yields (TAG, text) for every tag of an OFX file (SGML or XML) while reading it, closing tags
+    # as /TAG. text is the unescaped content between the tag and the next one
+    head = f.read(max(chunk_size, 10240)) # like ofxparse, headers are looked for in the first 10KB
+    decoder = codecs.getincrementaldecoder(get_ofx_encoding(head))('replace')
+    unescape = HTMLParser().unescape
+    buffer = decoder.decode(head)
+    while True:
+        chunk = f.read(chunk_size)
+        if chunk:
+            buffer += decoder.decode(chunk)
+            # the end of the buffer may contain an incomplete tag or text, it is kept for the next round
+            end = buffer.rfind('<')
+            if end <= 0:
+                continue
+        else:
+            buffer += decoder.decode('', True)
+            end = len(buffer)
+        # the first token is what precedes the first tag (the headers or nothing)
+        tokens = re.split(r'(?i)<(/?[a-z0-9_.]+)>', buffer[:end])
+        buffer = buffer[end:]
+        for i in range(1, len(tokens) - 1, 2):
+            text = tokens[i + 1].strip()
+            yield tokens[i].upper(), unescape(text) if '&' in text else text
+        if not chunk:
+            break
+
+
+def iter_ofx_statements(f):
+    # yields ('transaction', account, fields) for each STMTTRN as soon as it has been read and
+    # ('account', account, None) at the end of each statement. account is a dict with id, type
+    # and balance (only known at the end of the statement). like ofxparse, fields holds the
+    # first value of each tag found in the transaction (lowercased tag names)
+    account = transaction = None
+    in_ledgerbal = False
+    for tag, text in iter_ofx_elements(f):
+        if tag in ('STMTRS', 'CCSTMTRS'):
+            account = {'id': '', 'type': '', 'balance': None}
+        elif account is None:
+            continue
+        elif tag == 'STMTTRN':
+            transaction = {}
+        elif tag == '/STMTTRN':
+            if transaction is not None:
+                yield 'transaction', account, transaction
+            transaction = None
+        elif transaction is not None:
+            if not tag.startswith('/'):
+                transaction.setdefault(tag.lower(), text)
+        elif tag == 'LEDGERBAL':
+            in_ledgerbal = True
+        elif tag == '/LEDGERBAL':
+            in_ledgerbal = False
+        elif tag == 'BALAMT' and in_ledgerbal and account['balance'] is None:
+            account['balance'] = text
+        elif tag == 'ACCTID' and not account['id']:
+            account['id'] = text
+        elif tag == 'ACCTTYPE' and not account['type']:
+            account['type'] = text
+        elif tag in ('/STMTRS', '/CCSTMTRS'):
+            yield 'account', account, None
+            account = None
+
+
+def parse_ofx_amount(value):
+    # same rules as ofxparse for the different number formats
+    if re.search(r'.*\..*,', value):
+        value = value.replace('.', '')
+    if re.search(r'.*,.*\.', value):
+        value = value.replace(',', '')
+    if '.' not in value and ',' in value:
+        value = value.replace(',', '.')
+    value = value.replace(' ', '').replace('+', '')
+    try:
+        return Decimal(value)
+    except InvalidOperation:
+        if value in ('null', '-null'):
+            return Decimal(0)
+        raise
+
+
+def parse_ofx_datetime(value):
+    # same rules as ofxparse: the optional [offset:TZ] suffix is used to convert to UTC
+    m = re.search(r"\[(?P<tz>[-+]?\d+\.?\d*)\:\w*\]$", value)
+    offset = datetime.timedelta(hours=float(m.group('tz')) if m else 0)
+    m = re.search(r"^[0-9]*\.([0-9]{0,5})", value)
+    msec = datetime.timedelta(seconds=float("0." + m.group(1)) if m else 0)
+    try:
+        return datetime.datetime.strptime(value[:14], '%Y%m%d%H%M%S') - offset + msec
+    except ValueError:
+        return datetime.datetime.strptime(value[:8], '%Y%m%d') - offset + msec
 
 
 class OFXAdapter(BankAdapter):
     name = 'OFX'
 
+    @property
+    def use_ofxparse(self):
+        return self.config.get('ofx_parser', 'streaming') == 'ofxparse'
+
     def parse_ofx(self):
+        from ofxparse import OfxParser
         if not getattr(self, 'ofx', None):
             with codecs.open(self.filename) as f:
                 self.ofx = OfxParser.parse(f)
@@ -17,13 +130,57 @@ class OFXAdapter(BankAdapter):
             if account.account_id == account_id:
                 return account
 
+    def read_statements(self, start_date=None, end_date=None, account_id=None, with_transactions=True):
+        # single streaming pass over the file. transactions outside of the period are
+        # dropped as soon as they are read so that memory does not depend on the file size
+        accounts = []
+        transactions = []
+        dates = {}
+        with open(self.filename, 'rb') as f:
+            for event, account, fields in iter_ofx_statements(f):
+                if event == 'account':
+                    accounts.append(Account(id=str(account['id']),
+                                            title="%s %s" % (account['type'], account['id']),
+                                            amount=float(parse_ofx_amount(account['balance'] or '0'))))
+                    continue
+                if not with_transactions or (account_id is not None and account['id'] != account_id):
+                    continue
+                if fields['dtposted'] not in dates:
+                    dates[fields['dtposted']] = parse_ofx_datetime(fields['dtposted']).date()
+                date = dates[fields['dtposted']]
+                if (start_date and start_date > date) or (end_date and end_date <= date):
+                    continue
+                transactions.append(self.make_transaction(
+                    id=str(fields['fitid']),
+                    label="%s %s" % (fields.get('name', ''), fields.get('memo', '')),
+                    date=date,
+                    amount=float(parse_ofx_amount(fields['trnamt'])),
+                    account=str(account['id'])))
+        self.accounts = accounts
+        return accounts, transactions
+
     def fetch_accounts(self):
-        for account in self.parse_ofx().accounts:
-            yield Account(id=str(account.account_id),
-                          title="%s %s" % (account.account_type, account.account_id),
-                          amount=float(account.statement.balance))
+        if self.use_ofxparse:
+            return [Account(id=str(account.account_id),
+                            title="%s %s" % (account.account_type, account.account_id),
+                            amount=float(account.statement.balance))
+                    for account in self.parse_ofx().accounts]
+        if getattr(self, 'accounts', None) is None:
+            self.read_statements(with_transactions=False)
+        return self.accounts
+
+    @instrumentation.timed('adapter_fetch')
+    def fetch_transactions_from_all_accounts(self, start_date=None, end_date=None, watermarks=None):
+        if self.use_ofxparse:
+            return super(OFXAdapter, self).fetch_transactions_from_all_accounts(start_date, end_date, watermarks)
+        # all the accounts are read in the same pass
+        _, transactions = self.read_statements(start_date, end_date)
+        return sorted(transactions, key=lambda i: i.date, reverse=True)
+
+    def fetch_transactions(self, account, start_date=None, end_date=None, watermark=None):
+        if not self.use_ofxparse:
+            return self.read_statements(start_date, end_date, account.id)[1]
 
-    def fetch_transactions(self, account, start_date=None, end_date=None):
         ofx_account = self.get_ofx_account(account.id)
         transactions = []
 
@@ -1,6 +1,7 @@
 from collections import namedtuple, OrderedDict
 from .data import (split_income_expenses, extract_transactions_by_label, filter_transactions_period,
                    sort_transactions, period_to_months)
+from . import instrumentation
 import datetime
 from monthdelta import monthdelta
 
@@ -232,28 +233,35 @@ class PlannedExpense(namedtuple('PlannedExpense', ['label', 'amount', 'recurrenc
         }
 
 
-class BudgetGoal(namedtuple('BudgetGoal', ['label', 'amount'])):
+class BudgetGoal(namedtuple('BudgetGoal', ['label', 'amount', 'from_date', 'to_date', 'priority', 'weight'])):
     @classmethod
     def from_dict(cls, dct):
-        return cls(label=dct['label'], amount=dct.get('amount'))
+        from_date = datetime.datetime.strptime(dct['from_date'], '%Y-%m-%d').date() if dct.get('from_date') else None
+        to_date = datetime.datetime.strptime(dct['to_date'], '%Y-%m-%d').date() if dct.get('to_date') else None
+        return cls(label=dct['label'], amount=dct.get('amount'), from_date=from_date, to_date=to_date,
+            priority=dct.get('priority'), weight=dct.get('weight'))
 
     @property
     def savings_per_month(self):
         if not self.amount:
             return 0
-        return self.amount / 12
+        return self.amount / count_goal_months(self)
 
     def to_dict(self):
         return {
             "label": self.label,
-            "amount": self.amount
+            "amount": self.amount,
+            "from_date": self.from_date.isoformat() if self.from_date else None,
+            "to_date": self.to_date.isoformat() if self.to_date else None,
+            "priority": self.priority,
+            "weight": self.weight
         }
 
 
-class ComputedBudgetGoal(namedtuple('ComputedBudgetGoal', ['label', 'target', 'saved', 'used'])):
+class ComputedBudgetGoal(namedtuple('ComputedBudgetGoal', ['label', 'target', 'saved', 'used', 'from_date', 'to_date'])):
     @classmethod
     def from_savings_goal(cls, goal, **kwargs):
-        return cls(label=goal.label, target=goal.amount or 0, **kwargs)
+        return cls(label=goal.label, target=goal.amount or 0, from_date=goal.from_date, to_date=goal.to_date, **kwargs)
 
     @property
     def completed_amount(self):
@@ -293,7 +301,7 @@ class ComputedBudgetGoal(namedtuple('ComputedBudgetGoal', ['label', 'target', 's
     def savings_per_month(self):
         if not self.target:
             return 0
-        return min(self.target / 12, self.remaining)
+        return min(self.target / count_goal_months(self), self.remaining)
 
     def to_str(self, famount):
         return "%s: %s / %s (%s%%) [used=%s saved=%s remaining=%s]" % (
@@ -302,7 +310,102 @@ class ComputedBudgetGoal(namedtuple('ComputedBudgetGoal', ['label', 'target', 's
             famount(self.remaining))
 
 
-def compute_budget_goals(budgets, budget_goals, debug=False):
+def count_goal_months(goal):
+    # goals with a start and an end date are spread over their period, others over a year
+    if goal.from_date and goal.to_date:
+        return len(period_to_months(goal.from_date, goal.to_date))
+    return 12
+
+
+def dispatch_savings(savings, goals, saved, used, _debug=lambda message: None):
+    # dispatches the savings of a month amongst goals in progress and returns (leftover, completed labels).
+    # goals of the highest priority are filled first. within a priority, each goal receives a share
+    # proportional to its weight until it completes and what it did not need goes to the others
+    # (water-filling). goals are sorted by remaining capacity so that this happens in a single pass.
+    # negative savings are taken back from all goals at once, a saved amount cannot go below 0
+    completed = []
+    if savings < 0:
+        total_weight = sum(g.weight or 1 for g in goals)
+        leftover = 0
+        for goal in goals:
+            share = savings * (goal.weight or 1) / total_weight
+            new_save = max(saved[goal.label] + share, 0)
+            new_completed = max(used[goal.label] + saved[goal.label] + share, 0)
+            if new_completed >= goal.amount:
+                # already completed by what was used from it
+                give_back = new_completed - goal.amount
+                leftover += give_back
+                saved[goal.label] = min(new_save - give_back, goal.amount)
+                completed.append(goal.label)
+                _debug(' + Completed %s (saved=%s, used=%s, leftover=%s)' % (
+                    goal.label, saved[goal.label], used[goal.label], give_back))
+            else:
+                _debug(' - Taking %s from %s (saved=%s, used=%s, remaining=%s)' % (
+                    saved[goal.label] - new_save, goal.label, new_save, used[goal.label], goal.amount - new_completed))
+                saved[goal.label] = new_save
+        goals = [g for g in goals if g.label not in completed]
+        savings = leftover
+
+    for priority in sorted(set(g.priority or 0 for g in goals), reverse=True):
+        if savings <= 0:
+            break
+        tier = sorted([g for g in goals if (g.priority or 0) == priority],
+            key=lambda g: (g.amount - used[g.label] - saved[g.label]) / (g.weight or 1))
+        total_weight = sum(g.weight or 1 for g in tier)
+        for i, goal in enumerate(tier):
+            # compared like the amounts they add up to rather than through the remaining amount,
+            # which rounding can leave a hair above the share of a goal it completes exactly
+            share = savings * (goal.weight or 1) / total_weight
+            if used[goal.label] + saved[goal.label] + share < goal.amount:
+                # this goal and the following ones (which need more) get their share without completing
+                level = savings / total_weight
+                for g in tier[i:]:
+                    saved[g.label] += level * (g.weight or 1)
+                    _debug(' + Giving %s to %s (saved=%s, used=%s, remaining=%s)' % (
+                        level * (g.weight or 1), g.label, saved[g.label], used[g.label],
+                        g.amount - used[g.label] - saved[g.label]))
+                savings = 0
+                break
+            remaining = goal.amount - used[goal.label] - saved[goal.label]
+            saved[goal.label] = min(goal.amount - used[goal.label], goal.amount)
+            savings = max(savings - remaining, 0)
+            total_weight -= goal.weight or 1
+            completed.append(goal.label)
+            _debug(' + Giving %s to %s (saved=%s, used=%s remaining=COMPLETED!)' % (
+                remaining, goal.label, saved[goal.label], used[goal.label]))
+    return savings, completed
+
+
+def create_budget_goals_state(budget_goals):
+    used = {g.label: 0 for g in budget_goals}
+    return {
+        'saved': dict(used),
+        'used': used,
+        'remaining_goals': [g.label for g in budget_goals if g.amount],
+        'total_savings': 0,
+        'carried': {},
+        'completed': False
+    }
+
+
+def carry_budget_goals_state(state, budget_goals):
+    # state at the start of the following year. goals with a start date keep what was saved
+    # and used for them, the others start again from zero like the total savings
+    new_state = create_budget_goals_state(budget_goals)
+    for goal in budget_goals:
+        if not goal.from_date or goal.label not in state['saved']:
+            continue
+        new_state['saved'][goal.label] = new_state['carried'][goal.label] = state['saved'][goal.label]
+        new_state['used'][goal.label] = state['used'][goal.label]
+        if goal.label not in state['remaining_goals'] and goal.label in new_state['remaining_goals']:
+            new_state['remaining_goals'].remove(goal.label)
+    return new_state
+
+
+@instrumentation.timed('budget_goals')
+def compute_budget_goals(budgets, budget_goals, debug=False, state=None, checkpoint=None):
+    # state (see create_budget_goals_state()) is updated in place so that a computation can be
+    # resumed from where a previous one stopped. checkpoint(month, state) is called after each past month
     # TODO: reopen completed budget if we need to take from savings
 
     def _debug(message):
@@ -314,22 +417,17 @@ def compute_budget_goals(budgets, budget_goals, debug=False):
         _debug('No budget goals!')
         return [], 0
 
-    used = {g.label: 0 for g in budget_goals}
-    saved = dict(used)
-    remaining_goals = [g.label for g in budget_goals if g.amount]
+    if state is None:
+        state = create_budget_goals_state(budget_goals)
+    used = state['used']
+    saved = state['saved']
+    remaining_goals = set(state['remaining_goals'])
     budget_goals = {g.label: g for g in budget_goals}
     current_month = datetime.datetime.now().replace(day=1).date()
-    total_savings = 0
-    savings = 0
-
-    # for each months
-    for budget in budgets:
-        if budget.month > current_month:
-            # only past months
-            break
 
+    def allocate(budget):
         savings = budget.savings if budget.month < current_month else budget.expected_savings
-        _debug('%s = %s (before=%s)' % (budget.month.isoformat(), savings, total_savings))
+        _debug('%s = %s (before=%s)' % (budget.month.isoformat(), savings, state['total_savings']))
 
         # computing the amount used from each goals based on the marked transactions
         for tx in budget.transactions:
@@ -341,56 +439,51 @@ def compute_budget_goals(budgets, budget_goals, debug=False):
                         savings += abs(tx.amount)
                         _debug(' + Goal already completed, giving %s to savings' % abs(tx.amount))
 
-        if savings < 0 and total_savings <= 0:
+        if savings < 0 and state['total_savings'] <= 0:
             # we used money from our savings this month and there is no savings left already (...)
-            total_savings += savings
-            continue
-        if total_savings < 0:
+            state['total_savings'] += savings
+            return
+        if state['total_savings'] < 0:
             # we have some savings this month, but we had a negative balance until now
-            _debug(' - Using %s from new savings to pay off balance (remaining=%s)' % (abs(total_savings), total_savings + savings))
-            total_savings += savings
-            if total_savings < 0:
-                continue
-            savings = total_savings
+            _debug(' - Using %s from new savings to pay off balance (remaining=%s)' % (
+                abs(state['total_savings']), state['total_savings'] + savings))
+            state['total_savings'] += savings
+            if state['total_savings'] < 0:
+                return
+            savings = state['total_savings']
         else:
-            total_savings += savings
-
-        # we use a while loop because if some goal completes during the loop
-        # it may have some letfover savings that we will dispatch amongst other goals
-        while savings != 0 and remaining_goals:
-            savings_per_goal = savings / len(remaining_goals)
-            savings = 0
-            for goal in filter(lambda g: g.amount and g.label in remaining_goals, budget_goals.values()):
-                target = goal.amount
-                new_save = max(saved[goal.label] + savings_per_goal, 0)
-                completed = used[goal.label] + saved[goal.label]
-                new_completed = max(completed + savings_per_goal, 0)
-                if new_completed >= target:
-                    give_back = new_completed - target
-                    savings += give_back
-                    new_save = min(new_save - give_back, target)
-                    _debug(' + Giving %s to %s (saved=%s, used=%s remaining=COMPLETED!, leftover=%s)' % (
-                        new_save - saved[goal.label], goal.label, new_save, used[goal.label], give_back))
-                    saved[goal.label] = new_save
-                    remaining_goals.remove(goal.label)
-                elif new_completed < completed:
-                    take_back = saved[goal.label] - new_save
-                    saved[goal.label] = new_save
-                    _debug(' - Taking %s from %s (saved=%s, used=%s, remaining=%s)' % (
-                        take_back, goal.label, new_save, used[goal.label], target - new_completed))
-                else:
-                    saved[goal.label] = new_save
-                    _debug(' + Giving %s to %s (saved=%s, used=%s, remaining=%s)' % (
-                        new_completed - completed, goal.label, new_save, used[goal.label], target - new_completed))
+            state['total_savings'] += savings
+
+        # goals with a period only receive savings during it
+        active_goals = [g for g in filter_period(budget_goals.values(), budget.month, budget.month + monthdelta(1))
+            if g.label in remaining_goals]
+        if savings != 0 and active_goals:
+            _, completed = dispatch_savings(savings, active_goals, saved, used, _debug)
+            if completed:
+                remaining_goals.difference_update(completed)
+                state['remaining_goals'] = [label for label in state['remaining_goals'] if label in remaining_goals]
+
+        if state['total_savings'] < 0:
+            _debug(' ! Not enough savings to cover this month (remaining=%s)' % state['total_savings'])
 
-        if total_savings < 0:
-            _debug(' ! Not enough savings to cover this month (remaining=%s)' % total_savings)
-                    
         if not remaining_goals:
+            # following months are ignored once all goals are completed
+            state['completed'] = True
+
+    # for each months
+    for budget in budgets:
+        if budget.month > current_month:
+            # only past months
             break
+        if not state['completed']:
+            allocate(budget)
+        if checkpoint and budget.month < current_month:
+            checkpoint(budget.month, state)
 
-    savings_after_goals = max(total_savings - sum(saved.values()), 0)
-    _debug('END COMPUTING OF GOALS (savings=%s, after goals=%s)' % (total_savings, savings_after_goals))
+    # savings carried from previous years were not counted in total_savings
+    savings_after_goals = max(state['total_savings'] - sum(
+        saved[label] - state['carried'].get(label, 0) for label in saved), 0)
+    _debug('END COMPUTING OF GOALS (savings=%s, after goals=%s)' % (state['total_savings'], savings_after_goals))
 
     computed = []
     for goal in budget_goals.values():
@@ -399,6 +492,7 @@ def compute_budget_goals(budgets, budget_goals, debug=False):
     return computed, savings_after_goals
 
 
+@instrumentation.timed('budgetize')
 def budgetize(transactions, start_date, end_date, *args, **kwargs):
     budgets = BudgetList()
     for date in period_to_months(start_date, end_date):
@@ -435,6 +529,7 @@ def budgetize_month(transactions, date, income_sources=None, planned_expenses=No
 
     savings_goal = 0
     if budget_goals:
+        budget_goals = filter_period(budget_goals, start_date, end_date)
         savings_goal = sum([s.savings_per_month for s in budget_goals])
     
     income = sum([tx.amount for tx in income_transactions])
@@ -1,5 +1,6 @@
 from collections import namedtuple
 from .data import filter_transactions_period
+from . import instrumentation
 import re
 
 
@@ -35,6 +36,7 @@ class ComputedCategory(namedtuple('ComputedCategory', ['name', 'color', 'keyword
             ' /!\ %s' % (famount(self.warning_threshold)) if self.has_warning else '')
 
 
+@instrumentation.timed('categories')
 def compute_categories(transactions, categories=None, start_date=None, end_date=None, warning_threshold_multiplier=1):
     categories = {c.name: c for c in categories or []}
     amounts = {}
@@ -69,11 +71,19 @@ def compute_categories(transactions, categories=None, start_date=None, end_date=
     return final
 
 
-def match_categories(categories, label):
-    matches = []
+def compile_category_matchers(categories):
+    matchers = []
     for category in categories:
-        for keyword in (category.keywords or []):
-            if re.search(r"\b%s\b" % keyword, label, re.I):
-                matches.append(category.name)
-                continue
-    return matches
\ No newline at end of file
+        if category.keywords:
+            matchers.append((category.name, re.compile(r"\b(?:%s)\b" % "|".join(
+                "(?:%s)" % keyword for keyword in category.keywords), re.I)))
+    return matchers
+
+
+def match_categories(categories, label):
+    return match_compiled_categories(compile_category_matchers(categories), label)
+
+
+@instrumentation.timed('category_matching')
+def match_compiled_categories(matchers, label):
+    return [name for name, regexp in matchers if regexp.search(label)]
\ No newline at end of file
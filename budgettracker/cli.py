@@ -1,16 +1,75 @@
 # -*- coding: utf-8 -*-
-from .helpers import (load_config, update_local_data, load_yearly_budgets_from_config, notify_using_config,
-                      compute_yearly_budget_goals_from_config, compute_monthly_categories_from_config,
-                      rematch_categories, get_storage_from_config, create_amount_formatter)
-from .storage import get_storage
-import datetime, sys, os, json
+# commands import what they need and load the config and storage on first use
+# so that cheap ones (eg. notify from a cron job) start fast
+from contextlib import contextmanager
 from getopt import getopt
+import datetime, time, sys, os
 
 
-config = load_config()
-storage = get_storage_from_config(config)
-famount = create_amount_formatter(config)
+started_at = time.time()
+config = None
+storage = None
 commands = {}
+timings = {}
+
+# read-only commands answered by the daemon when it is running
+FORWARDED_COMMANDS = ('show', 'analyze_savings')
+
+
+@contextmanager
+def timed(name):
+    start = time.time()
+    try:
+        yield
+    finally:
+        timings[name] = timings.get(name, 0) + time.time() - start
+
+
+def get_config():
+    global config
+    if config is None:
+        with timed('config'):
+            from .config import load_config
+            config = load_config()
+    return config
+
+
+def get_storage():
+    global storage
+    if storage is None:
+        config = get_config()
+        with timed('storage'):
+            from .helpers import get_storage_from_config
+            storage = get_storage_from_config(config)
+    return storage
+
+
+def get_amount_formatter():
+    from .helpers import create_amount_formatter
+    return create_amount_formatter(get_config())
+
+
+def track_imports():
+    # accumulates the time spent in (top level) imports in timings['imports']
+    import __builtin__
+    original_import = __builtin__.__import__
+    depth = [0]
+    def tracking_import(*args, **kwargs):
+        depth[0] += 1
+        start = time.time()
+        try:
+            return original_import(*args, **kwargs)
+        finally:
+            depth[0] -= 1
+            if not depth[0]:
+                timings['imports'] = timings.get('imports', 0) + time.time() - start
+    __builtin__.__import__ = tracking_import
+
+
+def print_timings(stream=sys.stderr):
+    for name in ('startup', 'imports', 'config', 'storage', 'command', 'total'):
+        if name in timings:
+            print >>stream, "%-8s %8.1fms" % (name, timings[name] * 1000)
 
 
 def command(options='', long_options=None):
@@ -20,8 +79,15 @@ def command(options='', long_options=None):
     return decorator
 
 
-@command('', ['month=', 'year=', 'reset'])
-def update(filename=None, month=None, year=None, reset=False):
+@command('', ['month=', 'year=', 'reset', 'all'])
+def update(filename=None, month=None, year=None, reset=False, all=False):
+    from .helpers import update_local_data, import_local_data
+    config = get_config()
+    if all:
+        # imports every month of the file at once
+        months = import_local_data(config, filename=filename, reset=reset)
+        print "Updated %s month(s)%s" % (len(months), ": %s" % ", ".join(m.strftime("%Y-%m") for m in months) if months else "")
+        return
     date = None
     if month or year:
         if not month:
@@ -34,6 +100,11 @@ def update(filename=None, month=None, year=None, reset=False):
 
 @command('', ['month=', 'year=', 'refresh'])
 def show(month=None, year=None, refresh=False):
+    from .helpers import (update_local_data, load_yearly_budgets_from_config, compute_monthly_categories_from_config,
+                          compute_yearly_budget_goals_from_config)
+    config = get_config()
+    storage = get_storage()
+    famount = get_amount_formatter()
     if not month:
         month = datetime.date.today().month
     if not year:
@@ -95,8 +166,11 @@ def show(month=None, year=None, refresh=False):
 
 @command()
 def analyze_savings():
+    from .helpers import compute_yearly_budget_goals_from_config
+    famount = get_amount_formatter()
     print "-----------------------------------------"
-    goals, savings_after_goals = compute_yearly_budget_goals_from_config(config, datetime.date.today(), storage=storage, debug=True)
+    goals, savings_after_goals = compute_yearly_budget_goals_from_config(get_config(), datetime.date.today(),
+        storage=get_storage(), debug=True)
     print "-----------------------------------------"
     print
     print "Goals:"
@@ -111,37 +185,72 @@ def web(port=5000, debug=False):
     app.run(port=port, debug=debug)
 
 
+@command('', ['host=', 'port=', 'workers=', 'threads=', 'pidfile='])
+def serve(host='127.0.0.1', port=5000, workers=2, threads=4, pidfile=None):
+    from .web.server import run_server
+    run_server(host, int(port), int(workers), int(threads), pidfile)
+
+
+@command('', ['socket='])
+def daemon(socket=None):
+    from .daemon import Daemon, get_socket_filename
+    Daemon(socket or get_socket_filename(get_config()), get_config().get('daemon_poll_interval', 1)).serve_forever()
+
+
+@command('', ['once', 'interval=', 'workers='])
+def ingest(directory=None, once=False, interval=None, workers=None):
+    from .ingest import ingest_directory, watch_directory
+    def report(results):
+        for result in results.values():
+            if 'error' in result:
+                print "%s: failed (%s)" % (result['filename'], result['error'])
+            else:
+                print "%s: updated %s month(s)" % (result['filename'], len(result['months']))
+    if once:
+        report(ingest_directory(get_config(), directory, get_storage(), workers and int(workers)))
+        return
+    watch_directory(get_config(), directory, interval and float(interval), workers and int(workers), report)
+
+
 @command()
 def notify(message):
-    notify_using_config(config, message)
+    from .notifications import notify_using_config
+    notify_using_config(get_config(), message)
 
 
-@command()
-def remap_account_id(prev_id, new_id):
-    def iterator(transactions):
-        if tx.account == prev_id:
-            return tx.update(account=new_id)
-        return tx
-    storage.iter_all_transactions_for_update(iterator)
+def print_rewrite_results(results, dry_run=False):
+    for date, changed in sorted(results.items()):
+        print "%s: %s transactions" % (date.strftime('%Y-%m'), changed)
+    print "%s transactions %s in %s months" % (sum(results.values()),
+        'would change' if dry_run else 'changed', len(results))
 
 
-@command()
-def remap_category(old_category, new_category):
-    def iterator(transactions):
-        return tx.update(categories=map(
-            lambda c: new_category if c == old_category else c,
-            tx.categories or []
-        ))
-    storage.iter_all_transactions_for_update(iterator)
+@command('', ['dry-run', 'workers='])
+def remap_account_id(prev_id, new_id, dry_run=False, workers=None):
+    from .rewrite import RemapAccountId, rewrite_all_transactions
+    print_rewrite_results(rewrite_all_transactions(get_config(), RemapAccountId(prev_id, new_id),
+        get_storage(), workers, dry_run), dry_run)
+
+
+@command('', ['dry-run', 'workers='])
+def remap_category(old_category, new_category, dry_run=False, workers=None):
+    from .rewrite import RemapCategory, rewrite_all_transactions
+    print_rewrite_results(rewrite_all_transactions(get_config(), RemapCategory(old_category, new_category),
+        get_storage(), workers, dry_run), dry_run)
 
 
-command()(rematch_categories)
+@command('', ['dry-run', 'workers='])
+def rematch_categories(dry_run=False, workers=None):
+    from .helpers import rematch_categories
+    print_rewrite_results(rematch_categories(get_config(), get_storage(), workers, dry_run), dry_run)
 
 
 @command('', ['new-storage-dir='])
 def migrate_storage(new_storage, new_storage_dir=None):
-    old_storage = get_storage_from_config(config)
-    new_storage = get_storage(new_storage)(dict(config, storage_dir=new_storage_dir or config.get('storage_dir')))
+    from .storage import get_storage as get_storage_class
+    config = get_config()
+    old_storage = get_storage()
+    new_storage = get_storage_class(new_storage)(dict(config, storage_dir=new_storage_dir or config.get('storage_dir')))
 
     new_storage.save_accounts(old_storage.load_accounts())
     for date in old_storage.iter_months():
@@ -149,6 +258,17 @@ def migrate_storage(new_storage, new_storage_dir=None):
         new_storage.save_monthly_transactions(date, transactions)
     
 
+def forward_to_daemon(command, args, kwargs, global_options):
+    if command not in FORWARDED_COMMANDS or kwargs.get('refresh') or '--profile' in global_options:
+        return False
+    from .daemon import forward_command, get_socket_filename
+    output = forward_command(get_socket_filename(get_config()), command, args, kwargs)
+    if output is None:
+        return False
+    sys.stdout.write(output.encode(sys.stdout.encoding or 'utf-8'))
+    return True
+
+
 def main(as_module=False):
     this_module = __package__
     argv = sys.argv[1:]
@@ -162,6 +282,13 @@ def main(as_module=False):
     else:
         name = None
 
+    # global options must be placed before the command
+    global_options, argv = getopt(argv, '', ['profile', 'profile-output=', 'profile-top=', 'timings'])
+    global_options = dict(global_options)
+    if '--timings' in global_options:
+        timings['startup'] = time.time() - started_at
+        track_imports()
+
     if len(argv) == 0:
         print "Missing command. Available: %s" % ", ".join(commands.keys())
         sys.exit(1)
@@ -171,4 +298,18 @@ def main(as_module=False):
         sys.exit(1)
     func, options, long_options = commands[command]
     kwargs, args = getopt(argv, options, long_options)
-    func(*args, **{k.strip('-').replace('-', '_'): v if v else True for k, v in kwargs})
\ No newline at end of file
+    kwargs = {k.strip('-').replace('-', '_'): v if v else True for k, v in kwargs}
+    try:
+        with timed('command'):
+            if forward_to_daemon(command, args, kwargs, global_options):
+                return
+            if '--profile' in global_options:
+                from .profiling import profile_call
+                profile_call(func, args, kwargs, global_options.get('--profile-output', '%s.pstats' % command),
+                    int(global_options.get('--profile-top', 30)))
+            else:
+                func(*args, **kwargs)
+    finally:
+        if '--timings' in global_options:
+            timings['total'] = time.time() - started_at
+            print_timings()
\ No newline at end of file
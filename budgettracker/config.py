@@ -0,0 +1,103 @@
+from collections import Mapping
+import os, re, copy, codecs, json, hashlib
+
+
+ROOT_DIR = os.environ.get('BUDGET_DIR', '.')
+CONFIG_FILENAME = os.environ.get('BUDGET_CONFIG', os.path.join(ROOT_DIR, 'config.yaml'))
+
+
+class CompiledConfig(Mapping):
+    # read-only snapshot of the config holding its parsed objects and compiled regexps.
+    # never mutate it: build a new one from to_dict() and swap it instead
+    def __init__(self, config):
+        from .budget import IncomeSource, PlannedExpense, BudgetGoal
+        from .categories import Category, compile_category_matchers
+        self._config = copy.deepcopy(dict(config))
+        self.income_sources = tuple(map(IncomeSource.from_dict, self._config.get('income_sources') or []))
+        self.planned_expenses = tuple(map(PlannedExpense.from_dict, self._config.get('planned_expenses') or []))
+        self.budget_goals = tuple(map(BudgetGoal.from_dict, self._config.get('budget_goals') or []))
+        self.categories = tuple(map(Category.from_dict, self._config.get('categories') or []))
+        self.category_matchers = compile_category_matchers(self.categories)
+        self.inter_account_labels_out = None
+        self.inter_account_labels_in = None
+        if self._config.get('inter_account_labels_out') and self._config.get('inter_account_labels_in'):
+            self.inter_account_labels_out = re.compile(self._config['inter_account_labels_out'])
+            self.inter_account_labels_in = re.compile(self._config['inter_account_labels_in'])
+
+    def __getitem__(self, key):
+        return self._config[key]
+
+    def __iter__(self):
+        return iter(self._config)
+
+    def __len__(self):
+        return len(self._config)
+
+    def to_dict(self):
+        return copy.deepcopy(self._config)
+
+
+def compile_config(config):
+    if hasattr(config, '_get_current_object'):
+        # the web app refers to the config of the current ledger through a werkzeug proxy
+        config = config._get_current_object()
+    if isinstance(config, CompiledConfig):
+        return config
+    return CompiledConfig(config)
+
+
+def get_config_hash(config, keys):
+    # identifies the values of a subset of the config, used to invalidate derived state
+    dct = {k: config.get(k) for k in keys}
+    return hashlib.sha1(json.dumps(dct, sort_keys=True, default=str)).hexdigest()
+
+
+def get_config_cache_filename(filename):
+    return os.path.join(os.path.dirname(filename), '.%s.json' % os.path.basename(filename))
+
+
+def read_config_file(filename):
+    # importing yaml and parsing the file dominate the startup time of short commands. the parsed
+    # config is cached as json next to the file and used as long as the file is unchanged
+    stat = os.stat(filename)
+    key = [stat.st_mtime, stat.st_size]
+    cache_filename = get_config_cache_filename(filename)
+    try:
+        with open(cache_filename) as f:
+            cache = json.load(f)
+        if cache.get('key') == key:
+            return cache['config']
+    except (IOError, ValueError):
+        pass
+
+    import yaml
+    with open(filename) as f:
+        config = yaml.load(f) or {}
+    try:
+        # configs with values json does not support (eg. yaml dates) are not cached
+        data = json.dumps({'key': key, 'config': config})
+        with open(cache_filename + '.tmp', 'w') as f:
+            f.write(data)
+        os.rename(cache_filename + '.tmp', cache_filename)
+    except (TypeError, ValueError, IOError, OSError):
+        pass
+    return config
+
+
+def load_config(filename=CONFIG_FILENAME):
+    config = {}
+    if os.path.exists(filename):
+        config = read_config_file(filename)
+    config = {k.lower(): v for k, v in config.items()}
+    for k, v in os.environ.items():
+        if k.startswith('BUDGET_') and k != 'BUDGET_CONFIG':
+            config[k[7:].lower()] = v
+    return CompiledConfig(config)
+
+
+def save_config(config, filename=CONFIG_FILENAME):
+    if isinstance(config, CompiledConfig):
+        config = config.to_dict()
+    import yaml
+    with codecs.open(filename, 'w') as f:
+        yaml.safe_dump(config, f, default_flow_style=False)
@@ -0,0 +1,169 @@
+# keeps the config, storage files and the output of read-only commands warm in a background
+# process listening on a unix socket. the cli forwards these commands to it when it is running
+from .cli import FORWARDED_COMMANDS
+from SocketServer import ThreadingMixIn, UnixStreamServer, StreamRequestHandler
+import StringIO, threading, traceback, datetime, socket, signal, json, time, sys, os
+
+
+# commands precomputed at startup and after each change so that they answer instantly
+WARM_COMMANDS = [('show', [], {}), ('analyze_savings', [], {})]
+
+
+def get_socket_filename(config):
+    if config.get('daemon_socket'):
+        return config['daemon_socket']
+    return os.path.join(config.get('storage_dir', os.environ.get('BUDGET_DIR', '.')), '.daemon.sock')
+
+
+def forward_command(socket_filename, command, args, kwargs, timeout=60):
+    # returns the output of the command or None when the daemon is not running
+    if not os.path.exists(socket_filename):
+        return None
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.settimeout(timeout)
+    try:
+        client.connect(socket_filename)
+    except socket.error:
+        return None
+    try:
+        client.sendall(json.dumps({'command': command, 'args': args, 'kwargs': kwargs}) + "\n")
+        f = client.makefile('rb')
+        response = json.loads(f.read())
+    finally:
+        client.close()
+    if 'error' in response:
+        raise Exception("Daemon error: %s" % response['error'])
+    return response['output']
+
+
+class FileCache(object):
+    # transactions files are only read again once their mtime or size changes
+    def __init__(self):
+        self.files = {}
+        self.lock = threading.Lock()
+
+    def wrap(self, storage):
+        load_transactions = storage.load_transactions
+        def cached_load_transactions(filename):
+            try:
+                stat = os.stat(filename)
+                key = (stat.st_mtime, stat.st_size)
+            except OSError:
+                return load_transactions(filename)
+            with self.lock:
+                cached = self.files.get(filename)
+            if not cached or cached[0] != key:
+                cached = (key, load_transactions(filename))
+                with self.lock:
+                    self.files[filename] = cached
+            # callers may extend the returned list
+            return list(cached[1])
+        storage.load_transactions = cached_load_transactions
+        return storage
+
+
+class Daemon(object):
+    def __init__(self, socket_filename, poll_interval=1):
+        from . import cli
+        self.cli = cli
+        self.socket_filename = socket_filename
+        self.poll_interval = poll_interval
+        self.file_cache = FileCache()
+        self.outputs = {}
+        self.state = None
+        self.lock = threading.Lock()
+
+    def get_state(self):
+        from .config import CONFIG_FILENAME
+        config_mtime = os.path.getmtime(CONFIG_FILENAME) if os.path.exists(CONFIG_FILENAME) else None
+        return (config_mtime, self.cli.get_storage().get_generation(), datetime.date.today())
+
+    def refresh(self):
+        # outputs are dropped whenever data is written by any process (the storage generation
+        # changes), the config file changes or the day changes. returns whether it happened
+        state = self.get_state()
+        if state == self.state:
+            return False
+        if self.state and state[0] != self.state[0]:
+            self.cli.config = None
+            self.cli.storage = None
+            self.file_cache.wrap(self.cli.get_storage())
+            state = self.get_state()
+        self.outputs = {}
+        self.state = state
+        return True
+
+    def run_command(self, command, args, kwargs):
+        with self.lock:
+            self.refresh()
+            key = json.dumps([command, args, kwargs], sort_keys=True)
+            if key not in self.outputs:
+                func = self.cli.commands[command][0]
+                stdout = sys.stdout
+                sys.stdout = output = StringIO.StringIO()
+                try:
+                    func(*args, **kwargs)
+                finally:
+                    sys.stdout = stdout
+                self.outputs[key] = output.getvalue()
+            return self.outputs[key]
+
+    def warm(self):
+        for command, args, kwargs in WARM_COMMANDS:
+            try:
+                self.run_command(command, args, kwargs)
+            except Exception:
+                traceback.print_exc()
+
+    def watch(self):
+        while True:
+            time.sleep(self.poll_interval)
+            with self.lock:
+                changed = self.refresh()
+            if changed:
+                self.warm()
+
+    def serve_forever(self):
+        if os.path.exists(self.socket_filename):
+            # a socket left by a daemon which did not exit cleanly
+            if forward_command(self.socket_filename, 'ping', [], {}) is not None:
+                raise Exception("A daemon is already listening on %s" % self.socket_filename)
+            os.unlink(self.socket_filename)
+
+        self.file_cache.wrap(self.cli.get_storage())
+        self.warm()
+        thread = threading.Thread(target=self.watch)
+        thread.daemon = True
+        thread.start()
+
+        server = Server(self.socket_filename, RequestHandler)
+        server.daemon = self
+        os.chmod(self.socket_filename, 0600)
+        # the socket is removed when the daemon is stopped with SIGTERM as well
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+            os.unlink(self.socket_filename)
+
+
+class Server(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+
+class RequestHandler(StreamRequestHandler):
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline())
+            if request['command'] == 'ping':
+                response = {'output': ''}
+            elif request['command'] not in FORWARDED_COMMANDS:
+                response = {'error': "Command %s cannot be run by the daemon" % request['command']}
+            else:
+                response = {'output': self.server.daemon.run_command(request['command'],
+                    request.get('args', []), request.get('kwargs', {}))}
+        except Exception as e:
+            traceback.print_exc()
+            response = {'error': '%s: %s' % (e.__class__.__name__, e)}
+        self.wfile.write(json.dumps(response))
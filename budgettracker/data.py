@@ -1,5 +1,5 @@
 # -*- coding: utf-8 -*-
-import datetime, json, os, time, unicodecsv, re
+import datetime, json, os, time, unicodecsv, re, hashlib
 from collections import namedtuple
 from monthdelta import monthdelta
 
@@ -47,15 +47,46 @@ class Transaction(namedtuple('Transaction', ['id', 'label', 'date', 'amount', 'a
             'goal': self.goal
         }
 
+    def to_csv_row(self):
+        return [self.id, self.label, self.date.isoformat(), self.amount, self.account,
+            ', '.join(self.categories or []), self.goal]
+
     def to_str(self, famount):
         return u"%s - %s = %s%s%s" % (self.date.isoformat(), self.label, famount(self.amount),
             ' #%s' % ', #'.join(self.categories) if self.categories else '',
-            ' [%s%s]' % (famount(self.goal)) if self.goal else '')
+            ' [%s]' % self.goal if self.goal else '')
 
     def __unicode__(self):
         return self.to_str()
 
 
+class SyncWatermark(namedtuple('SyncWatermark', ['account', 'last_date', 'hash'])):
+    @classmethod
+    def from_dict(cls, dct):
+        return cls(
+            account=dct['account'],
+            last_date=datetime.datetime.strptime(dct['last_date'], "%Y-%m-%d").date(),
+            hash=dct['hash']
+        )
+
+    @classmethod
+    def from_transactions(cls, account, transactions):
+        return cls(account=account, last_date=max(tx.date for tx in transactions), hash=hash_transactions(transactions))
+
+    def to_dict(self):
+        return {
+            'account': self.account,
+            'last_date': self.last_date.isoformat(),
+            'hash': self.hash
+        }
+
+
+def hash_transactions(transactions):
+    rows = sorted(json.dumps(dict(tx.to_dict(), categories=sorted(tx.categories or [])), sort_keys=True)
+        for tx in transactions)
+    return hashlib.sha1("\n".join(rows)).hexdigest()
+
+
 def update_accounts(old_accounts, new_accounts):
     old = {acc.id: acc for acc in old_accounts}
     new_ids = [acc.id for acc in new_accounts]
@@ -86,6 +117,45 @@ def update_transactions(old_transactions, new_transactions):
     return old.values() + final
 
 
+def normalize_label(label):
+    return re.sub(r'[\W_]+', ' ', label.lower(), flags=re.UNICODE).strip()
+
+
+def make_transaction_hash(account, date, amount, label):
+    # identifies a transaction by its content, used when the source provides no id
+    key = u"|".join([unicode(account), date.isoformat(), '%.2f' % amount, normalize_label(label)])
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def deduplicate_transactions(transactions_by_source, date_window=3):
+    # merges lists of transactions coming from different sources (in priority order).
+    # transactions with the same id are merged like update_transactions does. a transaction
+    # matching one from another source on account, amount and normalized label with dates at
+    # most date_window days apart is dropped. each transaction can only absorb one duplicate
+    # per source so that identical transactions within a source are kept
+    final = []
+    ids = {}
+    index = {}
+    for source, transactions in enumerate(transactions_by_source):
+        for tx in transactions:
+            if tx.id in ids:
+                i = ids[tx.id]
+                final[i] = tx.update(
+                    categories=list(set(final[i].categories or []) | set(tx.categories or [])),
+                    goal=final[i].goal)
+                continue
+            candidates = index.setdefault((tx.account, round(tx.amount, 2), normalize_label(tx.label)), [])
+            for candidate in candidates:
+                if source not in candidate['matched'] and abs((candidate['date'] - tx.date).days) <= date_window:
+                    candidate['matched'].add(source)
+                    break
+            else:
+                candidates.append({'date': tx.date, 'matched': set([source])})
+                ids[tx.id] = len(final)
+                final.append(tx)
+    return final
+
+
 def filter_out_transactions(transactions, remove_transactions):
     return filter(lambda tx: tx not in remove_transactions, transactions)
 
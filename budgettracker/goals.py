@@ -0,0 +1,135 @@
+from .config import compile_config, get_config_hash
+from .budget import compute_budget_goals, create_budget_goals_state, carry_budget_goals_state
+from .data import period_to_months
+from monthdelta import monthdelta
+import datetime, copy
+
+
+# config keys the allocation of savings depends on. when one of them changes, checkpoints are dropped
+GOALS_CONFIG_KEYS = ['income_sources', 'planned_expenses', 'budget_goals', 'inter_account_labels_out',
+                     'inter_account_labels_in', 'income_delay']
+
+
+class GoalCheckpoints(object):
+    # allocation states of budget goals at the end of each past month, kept in the storage state.
+    # a checkpoint stays valid as long as the transactions files it was computed from are unchanged,
+    # as well as the ones of the checkpoint it was resumed from (the previous month, possibly of
+    # the previous year when goals carry over)
+    def __init__(self, config, storage):
+        self.config = compile_config(config)
+        self.storage = storage
+        config_hash = get_config_hash(self.config, GOALS_CONFIG_KEYS)
+        self.state = storage.load_state('goals')
+        if self.state.get('config_hash') != config_hash:
+            self.state = {'config_hash': config_hash, 'checkpoints': {}}
+        self.valid = {}
+        self.changed = False
+
+    def get_mtimes(self, month):
+        # with an income delay, a month also depends on the start of the following one
+        months = [month]
+        if self.config.get('income_delay'):
+            months.append(month + monthdelta(1))
+        return [self.storage.get_monthly_transactions_mtime(m) for m in months]
+
+    def is_valid(self, month):
+        key = month.isoformat()
+        if key not in self.valid:
+            checkpoint = self.state['checkpoints'].get(key)
+            self.valid[key] = bool(checkpoint) and checkpoint['mtimes'] == self.get_mtimes(month) and (
+                not checkpoint['previous'] or self.is_valid(parse_month(checkpoint['previous'])))
+        return self.valid[key]
+
+    def get(self, month):
+        return copy.deepcopy(self.state['checkpoints'][month.isoformat()]['state'])
+
+    def add(self, month, previous, state, mtimes):
+        # mtimes must be read before the transactions the state was computed from were loaded,
+        # a file written in between then invalidates the checkpoint
+        self.state['checkpoints'][month.isoformat()] = {
+            'mtimes': mtimes,
+            'previous': previous.isoformat() if previous else None,
+            'state': copy.deepcopy(state)}
+        self.valid[month.isoformat()] = True
+        self.changed = True
+
+    def save(self):
+        if self.changed:
+            self.storage.save_state('goals', self.state)
+            self.changed = False
+
+
+def parse_month(value):
+    return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+
+
+def get_year_period(year):
+    # same period as load_yearly_budgets_from_config()
+    start_date = datetime.date(year, 1, 1)
+    end_date = start_date.replace(year=year+1)
+    if year <= datetime.date.today().year:
+        end_date = min(datetime.date.today().replace(day=1) + monthdelta(1), end_date)
+    return start_date, end_date
+
+
+def get_goals_first_year(budget_goals, year):
+    # goals with a start date carry what was saved for them over years, the allocation of
+    # a year then depends on all the years since the earliest of these dates
+    return min([g.from_date.year for g in budget_goals if g.from_date and g.from_date.year < year] + [year])
+
+
+def load_budgets(config, storage, start_date, end_date):
+    from .helpers import budgetize_from_config
+    transactions = storage.load_period_transactions(start_date, end_date)
+    if config.get('income_delay'):
+        transactions.extend(storage.load_monthly_transactions(end_date))
+    return budgetize_from_config(config, transactions, start_date, end_date, False)
+
+
+def compute_goals_of_year(checkpoints, budget_goals, year, debug=False):
+    # returns (computed goals, savings after goals, state at the end of the year). only the
+    # months following the last valid checkpoint are loaded. the previous year is only
+    # computed when goals carry over and its last checkpoint is not valid
+    start_date, end_date = get_year_period(year)
+    current_month = datetime.date.today().replace(day=1)
+    previous = [None]
+    state = None
+
+    if not debug:
+        # the debug output of analyze_savings needs every month
+        for month in reversed(period_to_months(start_date, end_date)):
+            if month < current_month and checkpoints.is_valid(month):
+                state = checkpoints.get(month)
+                previous[0] = month
+                start_date = month + monthdelta(1)
+                break
+
+    if state is None:
+        if [g for g in budget_goals if g.from_date and g.from_date < start_date]:
+            _, _, previous_state = compute_goals_of_year(checkpoints, budget_goals, year - 1)
+            state = carry_budget_goals_state(previous_state, budget_goals)
+            previous[0] = datetime.date(year - 1, 12, 1)
+        else:
+            state = create_budget_goals_state(budget_goals)
+
+    def checkpoint(month, state):
+        checkpoints.add(month, previous[0], state, mtimes[month])
+        previous[0] = month
+
+    budgets = []
+    if start_date < end_date and start_date <= current_month:
+        mtimes = {month: checkpoints.get_mtimes(month) for month in period_to_months(start_date, end_date)}
+        budgets = load_budgets(checkpoints.config, checkpoints.storage, start_date, end_date)
+    goals, savings_after_goals = compute_budget_goals(budgets, budget_goals, debug, state, checkpoint)
+    return goals, savings_after_goals, state
+
+
+def compute_yearly_budget_goals(config, date, storage, debug=False):
+    config = compile_config(config)
+    budget_goals = list(config.budget_goals)
+    if not budget_goals:
+        return compute_budget_goals([], budget_goals, debug)
+    checkpoints = GoalCheckpoints(config, storage)
+    goals, savings_after_goals, _ = compute_goals_of_year(checkpoints, budget_goals, date.year, debug)
+    checkpoints.save()
+    return goals, savings_after_goals
@@ -1,16 +1,16 @@
-import time, os, datetime, codecs, yaml
+import time, os, datetime
 from .data import (extract_inter_account_transactions, filter_transactions_period, update_transactions,
-                   update_accounts as _update_accounts, period_to_months)
-from .budget import budgetize, IncomeSource, PlannedExpense, BudgetGoal, compute_budget_goals
-from .categories import compute_categories, Category, match_categories
+                   update_accounts as _update_accounts, period_to_months, hash_transactions, SyncWatermark)
+from .budget import budgetize, IncomeSource, PlannedExpense, BudgetGoal
+from .categories import compute_categories, Category
+from .config import load_config, save_config, compile_config, ROOT_DIR, CONFIG_FILENAME
 from .bank_adapters import get_bank_adapter
 from .storage import get_storage
+from .notifications import notify_using_config
+from .alerts import AlertEngine
+from .goals import compute_yearly_budget_goals
+from . import instrumentation, notifications
 from monthdelta import monthdelta
-from importlib import import_module
-
-
-ROOT_DIR = os.environ.get('BUDGET_DIR', '.')
-CONFIG_FILENAME = os.environ.get('BUDGET_CONFIG', os.path.join(ROOT_DIR, 'config.yaml'))
 
 
 def get_bank_adapter_from_config(config, filename=None):
@@ -21,36 +21,20 @@ def get_storage_from_config(config):
     return get_storage(config.get('storage', 'csv'))(config)
 
 
-def load_config(filename=CONFIG_FILENAME):
-    config = {}
-    if os.path.exists(filename):
-        with open(filename) as f:
-            config = yaml.load(f)
-    config = {k.lower(): v for k, v in config.items()}
-    for k, v in os.environ.items():
-        if k.startswith('BUDGET_') and k != 'BUDGET_CONFIG':
-            config[k[7:].lower()] = v
-    return config
-
-
-def save_config(config, filename=CONFIG_FILENAME):
-    with codecs.open(filename, 'w') as f:
-        yaml.safe_dump(config, f, default_flow_style=False)
-
-
 def budgetize_from_config(config, transactions, start_date, end_date, compute_budget_goals=True, storage=None):
-    if config.get('inter_account_labels_out') and config.get('inter_account_labels_in'):
+    config = compile_config(config)
+    if config.inter_account_labels_out:
         _, transactions = extract_inter_account_transactions(transactions,
-                config['inter_account_labels_out'], config['inter_account_labels_in'])
+                config.inter_account_labels_out, config.inter_account_labels_in)
 
-    income_sources = map(IncomeSource.from_dict, config.get('income_sources', []))
-    planned_expenses = map(PlannedExpense.from_dict, config.get('planned_expenses', []))
+    income_sources = list(config.income_sources)
+    planned_expenses = list(config.planned_expenses)
     income_delay = config.get('income_delay', 0)
 
     if compute_budget_goals:
         budget_goals, _ = compute_yearly_budget_goals_from_config(config, start_date, storage)
     else:
-        budget_goals = map(BudgetGoal.from_dict, config.get('budget_goals', []))
+        budget_goals = list(config.budget_goals)
 
     return budgetize(transactions, start_date, end_date, income_sources,
         planned_expenses, budget_goals, income_delay)
@@ -83,92 +67,215 @@ def load_yearly_budgets_from_config(config, date, compute_budget_goals=True, sto
 
 
 def compute_yearly_budget_goals_from_config(config, date, storage=None, debug=False):
-    return compute_budget_goals(
-        load_yearly_budgets_from_config(config, date, False, storage),
-        map(BudgetGoal.from_dict, config.get('budget_goals', [])),
-        debug=debug
-    )
+    if not storage:
+        storage = get_storage_from_config(config)
+    return compute_yearly_budget_goals(config, date, storage, debug)
 
 
 def compute_monthly_categories_from_config(config, date, storage=None):
     if not storage:
         storage = get_storage_from_config(config)
-    categories = map(Category.from_dict, config.get('categories', []))
     transactions = storage.load_monthly_transactions(date)
-    return compute_categories(transactions, categories)
+    return compute_categories(transactions, compile_config(config).categories)
 
 
-def update_monthly_transactions(storage, adapter, date, reset=False):
+def load_sync_watermarks(storage):
+    return {id: SyncWatermark.from_dict(dct) for id, dct in storage.load_state('sync').get('watermarks', {}).items()}
+
+
+def save_sync_watermarks(storage, watermarks):
+    state = storage.load_state('sync')
+    state['watermarks'] = {id: wm.to_dict() for id, wm in watermarks.items()}
+    storage.save_state('sync', state)
+
+
+def merge_sync_watermarks(storage, watermarks, reset=False):
+    # watermarks of all accounts and months are kept in one state, concurrent syncs (eg. web jobs
+    # of different months) would otherwise overwrite each other's
+    with storage.lock_state('sync'):
+        current = load_sync_watermarks(storage)
+        new_watermarks = dict(current)
+        for account, wm in watermarks.items():
+            if reset or account not in current or wm.last_date >= current[account].last_date:
+                new_watermarks[account] = wm
+        if new_watermarks != current:
+            save_sync_watermarks(storage, new_watermarks)
+
+
+def merge_monthly_transactions(storage, adapter, date, reset=False):
+    # returns (transactions, changed, watermarks) where watermarks are the ones of the fetched
+    # accounts. transactions is None when the adapter returned exactly what was fetched during
+    # the last sync (nothing was loaded from storage)
     start_date = date.replace(day=1)
     end_date = start_date + monthdelta(1)
 
-    transactions = adapter.fetch_transactions_from_all_accounts(start_date, end_date)
-    if not reset:
-        old_transactions = storage.load_monthly_transactions(date)
-        transactions = update_transactions(old_transactions, transactions)
+    watermarks = load_sync_watermarks(storage)
+    # watermarks are only relevant for the month they belong to
+    month_watermarks = {id: wm for id, wm in watermarks.items()
+        if not reset and start_date <= wm.last_date < end_date}
+
+    transactions = adapter.fetch_transactions_from_all_accounts(start_date, end_date, month_watermarks)
+    transactions_by_account = {}
+    for tx in transactions:
+        transactions_by_account.setdefault(tx.account, []).append(tx)
+    new_watermarks = {account: SyncWatermark.from_transactions(account, account_transactions)
+        for account, account_transactions in transactions_by_account.items()}
+
+    if not reset and {id: wm.hash for id, wm in new_watermarks.items()} == {id: wm.hash for id, wm in month_watermarks.items()}:
+        return None, False, new_watermarks
+
+    if reset:
+        return transactions, True, new_watermarks
+
+    old_transactions = storage.load_monthly_transactions(date)
+    transactions = update_transactions(old_transactions, transactions)
+    changed = hash_transactions(transactions) != hash_transactions(old_transactions)
+    return transactions, changed, new_watermarks
 
-    storage.save_monthly_transactions(date, transactions)
+
+def commit_monthly_transactions(storage, date, transactions, changed, watermarks, reset=False):
+    if changed:
+        storage.save_monthly_transactions(date, transactions)
+    # watermarks are saved after the transactions so that a failed save never skips transactions
+    merge_sync_watermarks(storage, watermarks, reset)
+
+
+def update_monthly_transactions(storage, adapter, date, reset=False):
+    transactions, changed, watermarks = merge_monthly_transactions(storage, adapter, date, reset)
+    commit_monthly_transactions(storage, date, transactions, changed, watermarks, reset)
     return transactions
 
 
 def update_accounts(storage, adapter, reset=False):
-    accounts = list(adapter.fetch_accounts())
+    with instrumentation.timer('adapter_fetch'):
+        accounts = list(adapter.fetch_accounts())
     if not reset:
         old_accounts = storage.load_accounts()
         accounts = _update_accounts(old_accounts, accounts)
+        if sorted(accounts) == sorted(old_accounts):
+            return accounts
     storage.save_accounts(accounts)
     return accounts
 
 
-def update_local_data(config, notify=True, date=None, storage=None, adapter=None, filename=None, reset=False):
+def update_local_data(config, notify=True, date=None, storage=None, adapter=None, filename=None, reset=False, progress=None):
     if not adapter:
         adapter = get_bank_adapter_from_config(config, filename)
     if not storage:
         storage = get_storage_from_config(config)
+    if not progress:
+        progress = lambda pct, message=None: None
+
+    if date and date < datetime.date.today().replace(day=1):
+        notify = False
+    if notify:
+        prepare_budget_alerts(config, storage)
 
     if not date:
         if datetime.date.today().day <= 5:
             # if we are still in the early days of a new month, keep updating the previous month
-            update_local_data(config, False, datetime.date.today() - monthdelta(1), adapter, session)
+            update_local_data(config, False, datetime.date.today().replace(day=1) - monthdelta(1),
+                storage, adapter, reset=reset)
         date = datetime.date.today().replace(day=1)
-    elif date < datetime.date.today().replace(day=1):
-        notify = False
-
-    prev_budget = load_monthly_budget_from_config(config, date, storage)
 
-    update_monthly_transactions(storage, adapter, date, reset)
-    update_accounts(storage, adapter, reset)
+    progress(10, 'Fetching transactions')
+    transactions, changed, watermarks = merge_monthly_transactions(storage, adapter, date, reset)
+    commit_monthly_transactions(storage, date, transactions, changed, watermarks, reset)
 
-    budget = load_monthly_budget_from_config(config, date, storage)
+    progress(60, 'Fetching accounts')
+    accounts = update_accounts(storage, adapter, reset)
 
     if notify:
-        if config.get('notify_remaining') and prev_budget.expected_remaining > config['notify_remaining'] and budget.expected_remaining <= config['notify_remaining']:
-            notify_using_config(config, 'BUDGET: /!\ LOW SAFE TO SPEND: %s' % budget.expected_remaining)
-        elif config.get('notify_delta') and (prev_budget.expected_remaining - budget.expected_remaining) > config['notify_delta']:
-            notify_using_config(config, 'BUDGET: Remaining funds: %s' % budget.expected_remaining)
+        notify_budget_changes(config, storage, date, transactions if changed else None, accounts, progress)
+
+
+def prepare_budget_alerts(config, storage):
+    # the totals alerts compare to are rebuilt from storage when missing or when the budget config
+    # changed. this must happen before a sync writes its data, otherwise its changes would already
+    # be part of the totals and would never be reported
+    with storage.lock_state('alerts'):
+        engine = AlertEngine(config, storage)
+        if engine.rebuilt:
+            engine.save()
+
+
+def notify_budget_changes(config, storage, date, transactions=None, accounts=None, progress=None):
+    # alert rules are evaluated against what changed since the previous evaluation: the
+    # transactions of the month (when they changed) and the accounts balance
+    if progress:
+        progress(80, 'Checking alerts')
+    # concurrent syncs (eg. web import jobs) would otherwise evaluate the same changes twice
+    with storage.lock_state('alerts'):
+        engine = AlertEngine(config, storage)
+        if transactions is not None:
+            engine.update_month(date, transactions)
+        if accounts is not None:
+            engine.update_accounts(accounts)
+        if progress:
+            progress(90, 'Sending notifications')
+        return engine.notify()
+
+
+def import_local_data(config, filename=None, storage=None, adapter=None, start_date=None, end_date=None,
+                      notify=True, reset=False, progress=None):
+    # imports every month found in the adapter source (eg. a file with years of history) in one run.
+    # months are merged concurrently, only the changed ones are written and alerts
+    # are evaluated once for the current month. returns the list of written months
+    if not adapter:
+        adapter = get_bank_adapter_from_config(config, filename)
+    if not storage:
+        storage = get_storage_from_config(config)
+    if not progress:
+        progress = lambda pct, message=None: None
 
-        categories = compute_monthly_categories_from_config(config, date, storage)
-        for category in categories:
-            if category.has_warning:
-                notify_using_config(config, 'BUDGET: /!\ CATEGORY WARNING: %s (%s / %s)' % (
-                    category.name, category.amount, category.warning_threshold))
+    progress(10, 'Fetching transactions')
+    buckets = list(adapter.fetch_monthly_transactions(start_date, end_date))
 
+    def merge(bucket):
+        date, transactions = bucket
+        if reset:
+            return date, transactions, True
+        old_transactions = storage.load_monthly_transactions(date)
+        transactions = update_transactions(old_transactions, transactions)
+        return date, transactions, hash_transactions(transactions) != hash_transactions(old_transactions)
 
-def rematch_categories(config, storage=None):
-    if not storage:
-        storage = get_storage_from_config(config)
-    categories = map(Category.from_dict, config.get('categories', []))
-    def iterator(tx):
-        return tx.update(
-            categories=list(set(tx.categories or []) | set(match_categories(categories, tx.label))))
-    storage.iter_all_transactions_for_update(iterator)
-
-
-def notify_using_config(config, message):
-    print message
-    if config.get('notify_adapter'):
-        adapter = import_module('budgettracker.notify_adapters.' + config['notify_adapter'])
-        adapter.send(config, message)
+    progress(30, 'Merging transactions')
+    merged = adapter.map_concurrently(merge, buckets)
+    changed_months = [date for date, _, changed in merged if changed]
+
+    progress(50, 'Saving transactions')
+    if notify:
+        prepare_budget_alerts(config, storage)
+    for date, transactions, changed in merged:
+        if changed:
+            storage.save_monthly_transactions(date, transactions)
+
+    # watermarks follow the latest imported month of each account, as with monthly updates
+    watermarks = {}
+    for date, transactions in buckets:
+        transactions_by_account = {}
+        for tx in transactions:
+            transactions_by_account.setdefault(tx.account, []).append(tx)
+        for account, account_transactions in transactions_by_account.items():
+            watermarks[account] = SyncWatermark.from_transactions(account, account_transactions)
+    merge_sync_watermarks(storage, watermarks, reset)
+
+    progress(60, 'Fetching accounts')
+    accounts = update_accounts(storage, adapter, reset)
+
+    if notify:
+        current_month = datetime.date.today().replace(day=1)
+        current_transactions = None
+        for date, transactions, changed in merged:
+            if date == current_month and changed:
+                current_transactions = transactions
+        notify_budget_changes(config, storage, current_month, current_transactions, accounts, progress)
+    return changed_months
+
+
+def rematch_categories(config, storage=None, workers=None, dry_run=False):
+    from .rewrite import RematchCategories, rewrite_all_transactions
+    return rewrite_all_transactions(config, RematchCategories(config), storage, workers, dry_run)
 
 
 def create_amount_formatter(config):
@@ -0,0 +1,162 @@
+from .helpers import get_storage_from_config, import_local_data, prepare_budget_alerts, notify_budget_changes
+from .bank_adapters import get_bank_adapter
+from .bank_adapters.base import BankAdapter
+from multiprocessing.pool import ThreadPool
+import datetime, hashlib, traceback, time, os
+
+
+ADAPTERS_BY_EXTENSION = {
+    '.csv': 'csv',
+    '.ofx': 'ofx',
+    '.qfx': 'ofx'
+}
+
+
+class PrefetchedAdapter(BankAdapter):
+    # serves what another adapter read so that files can be parsed concurrently
+    # while their transactions are merged into storage one file at a time
+    def __init__(self, config, adapter):
+        super(PrefetchedAdapter, self).__init__(config, adapter.filename)
+        self.name = adapter.name
+        self.months = list(adapter.fetch_monthly_transactions())
+        self.accounts = list(adapter.fetch_accounts())
+
+    def fetch_accounts(self):
+        return self.accounts
+
+    def fetch_transactions(self, account, start_date=None, end_date=None, watermark=None):
+        return [tx for _, transactions in self.months for tx in transactions if tx.account == account.id
+            and not (start_date and start_date > tx.date) and not (end_date and end_date <= tx.date)]
+
+    def fetch_monthly_transactions(self, start_date=None, end_date=None):
+        return self.months
+
+
+def file_checksum(filename, chunk_size=65536):
+    sha1 = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), ''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def get_adapter_name(filename):
+    return ADAPTERS_BY_EXTENSION.get(os.path.splitext(filename)[1].lower())
+
+
+def find_new_files(directory, processed, settle_delay=2, checksums=None):
+    # returns [(filename, checksum)] for supported files which have not been processed yet.
+    # files modified less than settle_delay seconds ago may still be being written. checksums
+    # maps names to the [size, mtime, checksum] of files seen before so that only new or
+    # modified files are read, it is updated in place
+    if checksums is None:
+        checksums = {}
+    files = []
+    names = set()
+    now = time.time()
+    for name in sorted(os.listdir(directory)):
+        filename = os.path.join(directory, name)
+        if name.startswith('.') or not get_adapter_name(name) or not os.path.isfile(filename):
+            continue
+        stat = os.stat(filename)
+        if now - stat.st_mtime < settle_delay:
+            continue
+        names.add(name)
+        if checksums.get(name, [])[:2] != [stat.st_size, stat.st_mtime]:
+            checksums[name] = [stat.st_size, stat.st_mtime, file_checksum(filename)]
+        checksum = checksums[name][2]
+        if checksum not in processed:
+            files.append((filename, checksum))
+    for name in set(checksums) - names:
+        del checksums[name]
+    return files
+
+
+def ingest_files(config, files, storage=None, workers=2):
+    # imports files found during one cycle. files are read concurrently by a bounded pool,
+    # merged one after the other and alerts are evaluated once for the whole batch.
+    # returns {checksum: result} with the changed months or the error of each file
+    if not storage:
+        storage = get_storage_from_config(config)
+
+    def read(file):
+        filename, checksum = file
+        try:
+            adapter = get_bank_adapter(get_adapter_name(filename))(config, filename)
+            return filename, checksum, PrefetchedAdapter(config, adapter), None
+        except Exception as e:
+            traceback.print_exc()
+            return filename, checksum, None, '%s: %s' % (e.__class__.__name__, e)
+
+    results = {}
+    changed_months = set()
+    prepare_budget_alerts(config, storage)
+
+    pool = ThreadPool(max(1, min(workers, len(files))))
+    try:
+        for filename, checksum, adapter, error in pool.imap(read, files):
+            result = {'filename': os.path.basename(filename), 'date': datetime.datetime.now().isoformat()}
+            if not error:
+                try:
+                    months = import_local_data(config, storage=storage, adapter=adapter, notify=False)
+                    changed_months.update(months)
+                    result['months'] = [m.isoformat() for m in months]
+                except Exception as e:
+                    traceback.print_exc()
+                    error = '%s: %s' % (e.__class__.__name__, e)
+            if error:
+                result['error'] = error
+            results[checksum] = result
+    finally:
+        pool.close()
+
+    current_month = datetime.date.today().replace(day=1)
+    notify_budget_changes(config, storage, current_month,
+        storage.load_monthly_transactions(current_month) if current_month in changed_months else None,
+        storage.load_accounts())
+    return results
+
+
+def ingest_directory(config, directory=None, storage=None, workers=None, settle_delay=None):
+    # runs one cycle. checksums of processed files (including failed ones, which are only
+    # retried once their content changes) are kept in the storage state, as well as the
+    # checksum, size and mtime of every file in the directory
+    if not storage:
+        storage = get_storage_from_config(config)
+    directory = directory or config['imports_dir']
+    state = storage.load_state('ingest')
+    checksums = state.get('checksums', {})
+    previous_checksums = dict(checksums)
+    files = find_new_files(directory, state.get('files', {}),
+        config.get('ingest_settle_delay', 2) if settle_delay is None else settle_delay, checksums)
+    results = {}
+    if files:
+        results = ingest_files(config, files, storage, workers or config.get('ingest_workers', 2))
+    if results or checksums != previous_checksums:
+        # files may have been recorded while this cycle was running (see record_imported_file())
+        with storage.lock_state('ingest'):
+            state = storage.load_state('ingest')
+            state.setdefault('files', {}).update(results)
+            state['checksums'] = checksums
+            storage.save_state('ingest', state)
+    return results
+
+
+def record_imported_file(storage, filename, checksum):
+    # files imported by other means (eg. uploads kept in imports_dir by the web interface)
+    # are recorded as processed so that they are not imported again
+    with storage.lock_state('ingest'):
+        state = storage.load_state('ingest')
+        state.setdefault('files', {})[checksum] = {'filename': os.path.basename(filename),
+            'date': datetime.datetime.now().isoformat()}
+        storage.save_state('ingest', state)
+
+
+def watch_directory(config, directory=None, interval=None, workers=None, callback=None):
+    storage = get_storage_from_config(config)
+    interval = interval or config.get('ingest_interval', 10)
+    while True:
+        results = ingest_directory(config, directory, storage, workers)
+        if results and callback:
+            callback(results)
+        time.sleep(interval)
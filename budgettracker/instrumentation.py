@@ -0,0 +1,139 @@
+from collections import defaultdict, OrderedDict
+from contextlib import contextmanager
+import threading, time, functools
+
+
+# instrumentation is disabled by default. all helpers return immediately in this case so that
+# timers left around hot code paths only cost a global lookup
+enabled = False
+buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+histograms = {}
+counters = defaultdict(float)
+lock = threading.Lock()
+local = threading.local()
+
+
+def enable(value=True):
+    global enabled
+    enabled = bool(value)
+
+
+def reset():
+    with lock:
+        histograms.clear()
+        counters.clear()
+
+
+def observe(name, duration, **labels):
+    if not enabled:
+        return
+    key = (name, tuple(sorted(labels.items())))
+    with lock:
+        if key not in histograms:
+            histograms[key] = [[0] * len(buckets), 0, 0.0]
+        histogram = histograms[key]
+        for i, bound in enumerate(buckets):
+            if duration <= bound:
+                histogram[0][i] += 1
+                break
+        histogram[1] += 1
+        histogram[2] += duration
+    timings = getattr(local, 'timings', None)
+    if timings is not None and not labels:
+        total, count = timings.get(name, (0, 0))
+        timings[name] = (total + duration, count + 1)
+
+
+def incr(name, value=1):
+    if not enabled:
+        return
+    with lock:
+        counters[name] += value
+    request_counters = getattr(local, 'counters', None)
+    if request_counters is not None:
+        request_counters[name] = request_counters.get(name, 0) + value
+
+
+@contextmanager
+def timer(name):
+    if not enabled:
+        yield
+        return
+    start = time.time()
+    try:
+        yield
+    finally:
+        observe(name, time.time() - start)
+
+
+def timed(name):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return func(*args, **kwargs)
+            start = time.time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                observe(name, time.time() - start)
+        return wrapper
+    return decorator
+
+
+def start_request():
+    # per-thread totals for the current request, used for the Server-Timing header
+    local.timings = OrderedDict()
+    local.counters = OrderedDict()
+    local.started_at = time.time()
+
+
+def end_request():
+    timings = getattr(local, 'timings', None)
+    counters = getattr(local, 'counters', None)
+    started_at = getattr(local, 'started_at', None)
+    local.timings = local.counters = local.started_at = None
+    if timings is None:
+        return None
+    timings['total'] = (time.time() - started_at, 1)
+    return timings, counters
+
+
+def format_server_timing(timings, counters):
+    parts = ['%s;dur=%.2f' % (name, total * 1000) for name, (total, count) in timings.items()]
+    parts.extend('%s;desc="%s"' % (name, int(value)) for name, value in counters.items())
+    return ', '.join(parts)
+
+
+def format_labels(labels, **extra):
+    labels = list(labels) + sorted(extra.items())
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (k, unicode(v).replace('\\', '\\\\').replace('"', '\\"'))
+        for k, v in labels)
+
+
+def format_prometheus(prefix='budgettracker'):
+    with lock:
+        counters_copy = sorted(counters.items())
+        histograms_copy = sorted((k, (list(v[0]), v[1], v[2])) for k, v in histograms.items())
+
+    lines = []
+    for name, value in counters_copy:
+        lines.append('# TYPE %s_%s_total counter' % (prefix, name))
+        lines.append('%s_%s_total %s' % (prefix, name, repr(float(value))))
+
+    last_name = None
+    for (name, labels), (bucket_counts, count, total) in histograms_copy:
+        metric = '%s_%s_seconds' % (prefix, name)
+        if name != last_name:
+            lines.append('# TYPE %s histogram' % metric)
+            last_name = name
+        cumulative = 0
+        for bound, bucket_count in zip(buckets, bucket_counts):
+            cumulative += bucket_count
+            lines.append('%s_bucket%s %d' % (metric, format_labels(labels, le=bound), cumulative))
+        lines.append('%s_bucket%s %d' % (metric, format_labels(labels, le='+Inf'), count))
+        lines.append('%s_sum%s %s' % (metric, format_labels(labels), repr(total)))
+        lines.append('%s_count%s %d' % (metric, format_labels(labels), count))
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,150 @@
+from collections import OrderedDict
+from contextlib import contextmanager
+import threading, uuid, time, traceback, Queue, os, json
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class Job(object):
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    def __init__(self, func, args=None, kwargs=None, lock_key=None, on_change=None):
+        self.id = uuid.uuid4().hex
+        self.on_change = on_change
+        self.func = func
+        self.args = args or ()
+        self.kwargs = kwargs or {}
+        self.lock_key = lock_key
+        self.status = self.PENDING
+        self.progress = 0
+        self.message = None
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+
+    @property
+    def finished(self):
+        return self.status in (self.DONE, self.FAILED)
+
+    def update_progress(self, progress, message=None):
+        self.progress = progress
+        self.message = message
+        self.changed()
+
+    def changed(self):
+        if self.on_change:
+            self.on_change(self)
+
+    def run(self):
+        self.status = self.RUNNING
+        self.changed()
+        try:
+            self.func(*self.args, progress=self.update_progress, **self.kwargs)
+            self.status = self.DONE
+            self.progress = 100
+        except Exception as e:
+            traceback.print_exc()
+            self.error = str(e)
+            self.status = self.FAILED
+        self.finished_at = time.time()
+        self.changed()
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'status': self.status,
+            'progress': self.progress,
+            'message': self.message,
+            'error': self.error
+        }
+
+
+class JobQueue(object):
+    # when state_dir is provided, job statuses and locks are shared through files so that
+    # several processes (eg. multiple web workers) can serve statuses and serialize jobs
+    def __init__(self, workers=1, max_finished_jobs=100, state_dir=None):
+        self.workers = workers
+        self.max_finished_jobs = max_finished_jobs
+        self.state_dir = state_dir
+        self.queue = Queue.Queue()
+        self.jobs = OrderedDict()
+        self.locks = {}
+        self.lock = threading.Lock()
+        self.threads = []
+
+    def submit(self, func, *args, **kwargs):
+        lock_key = kwargs.pop('lock_key', None)
+        job = Job(func, args, kwargs, lock_key, self._save_job if self.state_dir else None)
+        with self.lock:
+            self.jobs[job.id] = job
+            self._prune()
+            self._start_workers()
+        job.changed()
+        self.queue.put(job)
+        return job
+
+    def get(self, id):
+        job = self.jobs.get(id)
+        if job:
+            return job.to_dict()
+        if self.state_dir and os.path.exists(self._get_job_filename(id)):
+            with open(self._get_job_filename(id)) as f:
+                return json.load(f)
+
+    def _get_job_filename(self, id):
+        return os.path.join(self.state_dir, '%s.json' % os.path.basename(id))
+
+    def _save_job(self, job):
+        if not os.path.exists(self.state_dir):
+            os.makedirs(self.state_dir)
+        filename = self._get_job_filename(job.id)
+        with open(filename + '.tmp', 'w') as f:
+            json.dump(job.to_dict(), f)
+        os.rename(filename + '.tmp', filename)
+
+    def _prune(self):
+        finished = [j.id for j in self.jobs.values() if j.finished]
+        for id in finished[:max(len(finished) - self.max_finished_jobs, 0)]:
+            del self.jobs[id]
+            if self.state_dir and os.path.exists(self._get_job_filename(id)):
+                os.unlink(self._get_job_filename(id))
+
+    def _start_workers(self):
+        while len(self.threads) < self.workers:
+            thread = threading.Thread(target=self._work)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    @contextmanager
+    def _locked(self, key):
+        with self.lock:
+            lock = self.locks.setdefault(key, threading.Lock())
+        with lock:
+            if not self.state_dir or not fcntl:
+                yield
+                return
+            if not os.path.exists(self.state_dir):
+                os.makedirs(self.state_dir)
+            with open(os.path.join(self.state_dir, '%s.lock' % key), 'w') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _work(self):
+        while True:
+            job = self.queue.get()
+            # jobs sharing a lock key (eg. imports for the same month) never run concurrently
+            if job.lock_key is not None:
+                with self._locked(job.lock_key):
+                    job.run()
+            else:
+                job.run()
+            self.queue.task_done()
@@ -0,0 +1,142 @@
+from .config import get_config_hash
+from contextlib import contextmanager
+from importlib import import_module
+import threading, traceback, Queue, atexit, time
+
+
+notifiers = {}
+notifiers_lock = threading.Lock()
+local = threading.local()
+
+
+class Notifier(object):
+    # delivers messages from a background thread. the adapter connection (smtp server,
+    # http session) is opened for the first message and reused until the queue is empty.
+    # failed deliveries are retried on a new connection with an exponential backoff
+    def __init__(self, config, adapter):
+        self.config = config
+        self.adapter = adapter
+        self.queue = Queue.Queue()
+        self.connection = None
+        self.thread = None
+        self.lock = threading.Lock()
+
+    @property
+    def max_retries(self):
+        return self.config.get('notify_retries', 3)
+
+    @property
+    def retry_delay(self):
+        return self.config.get('notify_retry_delay', 1)
+
+    def send(self, message):
+        with self.lock:
+            if not self.thread:
+                self.thread = threading.Thread(target=self._work)
+                self.thread.daemon = True
+                self.thread.start()
+        self.queue.put(message)
+
+    def flush(self, timeout=None):
+        # waits for queued messages to be delivered (or dropped after all retries)
+        deadline = time.time() + timeout if timeout is not None else None
+        while self.queue.unfinished_tasks:
+            if deadline is not None and time.time() > deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def deliver(self, message):
+        for attempt in range(self.max_retries + 1):
+            try:
+                if self.connection is None:
+                    self.connection = self.adapter.connect(self.config)
+                self.adapter.deliver(self.config, message, self.connection)
+                return True
+            except Exception:
+                traceback.print_exc()
+                self.disconnect()
+                if attempt < self.max_retries:
+                    time.sleep(self.retry_delay * 2 ** attempt)
+        return False
+
+    def disconnect(self):
+        if self.connection is not None:
+            try:
+                self.adapter.disconnect(self.connection)
+            except Exception:
+                pass
+            self.connection = None
+
+    def _work(self):
+        while True:
+            message = self.queue.get()
+            try:
+                self.deliver(message)
+                if self.queue.empty():
+                    self.disconnect()
+            finally:
+                self.queue.task_done()
+
+
+def get_notifier_key(config):
+    # ledgers served by the same process each have their own recipients and credentials
+    return get_config_hash(config, sorted(k for k in config if k.startswith('notify_')))
+
+
+def get_notifier(config):
+    name = config.get('notify_adapter')
+    if not name:
+        return None
+    key = get_notifier_key(config)
+    with notifiers_lock:
+        if key not in notifiers:
+            notifiers[key] = Notifier(config, import_module('budgettracker.notify_adapters.' + name))
+        notifier = notifiers[key]
+    # the config may have been reloaded since the notifier was created
+    notifier.config = config
+    return notifier
+
+
+def flush_notifications(timeout=None):
+    for notifier in notifiers.values():
+        notifier.flush(timeout)
+
+
+# short lived processes (eg. the cli) wait for their notifications to be delivered
+atexit.register(flush_notifications, 60)
+
+
+def format_digest(messages):
+    if len(messages) == 1:
+        return messages[0]
+    return "\n".join(["BUDGET: %s notifications" % len(messages)] + messages)
+
+
+@contextmanager
+def digest(config):
+    # messages sent from the current thread inside this block are coalesced into a single one
+    if getattr(local, 'digest', None) is not None:
+        yield
+        return
+    local.digest = []
+    try:
+        yield
+    finally:
+        messages, local.digest = local.digest, None
+        if messages:
+            send_notification(config, format_digest(messages))
+
+
+def send_notification(config, message):
+    notifier = get_notifier(config)
+    if notifier:
+        notifier.send(message)
+
+
+def notify_using_config(config, message):
+    print message
+    if getattr(local, 'digest', None) is not None:
+        local.digest.append(message)
+    else:
+        send_notification(config, message)
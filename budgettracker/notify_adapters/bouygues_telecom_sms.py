@@ -20,9 +20,15 @@ def login(session, config):
     return session
 
 
-def send(config, message):
-    session = login(requests.Session(), config)
+def connect(config):
+    return login(requests.Session(), config)
+
+
+def disconnect(session):
+    session.close()
+
 
+def deliver(config, message, session):
     r = session.get('https://www.secure.bbox.bouyguestelecom.fr/services/SMSIHD/sendSMS.phtml')
     r.raise_for_status()
 
@@ -36,3 +42,9 @@ def send(config, message):
 
     r = session.get('https://www.secure.bbox.bouyguestelecom.fr/services/SMSIHD/resultSendSMS.phtml')
     r.raise_for_status()
+
+
+def send(config, message):
+    session = connect(config)
+    deliver(config, message, session)
+    disconnect(session)
@@ -1,28 +1,46 @@
 import smtplib
 
 
-def send(config, message):
+def connect(config):
+    server = smtplib.SMTP(config.get('notify_host', 'localhost'))
+    server.ehlo()
+    if config.get('notify_tls'):
+        server.starttls()
+        server.ehlo()
+    if config.get('notify_username'):
+        server.login(config['notify_username'], config.get('notify_password'))
+    return server
+
+
+def disconnect(server):
+    try:
+        server.quit()
+    except smtplib.SMTPException:
+        server.close()
+
+
+def deliver(config, message, server):
+    # errors are raised so that the caller can retry with a new connection
     if not config.get('notify_emails'):
         return
-        
+
     from_email = config.get('notify_from_email') or config.get('notify_username', 'no-reply@budgettracker')
     body = "\r\n".join([
         "From: %s" % from_email,
         "To: %s" % ', '.join(config.get('notify_emails', [])),
-        "Subject: %s" % message,
+        "Subject: %s" % message.split("\n", 1)[0],
         "",
         message
     ])
+    server.sendmail(from_email, config['notify_emails'], body)
+
 
+def send(config, message):
+    if not config.get('notify_emails'):
+        return
     try:
-        server = smtplib.SMTP(config.get('notify_host', 'localhost'))
-        server.ehlo()
-        if config.get('notify_tls'):
-            server.starttls()
-            server.ehlo()
-        if config.get('notify_username'):
-            server.login(config['notify_username'], config.get('notify_password'))
-        server.sendmail(from_email, config['notify_emails'], body)
-        server.quit()
+        server = connect(config)
+        deliver(config, message, server)
+        disconnect(server)
     except Exception as e:
-        print e
\ No newline at end of file
+        print e
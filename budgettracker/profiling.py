@@ -0,0 +1,77 @@
+import cProfile, pstats, os, re, sys, random, threading, StringIO
+
+
+def save_stats(stats, filename, top=30, sort='cumulative'):
+    # dumps the raw pstats file and a human readable summary of the top entries next to it
+    stats.dump_stats(filename)
+    summary = StringIO.StringIO()
+    stats.stream = summary
+    stats.sort_stats(sort).print_stats(top)
+    with open(os.path.splitext(filename)[0] + '.txt', 'w') as f:
+        f.write(summary.getvalue())
+    return summary.getvalue()
+
+
+def profile_call(func, args=None, kwargs=None, filename=None, top=30, sort='cumulative'):
+    profile = cProfile.Profile()
+    try:
+        return profile.runcall(func, *(args or ()), **(kwargs or {}))
+    finally:
+        if filename:
+            summary = save_stats(pstats.Stats(profile), filename, top, sort)
+            print >>sys.stderr, summary
+
+
+class ProfilerMiddleware(object):
+    # WSGI middleware profiling a sample of requests. samples are aggregated in one
+    # pstats file per route (as returned by get_route(environ)) under profile_dir
+    def __init__(self, app, profile_dir, sample_rate=1.0, get_route=None, top=30, sort='cumulative'):
+        self.app = app
+        self.profile_dir = profile_dir
+        self.sample_rate = float(sample_rate)
+        self.get_route = get_route or (lambda environ: environ.get('PATH_INFO', '/'))
+        self.top = top
+        self.sort = sort
+        self.lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        if random.random() >= self.sample_rate:
+            return self.app(environ, start_response)
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            app_iter = self.app(environ, start_response)
+        finally:
+            profile.disable()
+        return self.iter_profiled(app_iter, profile, self.get_route(environ))
+
+    def iter_profiled(self, app_iter, profile, route):
+        # the body is profiled too as responses may be streamed
+        try:
+            iterator = iter(app_iter)
+            while True:
+                profile.enable()
+                try:
+                    chunk = next(iterator)
+                except StopIteration:
+                    break
+                finally:
+                    profile.disable()
+                yield chunk
+        finally:
+            if hasattr(app_iter, 'close'):
+                app_iter.close()
+            self.save(profile, route)
+
+    def get_filename(self, route):
+        return os.path.join(self.profile_dir, '%s.pstats' % (re.sub(r'[^a-zA-Z0-9_.-]+', '_', route).strip('_') or 'root'))
+
+    def save(self, profile, route):
+        filename = self.get_filename(route)
+        with self.lock:
+            if not os.path.exists(self.profile_dir):
+                os.makedirs(self.profile_dir)
+            stats = pstats.Stats(profile)
+            if os.path.exists(filename):
+                stats.add(filename)
+            save_stats(stats, filename, self.top, self.sort)
@@ -0,0 +1,106 @@
+# bulk rewrites of all stored transactions. months are processed concurrently by a pool of
+# processes: each one loads a month, applies an operation to its transactions and only writes
+# the month back when one of them changed. operations must be picklable, hence the classes
+from .helpers import get_storage_from_config
+from .categories import Category, compile_category_matchers, match_compiled_categories
+from multiprocessing import Pool, cpu_count
+
+
+class RemapAccountId(object):
+    def __init__(self, prev_id, new_id):
+        self.prev_id = prev_id
+        self.new_id = new_id
+
+    def __call__(self, tx):
+        if tx.account == self.prev_id:
+            return tx.update(account=self.new_id)
+        return tx
+
+
+class RemapCategory(object):
+    def __init__(self, old_category, new_category):
+        self.old_category = old_category
+        self.new_category = new_category
+
+    def __call__(self, tx):
+        if self.old_category not in (tx.categories or []):
+            return tx
+        categories = []
+        for c in tx.categories:
+            c = self.new_category if c == self.old_category else c
+            if c not in categories:
+                categories.append(c)
+        return tx.update(categories=categories)
+
+
+class RematchCategories(object):
+    def __init__(self, config):
+        self.categories = [c if isinstance(c, dict) else c.to_dict() for c in config.get('categories') or []]
+        self.matchers = None
+
+    def __getstate__(self):
+        # compiled regexps are rebuilt in each process
+        return {'categories': self.categories, 'matchers': None}
+
+    def __call__(self, tx):
+        if self.matchers is None:
+            self.matchers = compile_category_matchers(map(Category.from_dict, self.categories))
+        categories = list(tx.categories or [])
+        # existing categories keep their order so that unchanged transactions compare equal
+        new = [c for c in match_compiled_categories(self.matchers, tx.label) if c not in categories]
+        if not new:
+            return tx
+        return tx.update(categories=categories + new)
+
+
+def rewrite_transactions(transactions, operation):
+    # returns the new transactions and the number of changed (or removed) ones
+    new_transactions = []
+    changed = 0
+    for tx in transactions:
+        new_tx = operation(tx)
+        if new_tx != tx:
+            changed += 1
+        if new_tx:
+            new_transactions.append(new_tx)
+    return new_transactions, changed
+
+
+worker = {}
+
+
+def init_worker(config, operation, dry_run):
+    worker.update(storage=get_storage_from_config(config), operation=operation, dry_run=dry_run)
+
+
+def rewrite_month(date):
+    return rewrite_storage_month(worker['storage'], worker['operation'], worker['dry_run'], date)
+
+
+def rewrite_storage_month(storage, operation, dry_run, date):
+    transactions, changed = rewrite_transactions(storage.load_monthly_transactions(date), operation)
+    if changed and not dry_run:
+        storage.save_monthly_transactions(date, transactions)
+    return date, changed
+
+
+def rewrite_all_transactions(config, operation, storage=None, workers=None, dry_run=False):
+    # returns {date: number of changed transactions} for the months which changed (or
+    # would have with dry_run). workers defaults to rewrite_workers or the number of cpus
+    config = dict(config)
+    if not storage:
+        storage = get_storage_from_config(config)
+    months = sorted(storage.iter_months())
+    workers = max(1, min(int(workers or config.get('rewrite_workers') or cpu_count()), len(months)))
+
+    if workers == 1:
+        # in process, eg. from web workers where rewrites of several ledgers may run concurrently
+        results = [rewrite_storage_month(storage, operation, dry_run, date) for date in months]
+    else:
+        pool = Pool(workers, init_worker, (config, operation, dry_run))
+        try:
+            results = pool.map(rewrite_month, months, chunksize=max(1, len(months) // (workers * 4)))
+        finally:
+            pool.close()
+            pool.join()
+    return {date: changed for date, changed in results if changed}
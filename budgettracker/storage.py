@@ -1,14 +1,28 @@
-import os, json, inspect, unicodecsv, codecs, datetime, re
+from contextlib import contextmanager
+import os, json, inspect, unicodecsv, codecs, datetime, re, threading
 from .data import Account, Transaction, period_to_months, filter_transactions_period
+from . import instrumentation
+from monthdelta import monthdelta
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+state_locks = {}
+state_locks_lock = threading.Lock()
 
 
 def get_storage(name):
     for o in globals().values():
-        if inspect.isclass(o) and issubclass(o, StorageBase) and o is not StorageBase and o.name == name:
+        if inspect.isclass(o) and issubclass(o, StorageBase) and o is not StorageBase and getattr(o, 'name', None) == name:
             return o
 
 
 class StorageBase(object):
+    # last generation produced by this instance, so that its owner can tell its own writes apart
+    written_generation = None
+
     def __init__(self, config):
         self.config = config
 
@@ -18,6 +32,28 @@ class StorageBase(object):
     def save_accounts(self, accounts):
         raise NotImplementedError
 
+    def get_generation(self):
+        return None
+
+    def bump_generation(self):
+        pass
+
+    def load_state(self, name):
+        return {}
+
+    def save_state(self, name, state):
+        pass
+
+    @contextmanager
+    def lock_state(self, name):
+        yield
+
+    def get_accounts_mtime(self):
+        return None
+
+    def get_monthly_transactions_mtime(self, date):
+        return None
+
     def load_monthly_transactions(self, date):
         raise NotImplementedError
 
@@ -30,6 +66,13 @@ class StorageBase(object):
             transactions.extend(self.load_monthly_transactions(date))
         return filter_transactions_period(transactions, start_date, end_date)
 
+    def iter_period_transactions(self, start_date, end_date):
+        # end_date is excluded but the month it falls in is read when it is not its first day
+        last_month = (end_date - datetime.timedelta(days=1)).replace(day=1)
+        for date in period_to_months(start_date, last_month + monthdelta(1)):
+            for tx in filter_transactions_period(self.load_monthly_transactions(date), start_date, end_date):
+                yield tx
+
     def load_yearly_transactions(self, date):
         start_date = date.replace(day=1, month=1)
         end_date = start_date.replace(year=start_date.year+1)
@@ -39,8 +82,10 @@ class StorageBase(object):
         raise NotImplementedError
 
     def iter_monthly_transactions_for_update(self, date, iterator):
-        transactions = filter(bool, map(iterator, self.load_monthly_transactions(date)))
-        self.save_monthly_transactions(date, transactions)
+        transactions = self.load_monthly_transactions(date)
+        new_transactions = filter(bool, map(iterator, transactions))
+        if new_transactions != transactions:
+            self.save_monthly_transactions(date, new_transactions)
 
     def iter_all_transactions_for_update(self, iterator):
         for date in self.iter_months():
@@ -59,10 +104,13 @@ class FileStorageBase(StorageBase):
 
     @property
     def directory(self):
-        path = self.config.get('storage_dir', os.environ.get('BUDGET_DIR', '.'))
-        if not os.path.exists(path):
-            os.makedirs(path)
-        return path
+        # the directory is only checked (and created) on first access
+        if self.__dict__.get('directory') is None:
+            path = self.config.get('storage_dir', os.environ.get('BUDGET_DIR', '.'))
+            if not os.path.exists(path):
+                os.makedirs(path)
+            self.__dict__['directory'] = path
+        return self.__dict__['directory']
 
     def get_accounts_filename(self):
         filename = 'accounts.%s' % self.extension
@@ -76,6 +124,84 @@ class FileStorageBase(StorageBase):
             filename = os.path.join(self.directory, filename)
         return filename
 
+    def get_generation_filename(self):
+        return os.path.join(self.directory, '.generation')
+
+    def get_generation(self):
+        try:
+            with open(self.get_generation_filename()) as f:
+                return f.read()
+        except IOError:
+            return None
+
+    def bump_generation(self):
+        # the generation changes on every write so that other processes can detect stale caches.
+        # a random suffix guarantees a change even if two processes bump concurrently
+        try:
+            counter = int((self.get_generation() or '0').split('-')[0])
+        except ValueError:
+            counter = 0
+        token = os.urandom(4).encode('hex')
+        generation = '%s-%s' % (counter + 1, token)
+        filename = self.get_generation_filename()
+        with open('%s.%s.tmp' % (filename, token), 'w') as f:
+            f.write(generation)
+        os.rename('%s.%s.tmp' % (filename, token), filename)
+        self.written_generation = generation
+        return generation
+
+    def get_state_filename(self, name):
+        return os.path.join(self.directory, '.%s.json' % name)
+
+    def load_state(self, name):
+        filename = self.get_state_filename(name)
+        if not os.path.exists(filename):
+            return {}
+        with codecs.open(filename) as f:
+            return json.load(f)
+
+    def save_state(self, name, state):
+        # states may be saved by concurrent processes (eg. web workers), the last one wins
+        filename = self.get_state_filename(name)
+        tmp_filename = '%s.%s.tmp' % (filename, os.urandom(4).encode('hex'))
+        with codecs.open(tmp_filename, 'w') as f:
+            json.dump(state, f, indent=2)
+        os.rename(tmp_filename, filename)
+
+    @contextmanager
+    def lock_state(self, name):
+        # serializes a load_state() / save_state() cycle across threads and processes
+        filename = '%s.lock' % self.get_state_filename(name)
+        with state_locks_lock:
+            lock = state_locks.setdefault(os.path.abspath(filename), threading.Lock())
+        with lock:
+            if not fcntl:
+                yield
+                return
+            with open(filename, 'w') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def get_file_mtime(self, filename):
+        try:
+            return os.path.getmtime(filename)
+        except OSError:
+            return None
+
+    def get_accounts_mtime(self):
+        return self.get_file_mtime(self.get_accounts_filename())
+
+    def get_monthly_transactions_mtime(self, date):
+        return self.get_file_mtime(self.get_monthly_transactions_filename(date))
+
+    def count_file_read(self, filename):
+        if instrumentation.enabled:
+            instrumentation.incr('storage_files_read')
+            instrumentation.incr('storage_bytes_read', os.path.getsize(filename))
+
     def load_transactions(self, filename):
         raise NotImplementedError
 
@@ -86,12 +212,17 @@ class FileStorageBase(StorageBase):
         return self.load_transactions(self.get_monthly_transactions_filename(date))
 
     def save_monthly_transactions(self, date, transactions):
-        self.save_transactions(transactions, self.get_monthly_transactions_filename(date))
+        # written to a temporary file first so that readers never see a partially written month
+        filename = self.get_monthly_transactions_filename(date)
+        tmp_filename = '%s.%s.tmp' % (filename, os.urandom(4).encode('hex'))
+        self.save_transactions(transactions, tmp_filename)
+        os.rename(tmp_filename, filename)
+        self.bump_generation()
 
     def iter_months(self):
         for filename in os.listdir(self.directory):
             pathname = os.path.join(self.directory, filename)
-            if not os.path.isfile(pathname) or not re.match(r"[0-9]{4}-[0-9]{2}\.%s" % self.extension, filename):
+            if not os.path.isfile(pathname) or not re.match(r"[0-9]{4}-[0-9]{2}\.%s$" % self.extension, filename):
                 continue
             yield datetime.date(*map(int, filename.split('.')[0].split('-') + [1]))
 
@@ -100,16 +231,20 @@ class CSVStorage(FileStorageBase):
     name = 'csv'
     extension = 'csv'
 
+    @instrumentation.timed('storage_load')
     def load_accounts(self):
         filename = self.get_accounts_filename()
         if not os.path.exists(filename):
             return []
+        self.count_file_read(filename)
         with codecs.open(filename) as f:
             return map(self._csv_row_to_account, unicodecsv.reader(f))
 
+    @instrumentation.timed('storage_load')
     def load_transactions(self, filename):
         if not os.path.exists(filename):
             return []
+        self.count_file_read(filename)
         with codecs.open(filename) as f:
             return map(self._csv_row_to_transaction, unicodecsv.reader(f))
 
@@ -118,12 +253,13 @@ class CSVStorage(FileStorageBase):
             writer = unicodecsv.writer(f)
             for acc in accounts:
                 writer.writerow(acc)
+        self.bump_generation()
 
     def save_transactions(self, transactions, filename):
         with codecs.open(filename, 'w') as f:
             writer = unicodecsv.writer(f)
             for tx in transactions:
-                writer.writerow(self._transaction_to_csv_row(tx))
+                writer.writerow(tx.to_csv_row())
 
     def _csv_row_to_account(self, row):
         return Account(row[0], row[1], float(row[2]))
@@ -132,30 +268,32 @@ class CSVStorage(FileStorageBase):
         return Transaction(row[0], row[1], datetime.datetime.strptime(row[2], "%Y-%m-%d").date(),
             float(row[3]), row[4], filter(unicode.strip, row[5].split(',')), row[6] or None)
 
-    def _transaction_to_csv_row(self, tx):
-        return [tx.id, tx.label, tx.date.isoformat(), tx.amount, tx.account, ', '.join(tx.categories), tx.goal]
-
 
 class JSONStorage(FileStorageBase):
     name = 'json'
     extension = 'json'
 
+    @instrumentation.timed('storage_load')
     def load_accounts(self):
         filename = self.get_accounts_filename()
         if not os.path.exists(filename):
             return []
+        self.count_file_read(filename)
         with codecs.open(filename) as f:
             return json.load(f, object_hook=lambda dct: Account.from_dict(dct))
 
+    @instrumentation.timed('storage_load')
     def load_transactions(self, filename):
         if not os.path.exists(filename):
             return []
+        self.count_file_read(filename)
         with codecs.open(filename) as f:
             return json.load(f, object_hook=lambda dct: Transaction.from_dict(dct))
 
     def save_accounts(self, accounts):
         with codecs.open(self.get_accounts_filename(), 'w') as f:
             json.dump(map(lambda acc: acc.to_dict(), accounts), f, indent=2)
+        self.bump_generation()
 
     def save_transactions(self, transactions, filename):
         with codecs.open(filename, 'w') as f:
@@ -1,28 +1,65 @@
-from flask import Flask, render_template, jsonify, request, session, redirect, url_for, abort
+from flask import Flask, Response, render_template as _render_template, jsonify, request, session, redirect, url_for, abort, g
 from werkzeug.utils import secure_filename
+from werkzeug.http import is_resource_modified
+from werkzeug.exceptions import HTTPException
+from werkzeug.local import LocalProxy
 from monthdelta import monthdelta
 from tempfile import NamedTemporaryFile
-import datetime, functools, json, unicodecsv, StringIO, os, uuid, math
-from ..data import sort_transactions
+import datetime, functools, json, unicodecsv, StringIO, os, uuid, math, hashlib, time
+from ..data import sort_transactions, period_to_months
 from ..budget import IncomeSource, PlannedExpense, BudgetGoal
 from ..categories import Category, compute_categories
-from ..helpers import (load_config, save_config, get_storage_from_config, get_bank_adapter_from_config,
-                       load_yearly_budgets_from_config, load_monthly_budget_from_config, update_local_data,
+from .. import instrumentation
+from ..profiling import ProfilerMiddleware
+from ..goals import get_goals_first_year
+from ..ingest import record_imported_file, file_checksum
+from ..helpers import (load_config, load_yearly_budgets_from_config, load_monthly_budget_from_config, update_local_data,
                        compute_yearly_budget_goals_from_config, compute_monthly_categories_from_config,
-                       rematch_categories, create_amount_formatter)
+                       rematch_categories, create_amount_formatter, CONFIG_FILENAME)
+from .ledgers import Ledger, LedgerRegistry, LedgerDispatcher, current, get_current_ledger
 
 
 app = Flask(__name__)
-config = load_config()
-storage = get_storage_from_config(config)
-bank_adapter = get_bank_adapter_from_config(config)
-app.config['SECRET_KEY'] = config.get('web_passcode', 'budgettracker')
 app.config['ASSETS_HASH'] = str(uuid.uuid4()).split('-')[0]
-app.config.update(config.get('web_config', {}))
 
+
+# the config of the process. it either describes the only ledger served or declares several
+# ones in web_ledgers, each with its own config file (passcode included) and storage
+process_config = load_config()
+if process_config.get('web_ledgers'):
+    # sessions hold the names of the unlocked ledgers, a guessable key would unlock all of them
+    if not process_config.get('web_secret_key'):
+        raise Exception("web_secret_key must be set when serving several ledgers")
+    ledgers = LedgerRegistry([Ledger.from_dict(name, dct) for name, dct in process_config['web_ledgers'].items()],
+        process_config.get('web_ledgers_max_loaded', 8), process_config.get('web_ledgers_idle_timeout', 900))
+    app.config['SECRET_KEY'] = process_config['web_secret_key']
+else:
+    ledgers = LedgerRegistry([Ledger('default', CONFIG_FILENAME)])
+    app.config['SECRET_KEY'] = process_config.get('web_secret_key', process_config.get('web_passcode', 'budgettracker'))
+app.config.update(process_config.get('web_config', {}))
+instrumentation.enable(process_config.get('instrumentation', False))
+
+# routes refer to the ledger of the current request (or job) through these
+config = LocalProxy(lambda: get_current_ledger().config)
+storage = LocalProxy(lambda: get_current_ledger().storage)
+bank_adapter = LocalProxy(lambda: get_current_ledger().bank_adapter)
+jobs = LocalProxy(lambda: get_current_ledger().jobs)
 months_labels = list(enumerate(['JAN', 'FEB', 'MAR', 'APR', 'MAY', 'JUN', 'JUL', 'AUG', 'SEP', 'OCT', 'NOV', 'DEC']))
 
 
+def get_route_name(environ):
+    try:
+        return app.url_map.bind_to_environ(environ).match()[0]
+    except HTTPException:
+        return 'unknown'
+
+
+if process_config.get('web_profile_dir'):
+    app.wsgi_app = ProfilerMiddleware(app.wsgi_app, process_config['web_profile_dir'],
+        process_config.get('web_profile_sample_rate', 1.0), get_route_name)
+app.wsgi_app = LedgerDispatcher(app.wsgi_app, ledgers)
+
+
 def value_class(value, warning_threshold=None, zero_as_neg=False):
     if warning_threshold is not None:
         if value > 0 and value < warning_threshold:
@@ -34,58 +71,216 @@ def value_class(value, warning_threshold=None, zero_as_neg=False):
 
 @app.context_processor
 def utility_processor():
-    categories = map(Category.from_dict, config.get('categories', []))
     return dict(
         famount=create_amount_formatter(config),
         max=max,
         ceil=math.ceil,
         current_month=datetime.date.today().replace(day=1),
         value_class=value_class,
-        config_categories=categories,
-        category_colors={c.name: c.color for c in categories},
-        config_budget_goals=map(BudgetGoal.from_dict, config.get('budget_goals', []))
+        config_categories=config.categories,
+        category_colors={c.name: c.color for c in config.categories},
+        config_budget_goals=config.budget_goals
     )
 
 
+def yearly_months(year=None, month=None, **kwargs):
+    year = year or datetime.date.today().year
+    start_date = datetime.date(get_goals_first_year(config.budget_goals, year), 1, 1)
+    end_date = datetime.date(year + 1, 1, 1)
+    months = period_to_months(start_date, end_date)
+    if config.get('income_delay'):
+        months.append(end_date)
+    return months
+
+
+# months of storage each route reads, used to compute its ETag and Last-Modified validators.
+# budgets always compute the yearly goals so even monthly routes depend on the whole year
+# (and on previous years when goals carry over).
+route_dependencies = {
+    'index': yearly_months,
+    'year': yearly_months,
+    'income': yearly_months,
+    'planned_expenses': yearly_months,
+    'category': yearly_months,
+    'goal': yearly_months,
+    'budget_json': yearly_months,
+    'transactions_json': yearly_months,
+    'transactions_csv': yearly_months
+}
+
+
+def get_dependencies_mtimes(months):
+    mtimes = [storage.get_monthly_transactions_mtime(date) for date in months]
+    mtimes.extend([storage.get_accounts_mtime(), get_current_ledger().get_config_mtime()])
+    return mtimes
+
+
+def compute_validators(mtimes):
+    today = datetime.date.today()
+    etag = hashlib.sha1(repr((get_current_ledger().name, request.path, today, app.config['ASSETS_HASH'],
+        mtimes))).hexdigest()
+    # pages depend on the current date so the day rollover counts as a modification
+    last_modified = max(filter(None, mtimes) + [time.mktime(today.timetuple())])
+    return etag, datetime.datetime.utcfromtimestamp(int(last_modified))
+
+
+def conditional(func):
+    dependencies = route_dependencies[func.__name__]
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        g.dependencies_mtimes = get_dependencies_mtimes(dependencies(*args, **kwargs))
+        etag, last_modified = compute_validators(g.dependencies_mtimes)
+        if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+            response = app.response_class(status=304)
+        else:
+            response = app.make_response(func(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+        response.set_etag(etag)
+        response.last_modified = last_modified
+        response.cache_control.no_cache = True
+        return response
+    return wrapper
+
+
+def cached_context(func):
+    # contexts are keyed by (route, year, ...) and the current date as most pages depend on it.
+    # the dependencies mtimes are stored alongside to catch files written by other processes
+    @functools.wraps(func)
+    def wrapper(*args):
+        key = (func.__name__,) + args + (datetime.date.today(),)
+        mtimes = g.get('dependencies_mtimes')
+        ledger = get_current_ledger()
+        with ledger.view_cache_lock:
+            entry = ledger.view_cache.pop(key, None)
+            if entry and entry[0] == mtimes:
+                ledger.view_cache[key] = entry
+                return entry[1]
+        context = func(*args)
+        with ledger.view_cache_lock:
+            ledger.view_cache[key] = (mtimes, context)
+            while len(ledger.view_cache) > config.get('web_view_cache_size', 64):
+                ledger.view_cache.popitem(last=False)
+        return context
+    return wrapper
+
+
+def invalidate_view_cache(date=None):
+    if not date:
+        get_current_ledger().invalidate_view_cache()
+        return
+    # goals are computed over the whole year and the previous year may look into january for income
+    years = [date.year]
+    if config.get('income_delay') and date.month == 1:
+        years.append(date.year - 1)
+    # goals carrying over from this year change the following ones as well
+    since_year = None
+    if get_goals_first_year(config.budget_goals, date.year + 1) <= date.year:
+        since_year = date.year + 1
+    get_current_ledger().invalidate_view_cache(years, since_year)
+
+
+def render_template(template_name, **context):
+    with instrumentation.timer('template_rendering'):
+        return _render_template(template_name, **context)
+
+
+@app.before_request
+def start_instrumentation():
+    if instrumentation.enabled:
+        instrumentation.start_request()
+
+
+@app.after_request
+def add_server_timing(response):
+    measures = instrumentation.end_request() if instrumentation.enabled else None
+    if measures:
+        timings, counters = measures
+        instrumentation.observe('request', timings['total'][0], endpoint=request.endpoint or '')
+        response.headers['Server-Timing'] = instrumentation.format_server_timing(timings, counters)
+    return response
+
+
+@app.before_request
+def activate_ledger():
+    ledger = request.environ['budgettracker.ledger']
+    ledgers.acquire(ledger)
+    g.ledger = current.ledger = ledger
+    ledger.refresh()
+
+
+@app.teardown_request
+def release_ledger(exc=None):
+    if g.get('ledger'):
+        ledgers.release(g.ledger)
+    current.ledger = None
+
+
+def is_allowed():
+    # sessions are shared by ledgers served under prefixes of the same host
+    return get_current_ledger().name in session.get('ledgers', [])
+
+
 def requires_passcode(func):
     @functools.wraps(func)
     def wrapper(*args, **kwargs):
-        if config.get('web_passcode') and not session.get('allowed') and (
+        if config.get('web_passcode') and not is_allowed() and (
           not request.authorization or request.authorization.username != config['web_passcode']):
             return redirect(url_for('login'))
         return func(*args, **kwargs)
     return wrapper
 
 
+@app.route('/metrics')
+@requires_passcode
+def metrics():
+    if not instrumentation.enabled:
+        abort(404)
+    return Response(instrumentation.format_prometheus(), mimetype='text/plain; version=0.0.4')
+
+
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     if not config.get('web_passcode'):
         return redirect(url_for('index'))
     if request.method == 'POST':
         if request.form['code'] == config.get('web_passcode'):
-            session['allowed'] = True
+            session['ledgers'] = session.get('ledgers', []) + [get_current_ledger().name]
             return redirect(url_for('index'))
     return render_template('login.html')
 
 
 @app.route('/logout')
 def logout():
-    if 'allowed' in session:
-        del session['allowed']
+    if is_allowed():
+        session['ledgers'] = [name for name in session['ledgers'] if name != get_current_ledger().name]
     return redirect(url_for('index'))
 
 
 @app.route('/')
 @app.route('/<int:year>/<int:month>')
 @requires_passcode
+@conditional
 def index(year=None, month=None):
-    current = datetime.date.today().replace(day=1)
     if year:
         date = datetime.date(year, month, 1)
     else:
-        date = current
+        date = datetime.date.today().replace(day=1)
 
     accounts = storage.load_accounts()
+    return render_template('index.html',
+        accounts=accounts,
+        account_balance=sum([a.amount for a in accounts]),
+        bank_adapter=bank_adapter,
+        months=months_labels,
+        **compute_index_context(date.year, date.month))
+
+
+@cached_context
+def compute_index_context(year, month):
+    current = datetime.date.today().replace(day=1)
+    date = datetime.date(year, month, 1)
+
     budgets = load_yearly_budgets_from_config(config, date, storage=storage)
     budget = budgets.get_from_date(date)
     categories = compute_monthly_categories_from_config(config, date, storage=storage)
@@ -103,30 +298,36 @@ def index(year=None, month=None):
     for i in range(2, nb_days_in_current_month + 1):
         chart_expenses_per_day.append(round(chart_expenses_per_day[i - 2] + expenses_per_day.get(i, 0), 2))
         chart_ideal_expenses.append(round(daily_safe_to_spend * i, 2))
-    
-    return render_template('index.html',
+
+    return dict(
         date=date,
         prev_date=(date - monthdelta(1)),
         next_date=(date + monthdelta(1)) if date < current else None,
-        accounts=accounts,
-        account_balance=sum([a.amount for a in accounts]),
         budgets=budgets,
         budget=budget,
         chart_expenses_per_day=chart_expenses_per_day,
         chart_ideal_expenses=chart_ideal_expenses,
         chart_expenses_per_day_labels=range(1, nb_days_in_current_month + 1),
-        bank_adapter=bank_adapter,
-        categories=categories,
-        months=months_labels)
+        categories=categories)
 
 
 @app.route('/<int:year>')
 @requires_passcode
+@conditional
 def year(year):
+    accounts = storage.load_accounts()
+    return render_template('year.html',
+        accounts=accounts,
+        account_balance=sum([a.amount for a in accounts]),
+        months=months_labels,
+        **compute_year_context(year))
+
+
+@cached_context
+def compute_year_context(year):
     current = datetime.date.today().replace(day=1)
     date = datetime.date(year, 1, 1)
     nb_months = 12 if date.year < current.year else current.month
-    accounts = storage.load_accounts()
     budgets = load_yearly_budgets_from_config(config, date, storage=storage)
 
     budget_goals, savings_after_goals = compute_yearly_budget_goals_from_config(
@@ -143,15 +344,13 @@ def year(year):
         planned_savings = budgets.expected_income - budgets.expected_planned_expenses
 
     categories = compute_categories(budgets.transactions,
-        map(Category.from_dict, config.get('categories', [])),
+        config.categories,
         warning_threshold_multiplier=12)
 
-    return render_template('year.html',
+    return dict(
         date=date,
         prev_year=(year - 1),
         next_year=(year + 1) if year < current.year else None,
-        accounts=accounts,
-        account_balance=sum([a.amount for a in accounts]),
         budgets=budgets,
         budget_goals=budget_goals,
         savings_goal=savings_goal,
@@ -161,7 +360,6 @@ def year(year):
         expected_savings=expected_savings,
         planned_savings=planned_savings,
         categories=categories,
-        months=months_labels,
         nb_months=nb_months,
         chart_months=[l for i, l in months_labels],
         chart_incomes=[round(b.income if b.month < current else b.expected_income, 2) for b in budgets],
@@ -173,7 +371,13 @@ def year(year):
 
 @app.route('/<int:year>/income')
 @requires_passcode
+@conditional
 def income(year):
+    return render_template('transactions_list.html', **compute_income_context(year))
+
+
+@cached_context
+def compute_income_context(year):
     current = datetime.date.today().replace(day=1)
     date = datetime.date(year, 1, 1)
     budgets = load_yearly_budgets_from_config(config, date, storage=storage)
@@ -182,7 +386,7 @@ def income(year):
     for budget in budgets:
         chart_amounts[budget.month.month - 1] = budget.income
 
-    return render_template('transactions_list.html',
+    return dict(
         page_title='Income',
         date=date,
         prev_year=(year - 1),
@@ -196,7 +400,13 @@ def income(year):
 
 @app.route('/<int:year>/planned-expenses')
 @requires_passcode
+@conditional
 def planned_expenses(year):
+    return render_template('transactions_list.html', **compute_planned_expenses_context(year))
+
+
+@cached_context
+def compute_planned_expenses_context(year):
     current = datetime.date.today().replace(day=1)
     date = datetime.date(year, 1, 1)
     budgets = load_yearly_budgets_from_config(config, date, storage=storage)
@@ -205,7 +415,7 @@ def planned_expenses(year):
     for budget in budgets:
         chart_amounts[budget.month.month - 1] = budget.planned_expenses
 
-    return render_template('transactions_list.html',
+    return dict(
         page_title='Planned expenses',
         date=date,
         prev_year=(year - 1),
@@ -219,14 +429,22 @@ def planned_expenses(year):
 
 @app.route('/<int:year>/categories/<name>')
 @requires_passcode
+@conditional
 def category(year, name):
+    context = compute_category_context(year, name.lower())
+    if not context:
+        abort(404)
+    return render_template('category.html', **context)
+
+
+@cached_context
+def compute_category_context(year, name):
     current = datetime.date.today().replace(day=1)
     date = datetime.date(year, 1, 1)
-    name = name.lower()
 
     transactions = storage.load_yearly_transactions(date)
     categories = compute_categories(transactions,
-        map(Category.from_dict, config.get('categories', [])),
+        config.categories,
         warning_threshold_multiplier=12)
 
     transactions = sort_transactions(filter(
@@ -241,9 +459,9 @@ def category(year, name):
 
     category = [c for c in categories if (c.name and c.name.lower() == name) or (not c.name and name == 'uncategorized')]
     if not category:
-        abort(404)
+        return None
 
-    return render_template('category.html',
+    return dict(
         date=date,
         prev_year=(year - 1),
         next_year=(year + 1) if year < current.year else None,
@@ -258,10 +476,18 @@ def category(year, name):
 
 @app.route('/<int:year>/goals/<label>')
 @requires_passcode
+@conditional
 def goal(year, label):
+    context = compute_goal_context(year, label.lower())
+    if not context:
+        abort(404)
+    return render_template('goal.html', **context)
+
+
+@cached_context
+def compute_goal_context(year, label):
     current = datetime.date.today().replace(day=1)
     date = datetime.date(year, 1, 1)
-    label = label.lower()
 
     budgets = load_yearly_budgets_from_config(config, date, storage=storage)
 
@@ -270,7 +496,7 @@ def goal(year, label):
 
     goal = [g for g in budget_goals if g.label.lower() == label]
     if not goal:
-        abort(404)
+        return None
 
     transactions = sort_transactions(filter(
         lambda tx: tx.amount < 0 and tx.goal and tx.goal.lower() == label, budgets.transactions))
@@ -280,10 +506,10 @@ def goal(year, label):
         chart_amounts[tx.date.month - 1] += abs(tx.amount)
 
     categories = compute_categories(transactions,
-        map(Category.from_dict, config.get('categories', [])),
+        config.categories,
         warning_threshold_multiplier=12)
 
-    return render_template('goal.html',
+    return dict(
         date=date,
         prev_year=(year - 1),
         next_year=(year + 1) if year < current.year else None,
@@ -297,6 +523,7 @@ def goal(year, label):
 
 @app.route('/<int:year>/<int:month>/budget.json')
 @requires_passcode
+@conditional
 def budget_json(year, month):
     date = datetime.date(year, month, 1)
     budget = load_monthly_budget_from_config(config, date, storage=storage)
@@ -305,6 +532,7 @@ def budget_json(year, month):
 
 @app.route('/<int:year>/<int:month>/transactions.json')
 @requires_passcode
+@conditional
 def transactions_json(year, month):
     date = datetime.date(year, month, 1)
     budget = load_monthly_budget_from_config(config, date, storage=storage)
@@ -313,15 +541,66 @@ def transactions_json(year, month):
 
 @app.route('/<int:year>/<int:month>/transactions.csv')
 @requires_passcode
+@conditional
 def transactions_csv(year, month):
     date = datetime.date(year, month, 1)
     budget = load_monthly_budget_from_config(config, date, storage=storage)
+    return Response(iter_transactions_as_csv(budget.transactions), mimetype='text/csv',
+        headers={"Content-Disposition": "attachment; filename=%s-%s.csv" % (year, month)})
+
+
+def iter_transactions_as_csv(transactions):
     out = StringIO.StringIO()
     writer = unicodecsv.writer(out)
-    for tx in budget.transactions:
-        writer.writerow(tx)
-    return out.getvalue(), {"Content-Disposition": "attachment; filename=%s-%s.csv" % (year, month),
-                 "Content-Type": "text/csv"}
+    for tx in transactions:
+        writer.writerow(tx.to_csv_row())
+        yield out.getvalue()
+        out.seek(0)
+        out.truncate()
+
+
+def iter_transactions_as_ndjson(transactions):
+    for tx in transactions:
+        yield json.dumps(tx.to_dict()) + '\n'
+
+
+export_formats = {
+    'csv': ('text/csv', iter_transactions_as_csv),
+    'ndjson': ('application/x-ndjson', iter_transactions_as_ndjson)
+}
+
+
+@app.route('/export')
+@requires_passcode
+def export():
+    try:
+        start_date = datetime.datetime.strptime(request.args['start'], '%Y-%m-%d').date()
+        end_date = datetime.datetime.strptime(request.args['end'], '%Y-%m-%d').date() \
+            if request.args.get('end') else datetime.date.today() + datetime.timedelta(days=1)
+    except (KeyError, ValueError):
+        abort(400)
+    format = request.args.get('format', 'csv')
+    if format not in export_formats or end_date <= start_date:
+        abort(400)
+
+    account = request.args.get('account')
+    category = request.args.get('category', '').lower()
+    goal = request.args.get('goal', '').lower()
+    def match(tx):
+        if account and tx.account != account:
+            return False
+        if category and not ((tx.categories and category in [c.lower() for c in tx.categories]) or (
+          category == 'uncategorized' and not tx.categories)):
+            return False
+        if goal and (not tx.goal or tx.goal.lower() != goal):
+            return False
+        return True
+
+    # transactions are streamed month by month from storage so memory does not grow with the period
+    transactions = (tx for tx in storage.iter_period_transactions(start_date, end_date) if match(tx))
+    mimetype, serializer = export_formats[format]
+    return Response(serializer(transactions), mimetype=mimetype, headers={
+        "Content-Disposition": "attachment; filename=%s_%s.%s" % (start_date.isoformat(), end_date.isoformat(), format)})
 
 
 @app.route('/<int:year>/<int:month>/<transaction_id>', methods=['POST'])
@@ -330,17 +609,15 @@ def update_transaction(year, month, transaction_id):
     categories = request.form.getlist('categories')
     goal = request.form.get('goal')
     storage.update_transaction(date, transaction_id, categories=categories, goal=goal)
+    invalidate_view_cache(date)
 
-    existing_categories = [c['name'] for c in config.get('categories') or []]
-    has_new_categories = False
-    for category in categories:
-        if category not in existing_categories:
-            if not config.get('categories'):
-                config['categories'] = []
-            config['categories'].append({'name': category})
-            has_new_categories = True
-    if has_new_categories:
-        save_config(config)
+    existing_categories = [c.name for c in config.categories]
+    new_categories = [{'name': c} for c in categories if c not in existing_categories]
+    if new_categories:
+        with get_current_ledger().config_lock:
+            new_config = config.to_dict()
+            new_config['categories'] = (new_config.get('categories') or []) + new_categories
+            replace_config(new_config)
 
     return ''
 
@@ -360,27 +637,56 @@ def update(year, month):
                 '%s-%s' % (datetime.date.today().isoformat(), secure_filename(file.filename)))
             if not os.path.exists(os.path.dirname(filename)):
                 os.makedirs(os.path.dirname(filename))
+            # ingest watches this directory. the upload is saved under a hidden name (ignored by
+            # ingest) and only gets its final name once recorded as imported
+            upload_filename = os.path.join(os.path.dirname(filename), '.%s' % os.path.basename(filename))
+            file.save(upload_filename)
+            record_imported_file(storage, filename, file_checksum(upload_filename))
+            os.rename(upload_filename, filename)
         else:
             temp_file = NamedTemporaryFile(delete=False)
             filename = temp_file.name
             temp_file.close()
             delete_file = True
-        file.save(filename)
-    update_local_data(config, date=date, filename=filename, storage=storage)
-    if delete_file:
-        os.unlink(filename)
+            file.save(filename)
+    job = jobs.submit(run_update, get_current_ledger(), date, filename, delete_file, lock_key=date)
+    if request.accept_mimetypes.accept_json and not request.accept_mimetypes.accept_html:
+        return job_response(job.to_dict()), 202
     return redirect(url_for('index', year=year, month=month))
 
 
+def run_update(ledger, date, filename, delete_file, progress):
+    try:
+        with ledger.activate():
+            update_local_data(config, date=date, filename=filename, storage=storage, progress=progress)
+            invalidate_view_cache(date)
+    finally:
+        if delete_file:
+            os.unlink(filename)
+
+
+def job_response(job):
+    return jsonify(dict(job, url=url_for('job_status', job_id=job['id'])))
+
+
+@app.route('/jobs/<job_id>.json')
+@requires_passcode
+def job_status(job_id):
+    job = jobs.get(job_id)
+    if not job:
+        abort(404)
+    return job_response(job)
+
+
 @app.route('/settings', methods=['GET', 'POST'])
 @requires_passcode
 def settings():
-    global config
     if request.method == 'POST':
         date_cast = lambda d: datetime.datetime.strptime(d, '%Y-%m-%d').date() if d else ''
         color_cast = lambda c: '#%s' % c if not c.startswith('#') else c
         keywords_cast = lambda k: filter(bool, map(unicode.strip, k.split(',')))
         optional_float_cast = lambda f: float(f) if f else None
+        optional_int_cast = lambda i: int(i) if i else None
         income_sources = map(lambda a: IncomeSource(*a), zip(
             request.form.getlist('income_sources_label'),
             request.form.getlist('income_sources_amount', float),
@@ -396,26 +702,37 @@ def settings():
             request.form.getlist('planned_expenses_to_date', date_cast)))
         budget_goals = map(lambda a: BudgetGoal(*a), zip(
             request.form.getlist('budget_goals_label'),
-            request.form.getlist('budget_goals_amount', optional_float_cast)))
+            request.form.getlist('budget_goals_amount', optional_float_cast),
+            request.form.getlist('budget_goals_from_date', date_cast),
+            request.form.getlist('budget_goals_to_date', date_cast),
+            request.form.getlist('budget_goals_priority', optional_int_cast),
+            request.form.getlist('budget_goals_weight', optional_float_cast)))
         categories = map(lambda a: Category(*a), zip(
             request.form.getlist('categories_name'),
             request.form.getlist('categories_color', color_cast),
             request.form.getlist('categories_keywords', keywords_cast),
             request.form.getlist('categories_warning_threshold', optional_float_cast)))
 
-        config.update(
-          income_sources=map(lambda s: s.to_dict(), income_sources),
-          planned_expenses=map(lambda e: e.to_dict(), planned_expenses),
-          budget_goals=map(lambda g: g.to_dict(), budget_goals),
-          categories=map(lambda c: c.to_dict(), categories))
-
-        save_config(config)
-        rematch_categories(config, storage)
+        with get_current_ledger().config_lock:
+            new_config = config.to_dict()
+            new_config.update(
+              income_sources=map(lambda s: s.to_dict(), income_sources),
+              planned_expenses=map(lambda e: e.to_dict(), planned_expenses),
+              budget_goals=map(lambda g: g.to_dict(), budget_goals),
+              categories=map(lambda c: c.to_dict(), categories))
+            replace_config(new_config)
+        # no process pool from within a (threaded) web worker
+        rematch_categories(config, storage, workers=1)
+        invalidate_view_cache()
         return redirect(url_for('index'))
 
     return render_template('settings.html',
         config=config,
-        income_sources=map(IncomeSource.from_dict, config.get('income_sources', [])),
-        planned_expenses=map(PlannedExpense.from_dict, config.get('planned_expenses', [])),
-        budget_goals=map(BudgetGoal.from_dict, config.get('budget_goals', [])),
-        categories=map(Category.from_dict, config.get('categories', [])))
+        income_sources=config.income_sources,
+        planned_expenses=config.planned_expenses,
+        budget_goals=config.budget_goals,
+        categories=config.categories)
+
+
+def replace_config(new_config):
+    get_current_ledger().replace_config(new_config)
@@ -0,0 +1,187 @@
+# one web process can serve several ledgers (a config file and the storage directory it points to),
+# each one selected by hostname and/or url prefix. ledgers are loaded on first use and the parsed
+# config, storage and cached pages of the least recently used ones are dropped once too many are
+# loaded or once they have been idle for a while
+from werkzeug.exceptions import NotFound
+from collections import OrderedDict
+from contextlib import contextmanager
+from ..helpers import load_config, save_config, get_storage_from_config, get_bank_adapter_from_config
+from ..config import compile_config
+from ..jobs import JobQueue
+import threading, time, os
+
+
+current = threading.local()
+
+
+def get_current_ledger():
+    ledger = getattr(current, 'ledger', None)
+    if ledger is None:
+        raise RuntimeError("No ledger is active in this thread")
+    return ledger
+
+
+class Ledger(object):
+    def __init__(self, name, config_filename, prefix=None, host=None, default_storage_dir=None):
+        self.name = name
+        self.config_filename = config_filename
+        self.prefix = prefix.rstrip('/') if prefix else None
+        self.host = host.lower() if host else None
+        self.default_storage_dir = default_storage_dir
+        self.config = None
+        self.storage = None
+        self.bank_adapter = None
+        self.generation = None
+        self.config_mtime = None
+        self.jobs = None
+        self.view_cache = OrderedDict()
+        self.view_cache_lock = threading.Lock()
+        self.config_lock = threading.Lock()
+        self.lock = threading.Lock()
+        self.active_requests = 0
+        self.last_used = 0
+
+    @classmethod
+    def from_dict(cls, name, dct):
+        # the storage of a declared ledger defaults to the directory of its config file
+        return cls(name, dct['config'], dct.get('prefix'), dct.get('host'),
+            os.path.dirname(os.path.abspath(dct['config'])))
+
+    @property
+    def loaded(self):
+        return self.config is not None
+
+    @property
+    def idle(self):
+        return not self.active_requests and (not self.jobs or not self.jobs.queue.unfinished_tasks)
+
+    def load(self):
+        self.config_mtime = self.get_config_mtime()
+        config = load_config(self.config_filename)
+        if self.default_storage_dir and 'storage_dir' not in config:
+            config = compile_config(dict(config.to_dict(), storage_dir=self.default_storage_dir))
+        storage = get_storage_from_config(config)
+        self.bank_adapter = get_bank_adapter_from_config(config)
+        self.storage = storage
+        self.config = config
+        if not self.jobs:
+            # kept when the ledger is unloaded, jobs may still be running
+            self.jobs = JobQueue(config.get('web_update_workers', 2),
+                state_dir=os.path.join(config.get('storage_dir', os.environ.get('BUDGET_DIR', '.')), '.jobs'))
+
+    def unload(self):
+        with self.lock:
+            self.config = self.storage = self.bank_adapter = self.generation = self.config_mtime = None
+            self.invalidate_view_cache()
+
+    def refresh(self):
+        # the storage generation changes whenever any process (other web workers, the cli) writes
+        # data or the config. writes made by this process already invalidated the contexts they
+        # affect, other ones drop the whole view cache. the config is only reloaded when its file changed
+        if self.loaded and self.storage.get_generation() == self.generation \
+          and self.get_config_mtime() == self.config_mtime:
+            return
+        with self.lock:
+            if not self.loaded:
+                self.load()
+                self.generation = self.storage.get_generation()
+                return
+            current_generation = self.storage.get_generation()
+            if self.get_config_mtime() != self.config_mtime:
+                self.load()
+                self.invalidate_view_cache()
+            elif current_generation not in (self.generation, self.storage.written_generation):
+                self.invalidate_view_cache()
+            self.generation = current_generation
+
+    def replace_config(self, new_config):
+        # the compiled config is swapped atomically so concurrent requests either see the old or the new one
+        save_config(new_config, self.config_filename)
+        self.config = compile_config(new_config)
+        self.storage.bump_generation()
+        self.invalidate_view_cache()
+
+    def invalidate_view_cache(self, years=None, since_year=None):
+        # contexts are keyed by (route, year, ...)
+        with self.view_cache_lock:
+            if not years and not since_year:
+                self.view_cache.clear()
+                return
+            for key in [k for k in self.view_cache if k[1] in (years or []) or (since_year and k[1] >= since_year)]:
+                del self.view_cache[key]
+
+    def get_config_mtime(self):
+        try:
+            return os.path.getmtime(self.config_filename)
+        except OSError:
+            return None
+
+    @contextmanager
+    def activate(self):
+        # makes this ledger the one config and storage refer to in the current thread (eg. in jobs)
+        previous = getattr(current, 'ledger', None)
+        current.ledger = self
+        try:
+            yield self
+        finally:
+            current.ledger = previous
+
+
+class LedgerRegistry(object):
+    def __init__(self, ledgers, max_loaded=None, idle_timeout=None):
+        self.ledgers = OrderedDict((ledger.name, ledger) for ledger in ledgers)
+        self.max_loaded = max_loaded
+        self.idle_timeout = idle_timeout
+        # loaded ledgers, least recently used first
+        self.loaded = OrderedDict()
+        self.lock = threading.Lock()
+
+    def match(self, host, path):
+        # returns the ledger with the longest prefix matching the request
+        host = host.split(':')[0].lower()
+        matching = [ledger for ledger in self.ledgers.values()
+            if (not ledger.host or ledger.host == host) and (not ledger.prefix
+                or path == ledger.prefix or path.startswith(ledger.prefix + '/'))]
+        if matching:
+            return max(matching, key=lambda ledger: (len(ledger.prefix or ''), bool(ledger.host)))
+
+    def acquire(self, ledger):
+        with self.lock:
+            ledger.active_requests += 1
+            ledger.last_used = time.time()
+            self.loaded.pop(ledger.name, None)
+            self.loaded[ledger.name] = ledger
+            self.evict()
+
+    def release(self, ledger):
+        with self.lock:
+            ledger.active_requests -= 1
+
+    def evict(self):
+        # ledgers serving requests or running jobs are never unloaded
+        now = time.time()
+        for ledger in self.loaded.values():
+            too_many = self.max_loaded and len(self.loaded) > self.max_loaded
+            expired = self.idle_timeout and now - ledger.last_used > self.idle_timeout
+            if (too_many or expired) and ledger.idle:
+                ledger.unload()
+                del self.loaded[ledger.name]
+
+
+class LedgerDispatcher(object):
+    # selects the ledger of a request. its prefix is moved from PATH_INFO to SCRIPT_NAME
+    # so that routes match and generated urls include it
+    def __init__(self, app, registry):
+        self.app = app
+        self.registry = registry
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        ledger = self.registry.match(environ.get('HTTP_HOST', environ.get('SERVER_NAME', '')), path)
+        if not ledger:
+            return NotFound()(environ, start_response)
+        if ledger.prefix:
+            environ['SCRIPT_NAME'] = environ.get('SCRIPT_NAME', '') + ledger.prefix
+            environ['PATH_INFO'] = path[len(ledger.prefix):] or '/'
+        environ['budgettracker.ledger'] = ledger
+        return self.app(environ, start_response)
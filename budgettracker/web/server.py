@@ -0,0 +1,37 @@
+from . import app
+
+
+def run_server(host='127.0.0.1', port=5000, workers=2, threads=4, pidfile=None, timeout=120):
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        print "gunicorn is not installed, falling back to a single multi-threaded process"
+        from werkzeug.serving import run_simple
+        run_simple(host, port, app, threaded=True)
+        return
+
+    if threads > 1:
+        try:
+            # the threaded worker depends on the futures backport
+            import concurrent.futures
+        except ImportError:
+            print "futures is not installed, using single threaded workers"
+            threads = 1
+
+    class Application(BaseApplication):
+        def load_config(self):
+            self.cfg.set('bind', '%s:%s' % (host, port))
+            self.cfg.set('workers', workers)
+            self.cfg.set('threads', threads)
+            self.cfg.set('worker_class', 'gthread' if threads > 1 else 'sync')
+            self.cfg.set('timeout', timeout)
+            # the app is imported once in the master process and forked into the workers.
+            # sending SIGHUP to the master gracefully replaces the workers
+            self.cfg.set('preload_app', True)
+            if pidfile:
+                self.cfg.set('pidfile', pidfile)
+
+        def load(self):
+            return app
+
+    Application().run()
@@ -15,10 +15,54 @@ function uploadFile() {
   document.querySelector('#update-form > input[type="file"]').click();
 }
 
-function submitUpdate(files) {
-  if (files.length) {
-    document.querySelector('#update-form').submit();
+function submitUpdate(event) {
+  if (event) {
+    event.preventDefault();
   }
+  var form = document.querySelector('#update-form');
+  var button = form.querySelector('button');
+  button.disabled = true;
+  button.classList.add('updating');
+
+  var req = new XMLHttpRequest();
+  req.responseType = 'json';
+  req.addEventListener("load", function() {
+    if (req.status !== 202) {
+      updateFailed(button, 'server error');
+      return;
+    }
+    pollUpdateJob(req.response, button);
+  });
+  req.open("POST", form.action);
+  req.setRequestHeader('Accept', 'application/json');
+  req.send(new FormData(form));
+}
+
+function pollUpdateJob(job, button) {
+  if (job.status === 'done') {
+    window.location.reload();
+    return;
+  }
+  if (job.status === 'failed') {
+    updateFailed(button, job.error);
+    return;
+  }
+  button.title = (job.message || 'Waiting') + ' (' + job.progress + '%)';
+  setTimeout(function() {
+    var req = new XMLHttpRequest();
+    req.responseType = 'json';
+    req.addEventListener("load", function() {
+      pollUpdateJob(req.response, button);
+    });
+    req.open("GET", job.url);
+    req.send();
+  }, 1000);
+}
+
+function updateFailed(button, error) {
+  button.disabled = false;
+  button.classList.remove('updating');
+  alert('Update failed: ' + error);
 }
 
 function transactionNodeToObject(node) {
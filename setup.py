@@ -9,7 +9,7 @@ setup(
     author='Maxime Bouroumeau-Fuseau',
     author_email='maxime.bouroumeau@gmail.com',
     description='Simple budget tracking app',
-    packages=find_packages(),
+    packages=find_packages(exclude=['benchmarks', 'benchmarks.*']),
     package_data={
         'budgettracker': ['web/templates/*', 'web/static/*'],
     },
@@ -24,6 +24,9 @@ setup(
         'ofxparse',
         'PyYAML'
     ],
+    extras_require={
+        'serve': ['gunicorn', 'futures']
+    },
     entry_points='''
         [console_scripts]
         budgettracker=budgettracker.cli:main
@@ -0,0 +1,61 @@
+import unittest, tempfile, shutil, datetime
+from budgettracker import helpers
+from budgettracker.bank_adapters.base import BankAdapter
+from budgettracker.data import Account
+from budgettracker.helpers import update_local_data
+
+
+class CannedAdapter(BankAdapter):
+    def __init__(self, config, balance, transactions):
+        super(CannedAdapter, self).__init__(config)
+        self.balance = balance
+        self.transactions = transactions
+
+    def fetch_accounts(self):
+        return [Account(id='ACC1', title='Checking', amount=self.balance)]
+
+    def fetch_transactions(self, account, start_date=None, end_date=None, watermark=None):
+        return [self.make_transaction(id=id, label=label, date=date, amount=amount, account=account.id)
+                for id, label, date, amount in self.transactions
+                if (not start_date or date >= start_date) and (not end_date or date < end_date)]
+
+
+class AlertsAfterConfigChangeTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.config = {'storage': 'json', 'storage_dir': self.directory, 'notify_balance': 500,
+            'notify_large_transaction': 200,
+            'categories': [{'name': 'Food', 'keywords': ['MONOPRIX'], 'warning_threshold': 100}]}
+        self.alerts = []
+        notify_budget_changes = helpers.notify_budget_changes
+        def record(*args, **kwargs):
+            alerts = notify_budget_changes(*args, **kwargs)
+            self.alerts.append(alerts)
+            return alerts
+        helpers.notify_budget_changes = record
+        self.addCleanup(setattr, helpers, 'notify_budget_changes', notify_budget_changes)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def sync(self, config, balance, transactions):
+        update_local_data(config, adapter=CannedAdapter(config, balance, transactions))
+        return self.alerts[-1]
+
+    def test_sync_right_after_a_category_change(self):
+        today = datetime.date.today()
+        transactions = [('1', 'CB MONOPRIX', today.replace(day=1), -20.0)]
+        self.assertEqual(self.sync(self.config, 1000, transactions), [])
+
+        # adding a category changes the budget config, the totals alerts compare to are rebuilt
+        config = dict(self.config, categories=self.config['categories'] + [
+            {'name': 'Car', 'keywords': ['GARAGE'], 'warning_threshold': 50}])
+        transactions.append(('2', 'CB GARAGE DUPONT', today, -300.0))
+        self.assertEqual(sorted(self.sync(config, 400, transactions)), [
+            'BUDGET: /!\\ CATEGORY WARNING: Car (300.0 / 50)',
+            'BUDGET: /!\\ LOW BALANCE: Checking (400)',
+            'BUDGET: LARGE TRANSACTION: CB GARAGE DUPONT (-300.0)'])
+
+
+if __name__ == '__main__':
+    unittest.main()
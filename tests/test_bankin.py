@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+import unittest, threading, tempfile, shutil, datetime, urlparse, functools, time, os
+from budgettracker.bank_adapters.bankin import BankinAdapter
+
+
+MONTHS = ['JAN', 'FEV', 'MAR', 'AVR', 'MAI', 'JUIN', 'JUIL', 'AOUT', 'SEPT', 'OCT', 'NOV', 'DEC']
+
+LOGIN_PAGE = '<html><body><form id="login"><input name="authenticityToken" value="token"></form></body></html>'
+
+ACCOUNT = (u'<span class="item" nb="%(id)s"><span class="bankAccount">Compte %(id)s</span>'
+           u'<span class="bankAmount">%(amount)s €</span></span>')
+
+TRANSACTION = (u'<div><p class="date"><span>%(day)s<span>%(month)s.<span>%(year)s</span></span></span></p>'
+               u'<p class="nom"><span class="note">%(label)s</span></p>'
+               u'<p class="price"><span>%(amount)s €</span></p>'
+               u'<div class="moveMonths"><input id="trId" value="%(id)s"></div></div>')
+
+NO_MORE_TRANSACTIONS = u'<div align="center">Aucune opération</div>'
+
+
+def make_canned_transactions(account, count):
+    # most recent first, one every other day, like the bankin listing
+    date = datetime.date(2026, 10, 15)
+    transactions = []
+    for i in range(count):
+        transactions.append({'id': '%s-%d' % (account, i), 'day': date.day, 'month': MONTHS[date.month - 1],
+            'year': date.year, 'label': u'CB CAFÉ %d' % i, 'amount': '-%d.%02d' % (i + 1, i % 100)})
+        date -= datetime.timedelta(days=2)
+    return transactions
+
+
+class CannedBankin(object):
+    def __init__(self, accounts, delay=0.01):
+        self.accounts = accounts
+        self.delay = delay
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    def handle(self, path, form):
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            # network latency, so that concurrent requests overlap
+            time.sleep(self.delay)
+            if path.startswith('/inscription'):
+                return LOGIN_PAGE
+            if path == '/Application/authenticate':
+                return ''
+            if path == '/Accounts/index':
+                return (u'<div id="contenu"><div class="listecomptes"><div class="scroool"><p class="on">%s</p>'
+                    u'</div></div></div>' % u''.join(ACCOUNT % {'id': id, 'amount': '1 234.56'} for id in self.accounts))
+            if path == '/AccountsAjax/listTransactions':
+                transactions = self.accounts[form['accountId'][0]][int(form['from'][0]):int(form['to'][0])]
+                if not transactions:
+                    return NO_MORE_TRANSACTIONS
+                return u''.join(TRANSACTION % tx for tx in transactions)
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+
+class Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.respond(self.server.bankin.handle(self.path, {}))
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.respond(self.server.bankin.handle(self.path, urlparse.parse_qs(body)))
+
+    def respond(self, body):
+        self.send_response(404 if body is None else 200)
+        body = (body or u'').encode('utf-8')
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class BankinAdapterTest(unittest.TestCase):
+    def setUp(self):
+        self.bankin = CannedBankin({id: make_canned_transactions(id, 120) for id in ('ACC1', 'ACC2', 'ACC3')})
+        self.server = Server(('127.0.0.1', 0), RequestHandler)
+        self.server.bankin = self.bankin
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        self.server.shutdown()
+        self.server.server_close()
+
+    def create_adapter(self, **config):
+        adapter = BankinAdapter(dict(config, bankin_url='http://127.0.0.1:%s' % self.server.server_address[1]))
+        # cookies are kept in session.json, in the current directory by default
+        adapter.create_request_session = functools.partial(adapter.create_request_session,
+            reuse=True, filename=os.path.join(self.directory, 'session-%s.json' % id(adapter)))
+        return adapter
+
+    def test_is_a_web_adapter(self):
+        self.assertEqual(self.create_adapter().fetch_type, 'web')
+
+    def test_concurrent_fetch_returns_the_same_transactions_as_sequential(self):
+        start_date = datetime.date(2026, 3, 1)
+        sequential = self.create_adapter(bank_adapter_max_workers=1)
+        expected = sequential.fetch_transactions_from_all_accounts(start_date)
+        self.assertEqual(self.bankin.max_in_flight, 1)
+        # one transaction every other day from 2026-10-15 back to 2026-03-01, for 3 accounts
+        self.assertEqual(len(expected), 3 * 115)
+        self.assertEqual(expected[0].label, u'CB CAFÉ 0')
+
+        concurrent = self.create_adapter(bank_adapter_max_workers=4, bank_adapter_page_ahead=2)
+        self.assertEqual(concurrent.fetch_transactions_from_all_accounts(start_date), expected)
+        self.assertGreater(self.bankin.max_in_flight, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
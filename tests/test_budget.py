@@ -0,0 +1,96 @@
+import unittest, datetime, random
+from collections import namedtuple
+from monthdelta import monthdelta
+from budgettracker.budget import BudgetGoal, compute_budget_goals
+from budgettracker.data import Transaction
+
+
+MonthBudget = namedtuple('MonthBudget', ['month', 'savings', 'expected_savings', 'transactions'])
+
+
+def previous_compute_budget_goals(budgets, budget_goals):
+    # allocation of savings before priorities and weights were introduced, every goal in
+    # progress receiving an equal share of the savings until it completes
+    used = {g.label: 0 for g in budget_goals}
+    saved = dict(used)
+    remaining_goals = [g.label for g in budget_goals if g.amount]
+    budget_goals = {g.label: g for g in budget_goals}
+    total_savings = 0
+    for budget in budgets:
+        savings = budget.savings
+        for tx in budget.transactions:
+            if tx.goal and tx.goal in used and tx.amount < 0:
+                used[tx.goal] += abs(tx.amount)
+                if budget_goals[tx.goal].amount and tx.goal not in remaining_goals:
+                    savings += abs(tx.amount)
+        if savings < 0 and total_savings <= 0:
+            total_savings += savings
+            continue
+        if total_savings < 0:
+            total_savings += savings
+            if total_savings < 0:
+                continue
+            savings = total_savings
+        else:
+            total_savings += savings
+        while savings != 0 and remaining_goals:
+            savings_per_goal = savings / len(remaining_goals)
+            savings = 0
+            for goal in filter(lambda g: g.amount and g.label in remaining_goals, budget_goals.values()):
+                new_save = max(saved[goal.label] + savings_per_goal, 0)
+                new_completed = max(used[goal.label] + saved[goal.label] + savings_per_goal, 0)
+                if new_completed >= goal.amount:
+                    give_back = new_completed - goal.amount
+                    savings += give_back
+                    saved[goal.label] = min(new_save - give_back, goal.amount)
+                    remaining_goals.remove(goal.label)
+                else:
+                    saved[goal.label] = new_save
+        if not remaining_goals:
+            break
+    return saved, used, max(total_savings - sum(saved.values()), 0)
+
+
+def generate_scenario(rnd, ngoals, nmonths):
+    goals = [BudgetGoal(label='G%d' % i, amount=rnd.choice([None, rnd.randint(50, 2000), rnd.randint(50, 2000)]),
+        from_date=None, to_date=None, priority=None, weight=None) for i in range(ngoals)]
+    budgets = []
+    month = datetime.date(2015, 1, 1)
+    for i in range(nmonths):
+        transactions = []
+        for j in range(rnd.randint(0, 3)):
+            transactions.append(Transaction(id='%d-%d' % (i, j), label='tx', date=month, account='acc',
+                amount=-float(rnd.choice([rnd.randint(1, 300), round(rnd.uniform(1, 300), 2)])),
+                categories=[], goal=rnd.choice(goals).label))
+        savings = float(rnd.choice([rnd.randint(-400, 1200), round(rnd.uniform(-400, 1200), 2)]))
+        budgets.append(MonthBudget(month, savings, savings, transactions))
+        month += monthdelta(1)
+    return goals, budgets
+
+
+class ComputeBudgetGoalsTest(unittest.TestCase):
+    def test_goals_without_priority_nor_weight_share_savings_equally(self):
+        for seed in range(300):
+            rnd = random.Random(seed)
+            goals, budgets = generate_scenario(rnd, rnd.randint(1, 8), rnd.randint(1, 24))
+            saved, used, savings_after_goals = previous_compute_budget_goals(budgets, goals)
+            computed, new_savings_after_goals = compute_budget_goals(budgets, goals)
+            for goal in computed:
+                self.assertAlmostEqual(goal.saved, saved[goal.label], places=6, msg='seed %d' % seed)
+                self.assertAlmostEqual(goal.used, used[goal.label], places=6, msg='seed %d' % seed)
+            self.assertAlmostEqual(new_savings_after_goals, savings_after_goals, places=6, msg='seed %d' % seed)
+
+    def test_goal_completed_by_rounded_savings(self):
+        # 1.0 - 0.7 is a hair above 0.3, the goal must still complete on the second month
+        # so that the amount later used from it goes back to the savings
+        goals = [BudgetGoal('G0', 1.0, None, None, None, None), BudgetGoal('G1', 10.0, None, None, None, None)]
+        months = [datetime.date(2015, m, 1) for m in (1, 2, 3)]
+        budgets = [MonthBudget(months[0], 1.4, 1.4, []), MonthBudget(months[1], 0.6, 0.6, []),
+            MonthBudget(months[2], 0.0, 0.0, [Transaction('1', 'tx', months[2], -0.5, 'acc', [], 'G0')])]
+        computed = {g.label: g for g in compute_budget_goals(budgets, goals)[0]}
+        self.assertAlmostEqual(computed['G0'].saved, 1.0)
+        self.assertAlmostEqual(computed['G1'].saved, 1.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
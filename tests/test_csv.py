@@ -0,0 +1,67 @@
+import unittest, tempfile, shutil, datetime, os
+from budgettracker.bank_adapters.csv import CSVAdapter
+
+
+def make_rows():
+    # two accounts, every third day from november to february
+    rows = []
+    date = datetime.date(2025, 11, 1)
+    for i in range(40):
+        rows.append((str(i), 'CB MONOPRIX %d' % i if i % 2 else 'PRLV EDF %d' % i, date, -10.0 - i, 'ACC%d' % (i % 2)))
+        date += datetime.timedelta(days=3)
+    return rows
+
+
+class CSVAdapterTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'export.csv')
+        self.rows = make_rows()
+        with open(self.filename, 'w') as f:
+            for row in self.rows:
+                f.write('%s,%s,%s,%s,%s\n' % (row[0], row[1], row[2].isoformat(), row[3], row[4]))
+        self.adapter = CSVAdapter({'categories': [{'name': 'Food', 'keywords': ['MONOPRIX']}]}, self.filename)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def expected_ids(self, start_date=None, end_date=None):
+        return sorted(row[0] for row in self.rows
+            if (not start_date or row[2] >= start_date) and (not end_date or row[2] < end_date))
+
+    def test_accounts_balances(self):
+        balances = {acc.id: acc.amount for acc in self.adapter.fetch_accounts()}
+        self.assertEqual(balances, {'ACC0': sum(r[3] for r in self.rows if r[4] == 'ACC0'),
+                                    'ACC1': sum(r[3] for r in self.rows if r[4] == 'ACC1')})
+
+    def test_file_is_read_once(self):
+        list(self.adapter.fetch_accounts())
+        os.unlink(self.filename)
+        transactions = self.adapter.fetch_transactions_from_all_accounts()
+        self.assertEqual(sorted(tx.id for tx in transactions), self.expected_ids())
+        self.assertEqual([tx.date for tx in transactions], sorted([r[2] for r in self.rows], reverse=True))
+
+    def test_periods_within_months(self):
+        for start_date, end_date in [(datetime.date(2025, 12, 1), datetime.date(2026, 1, 1)),
+                                     (datetime.date(2025, 11, 15), datetime.date(2026, 1, 10)),
+                                     (datetime.date(2026, 1, 20), None), (None, datetime.date(2025, 11, 4))]:
+            transactions = self.adapter.fetch_transactions_from_all_accounts(start_date, end_date)
+            self.assertEqual(sorted(tx.id for tx in transactions), self.expected_ids(start_date, end_date))
+
+    def test_monthly_buckets(self):
+        buckets = list(self.adapter.fetch_monthly_transactions(datetime.date(2025, 11, 20)))
+        self.assertEqual([month for month, _ in buckets], [datetime.date(2025, 11, 1), datetime.date(2025, 12, 1),
+            datetime.date(2026, 1, 1), datetime.date(2026, 2, 1)])
+        for month, transactions in buckets:
+            self.assertTrue(all(tx.date.replace(day=1) == month for tx in transactions))
+        self.assertEqual(sorted(tx.id for _, transactions in buckets for tx in transactions),
+            self.expected_ids(datetime.date(2025, 11, 20)))
+
+    def test_categories_are_matched(self):
+        transactions = {tx.id: tx for tx in self.adapter.fetch_transactions_from_all_accounts()}
+        self.assertEqual(transactions['1'].categories, ['Food'])
+        self.assertEqual(transactions['2'].categories, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
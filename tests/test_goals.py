@@ -0,0 +1,61 @@
+import unittest, tempfile, shutil, datetime, os
+from budgettracker.data import Transaction
+from budgettracker.goals import compute_yearly_budget_goals
+from budgettracker.storage import JSONStorage
+
+
+def make_month(month, expenses):
+    return [Transaction(id='%s-salary' % month.month, label='SALARY', date=month.replace(day=2), amount=2000.0,
+                        account='ACC1', categories=[], goal=None),
+            Transaction(id='%s-rent' % month.month, label='RENT', date=month.replace(day=5), amount=-expenses,
+                        account='ACC1', categories=[], goal=None)]
+
+
+class GoalCheckpointsTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.config = {'storage': 'json', 'storage_dir': self.directory,
+                       'budget_goals': [{'label': 'House', 'amount': 100000}]}
+        self.storage = JSONStorage(self.config)
+        # a past year, where every month is checkpointed
+        self.year = datetime.date.today().year - 1
+        for month in range(1, 13):
+            self.storage.save_monthly_transactions(datetime.date(self.year, month, 1),
+                make_month(datetime.date(self.year, month, 1), 500.0))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def compute(self):
+        goals, _ = compute_yearly_budget_goals(self.config, datetime.date(self.year, 12, 1), self.storage)
+        return {g.label: g.saved for g in goals}
+
+    def change_march(self):
+        march = datetime.date(self.year, 3, 1)
+        self.storage.save_monthly_transactions(march, make_month(march, 1500.0))
+        # a distinct mtime, whatever the resolution of the filesystem
+        filename = self.storage.get_monthly_transactions_filename(march)
+        mtime = os.path.getmtime(filename) + 10
+        os.utime(filename, (mtime, mtime))
+
+    def test_changed_month_is_recomputed(self):
+        self.assertEqual(self.compute(), {'House': 12 * 1500.0})
+        self.assertTrue(self.storage.load_state('goals')['checkpoints'])
+        self.change_march()
+        self.assertEqual(self.compute(), {'House': 12 * 1500.0 - 1000})
+
+    def test_month_written_while_loading_is_recomputed(self):
+        load_period_transactions = self.storage.load_period_transactions
+        def load_then_write(*args):
+            # a sync writes a month after its transactions were read for the computation
+            transactions = load_period_transactions(*args)
+            self.storage.load_period_transactions = load_period_transactions
+            self.change_march()
+            return transactions
+        self.storage.load_period_transactions = load_then_write
+        self.assertEqual(self.compute(), {'House': 12 * 1500.0})
+        self.assertEqual(self.compute(), {'House': 12 * 1500.0 - 1000})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import unittest, tempfile, shutil, datetime, os
+from budgettracker.bank_adapters.csv import CSVAdapter
+from budgettracker.helpers import import_local_data, load_sync_watermarks
+from budgettracker.storage import JSONStorage
+
+
+ROWS = [('1', 'RENT', '2025-11-02', -800, 'ACC1'), ('2', 'CB MONOPRIX', '2025-11-20', -35, 'ACC1'),
+        ('3', 'RENT', '2025-12-02', -800, 'ACC1'), ('4', 'SALARY', '2025-12-28', 2000, 'ACC2'),
+        ('5', 'RENT', '2026-01-02', -800, 'ACC1'), ('6', 'CB SNCF', '2026-01-15', -60, 'ACC2')]
+
+
+class BulkImportTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.config = {'storage': 'json', 'storage_dir': self.directory}
+        self.storage = JSONStorage(self.config)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def import_rows(self, rows):
+        filename = os.path.join(self.directory, 'export.csv')
+        with open(filename, 'w') as f:
+            for row in rows:
+                f.write('%s,%s,%s,%s,%s\n' % row)
+        return import_local_data(self.config, storage=self.storage, adapter=CSVAdapter(self.config, filename),
+                                 notify=False)
+
+    def test_every_month_is_written_once(self):
+        months = [datetime.date(2025, 11, 1), datetime.date(2025, 12, 1), datetime.date(2026, 1, 1)]
+        self.assertEqual(sorted(self.import_rows(ROWS)), months)
+        self.assertEqual([sorted(tx.id for tx in self.storage.load_monthly_transactions(m)) for m in months],
+            [['1', '2'], ['3', '4'], ['5', '6']])
+        self.assertEqual({id: wm.last_date for id, wm in load_sync_watermarks(self.storage).items()},
+            {'ACC1': datetime.date(2026, 1, 2), 'ACC2': datetime.date(2026, 1, 15)})
+
+        mtimes = [self.storage.get_monthly_transactions_mtime(m) for m in months]
+        self.assertEqual(self.import_rows(ROWS), [])
+        self.assertEqual([self.storage.get_monthly_transactions_mtime(m) for m in months], mtimes)
+
+    def test_only_changed_months_are_written(self):
+        self.import_rows(ROWS)
+        self.storage.update_transaction(datetime.date(2025, 11, 1), '2', categories=['Food'], goal='Holidays')
+        rows = ROWS + [('7', 'CB FNAC', '2025-12-24', -120, 'ACC2')]
+        self.assertEqual(self.import_rows(rows), [datetime.date(2025, 12, 1)])
+        # what was set on stored transactions is kept
+        tx = [tx for tx in self.storage.load_monthly_transactions(datetime.date(2025, 11, 1)) if tx.id == '2'][0]
+        self.assertEqual((tx.categories, tx.goal), (['Food'], 'Holidays'))
+
+    def test_reset_replaces_stored_months(self):
+        self.import_rows(ROWS)
+        self.storage.update_transaction(datetime.date(2025, 11, 1), '2', categories=['Food'])
+        filename = os.path.join(self.directory, 'export.csv')
+        import_local_data(self.config, storage=self.storage, adapter=CSVAdapter(self.config, filename),
+                          notify=False, reset=True)
+        tx = [tx for tx in self.storage.load_monthly_transactions(datetime.date(2025, 11, 1)) if tx.id == '2'][0]
+        self.assertEqual(tx.categories, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
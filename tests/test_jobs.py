@@ -0,0 +1,58 @@
+import unittest, tempfile, shutil, threading, time
+from budgettracker.jobs import JobQueue
+
+
+class InFlight(object):
+    # counts jobs running at the same time, per lock key
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = {}
+        self.max_running = {}
+
+    def __call__(self, key, progress):
+        with self.lock:
+            self.running[key] = self.running.get(key, 0) + 1
+            self.max_running[key] = max(self.max_running.get(key, 0), self.running[key])
+        time.sleep(0.02)
+        progress(50, 'halfway')
+        with self.lock:
+            self.running[key] -= 1
+
+
+class JobQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_jobs_with_the_same_lock_key_do_not_overlap(self):
+        queue = JobQueue(workers=4, state_dir=self.directory)
+        in_flight = InFlight()
+        jobs = [queue.submit(in_flight, key, lock_key=key) for key in ['2026-09'] * 4 + ['2026-10'] * 4]
+        queue.queue.join()
+        self.assertEqual(in_flight.max_running, {'2026-09': 1, '2026-10': 1})
+        self.assertEqual([queue.get(job.id)['status'] for job in jobs], ['done'] * 8)
+
+    def test_jobs_without_lock_key_run_concurrently(self):
+        queue = JobQueue(workers=4)
+        in_flight = InFlight()
+        for i in range(4):
+            queue.submit(in_flight, None)
+        queue.queue.join()
+        self.assertGreater(in_flight.max_running[None], 1)
+
+    def test_statuses_are_shared_through_the_state_dir(self):
+        # eg. a job submitted to one web worker and polled from another one
+        queue = JobQueue(state_dir=self.directory)
+        def fail(progress):
+            raise ValueError('unreadable file')
+        job = queue.submit(fail)
+        queue.queue.join()
+        status = JobQueue(state_dir=self.directory).get(job.id)
+        self.assertEqual((status['status'], status['error']), ('failed', 'unreadable file'))
+        self.assertIsNone(JobQueue(state_dir=self.directory).get('unknown'))
+
+
+if __name__ == '__main__':
+    unittest.main()
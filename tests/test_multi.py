@@ -0,0 +1,64 @@
+import unittest, datetime
+from budgettracker.bank_adapters.base import BankAdapter
+from budgettracker.bank_adapters.multi import MultiAdapter
+from budgettracker.data import Account, Transaction, deduplicate_transactions
+
+
+def tx(id, label, day, amount, account='ACC1', categories=None):
+    return Transaction(id=id, label=label, date=datetime.date(2026, 10, day), amount=amount, account=account,
+                       categories=categories or [], goal=None)
+
+
+class StaticAdapter(BankAdapter):
+    def __init__(self, config, accounts, transactions):
+        super(StaticAdapter, self).__init__(config)
+        self.accounts = accounts
+        self.transactions = transactions
+
+    def fetch_accounts(self):
+        return self.accounts
+
+    def fetch_transactions(self, account, start_date=None, end_date=None, watermark=None):
+        return [t for t in self.transactions if t.account == account.id
+                and (not start_date or t.date >= start_date) and (not end_date or t.date < end_date)]
+
+
+class DeduplicateTransactionsTest(unittest.TestCase):
+    def test_duplicates_across_sources(self):
+        bank = [tx('b1', 'CB MONOPRIX 12/10', 12, -35.2), tx('b2', 'PRLV EDF', 5, -60.0), tx('b3', 'RENT', 1, -800.0)]
+        aggregator = [tx('a1', 'cb monoprix 12-10', 14, -35.2),   # posted two days later
+                      tx('a2', 'PRLV EDF', 15, -60.0),            # outside of the window
+                      tx('a3', 'RENT', 1, -800.0, 'ACC2'),        # another account
+                      tx('b3', 'RENT', 1, -800.0, categories=['Home'])]
+        final = deduplicate_transactions([bank, aggregator], 3)
+        self.assertEqual([t.id for t in final], ['b1', 'b2', 'b3', 'a2', 'a3'])
+        # same id: merged, the first source wins
+        self.assertEqual(final[2].categories, ['Home'])
+
+    def test_identical_transactions_within_a_source_are_kept(self):
+        # two coffees on the same day, the other source only knows one of them
+        bank = [tx('b1', 'CB CAFE', 3, -2.5), tx('b2', 'CB CAFE', 3, -2.5)]
+        aggregator = [tx('a1', 'CB CAFE', 3, -2.5)]
+        self.assertEqual([t.id for t in deduplicate_transactions([bank, aggregator])], ['b1', 'b2'])
+        aggregator.append(tx('a2', 'CB CAFE', 4, -2.5))
+        aggregator.append(tx('a3', 'CB CAFE', 4, -2.5))
+        self.assertEqual([t.id for t in deduplicate_transactions([bank, aggregator])], ['b1', 'b2', 'a3'])
+
+
+class MultiAdapterTest(unittest.TestCase):
+    def test_two_adapters(self):
+        account = Account(id='ACC1', title='Checking', amount=1000.0)
+        adapter = MultiAdapter({'bank_adapters_dedup_days': 2})
+        adapter.__dict__['adapters'] = [
+            StaticAdapter({}, [account], [tx('b1', 'CB FNAC', 10, -120.0), tx('b2', 'CB SNCF', 11, -45.0)]),
+            StaticAdapter({}, [account.update(amount=980.0)],
+                [tx('a1', 'CB FNAC', 12, -120.0), tx('a2', 'CB SNCF', 20, -45.0), tx('a3', 'CB CAFE', 18, -2.5)])]
+        self.assertEqual([t.id for t in adapter.fetch_transactions_from_all_accounts()], ['a2', 'a3', 'b2', 'b1'])
+        # a1 is a duplicate of b1 which is dated before the period
+        self.assertEqual([t.id for t in adapter.fetch_transactions(account, datetime.date(2026, 10, 11))],
+                         ['b2', 'a2', 'a3'])
+        self.assertEqual(len(adapter.fetch_accounts()), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
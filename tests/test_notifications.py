@@ -0,0 +1,170 @@
+import unittest, threading, smtpd, asyncore, time
+from budgettracker import notifications
+from budgettracker.notifications import Notifier, digest, notify_using_config, get_notifier_key
+
+
+class FakeAdapter(object):
+    # records connections and deliveries instead of talking to an smtp server.
+    # the first `failures` deliveries raise and deliveries wait for the gate to be open
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.gate = threading.Event()
+        self.gate.set()
+        self.connections = 0
+        self.disconnections = 0
+        self.delivered = []
+        self.recipients = []
+
+    def connect(self, config):
+        self.connections += 1
+        return self.connections
+
+    def deliver(self, config, message, connection):
+        self.gate.wait()
+        if self.failures:
+            self.failures -= 1
+            raise IOError('connection reset')
+        self.delivered.append((connection, message))
+        self.recipients.append((config.get('notify_emails'), message))
+
+    def disconnect(self, connection):
+        self.disconnections += 1
+
+
+class NotifierTest(unittest.TestCase):
+    def setUp(self):
+        self.config = {'notify_adapter': 'fake', 'notify_retries': 2, 'notify_retry_delay': 0}
+
+    def tearDown(self):
+        notifications.notifiers.clear()
+
+    def test_queued_messages_share_one_connection(self):
+        adapter = FakeAdapter()
+        adapter.gate.clear()
+        notifier = Notifier(self.config, adapter)
+        for i in range(4):
+            notifier.send('message %s' % i)
+        self.assertFalse(notifier.flush(0.1))
+        adapter.gate.set()
+        self.assertTrue(notifier.flush(5))
+        self.assertEqual(adapter.delivered, [(1, 'message %s' % i) for i in range(4)])
+        # disconnected once the queue is empty
+        self.assertEqual(adapter.disconnections, 1)
+
+    def test_failed_delivery_is_retried_on_a_new_connection(self):
+        adapter = FakeAdapter(failures=2)
+        notifier = Notifier(self.config, adapter)
+        notifier.send('hello')
+        self.assertTrue(notifier.flush(5))
+        self.assertEqual(adapter.delivered, [(3, 'hello')])
+
+    def test_message_is_dropped_after_all_retries(self):
+        # 1 + notify_retries attempts for the first message
+        adapter = FakeAdapter(failures=3)
+        notifier = Notifier(self.config, adapter)
+        notifier.send('lost')
+        notifier.send('next')
+        self.assertTrue(notifier.flush(5))
+        self.assertEqual(adapter.delivered, [(4, 'next')])
+
+    def test_digest_sends_a_single_message(self):
+        adapter = FakeAdapter()
+        notifications.notifiers[get_notifier_key(self.config)] = Notifier(self.config, adapter)
+        with digest(self.config):
+            notify_using_config(self.config, 'BUDGET: first')
+            notify_using_config(self.config, 'BUDGET: second')
+        notifications.flush_notifications(5)
+        self.assertEqual(adapter.delivered, [(1, "BUDGET: 2 notifications\nBUDGET: first\nBUDGET: second")])
+
+    def test_ledgers_keep_their_own_recipients(self):
+        # two ledgers served by one process use the same adapter with different settings
+        adapter = FakeAdapter()
+        alice = dict(self.config, notify_emails=['alice@example.com'])
+        bob = dict(self.config, notify_emails=['bob@example.com'])
+        import_module = notifications.import_module
+        notifications.import_module = lambda name: adapter
+        try:
+            for i in range(3):
+                notify_using_config(alice, 'BUDGET: alice %d' % i)
+                notify_using_config(bob, 'BUDGET: bob %d' % i)
+        finally:
+            notifications.import_module = import_module
+        notifications.flush_notifications(5)
+        self.assertEqual(len(notifications.notifiers), 2)
+        self.assertEqual(sorted(adapter.recipients), sorted(
+            [(['alice@example.com'], 'BUDGET: alice %d' % i) for i in range(3)] +
+            [(['bob@example.com'], 'BUDGET: bob %d' % i) for i in range(3)]))
+
+
+class RecordingChannel(smtpd.SMTPChannel):
+    def smtp_QUIT(self, arg):
+        self._SMTPChannel__server.quits += 1
+        smtpd.SMTPChannel.smtp_QUIT(self, arg)
+
+
+class RecordingSMTPServer(smtpd.SMTPServer):
+    # an smtp server on localhost keeping what it receives
+    def __init__(self):
+        smtpd.SMTPServer.__init__(self, ('127.0.0.1', 0), None)
+        self.sessions = 0
+        self.quits = 0
+        self.messages = []
+
+    def handle_accept(self):
+        pair = self.accept()
+        if pair is not None:
+            self.sessions += 1
+            RecordingChannel(self, *pair)
+
+    def process_message(self, peer, mailfrom, rcpttos, data):
+        self.messages.append((mailfrom, rcpttos, data))
+
+
+class EmailAdapterTest(unittest.TestCase):
+    def setUp(self):
+        self.server = RecordingSMTPServer()
+        self.running = True
+        # while cleared, connections wait for the smtp greeting
+        self.serving = threading.Event()
+        self.serving.set()
+        def serve():
+            while self.running:
+                if self.serving.wait(0.01):
+                    asyncore.loop(timeout=0.01, count=1)
+        self.thread = threading.Thread(target=serve)
+        self.thread.daemon = True
+        self.thread.start()
+        self.config = {'notify_adapter': 'email', 'notify_host': '127.0.0.1:%s' % self.server.socket.getsockname()[1],
+                       'notify_emails': ['alice@example.com', 'bob@example.com'], 'notify_from_email': 'budget@example.com',
+                       'notify_retries': 0}
+
+    def tearDown(self):
+        notifications.notifiers.clear()
+        self.running = False
+        self.thread.join()
+        asyncore.close_all()
+
+    def test_messages_are_delivered_over_smtp(self):
+        self.serving.clear()
+        notify_using_config(self.config, 'BUDGET: /!\\ LOW BALANCE: Checking (400)')
+        notify_using_config(self.config, 'BUDGET: first line\nsecond line')
+        self.serving.set()
+        notifications.flush_notifications(5)
+        # the server handles the QUIT after the notifier disconnected
+        deadline = time.time() + 5
+        while not self.server.quits and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(len(self.server.messages), 2)
+        for mailfrom, rcpttos, data in self.server.messages:
+            self.assertEqual(mailfrom, 'budget@example.com')
+            self.assertEqual(rcpttos, ['alice@example.com', 'bob@example.com'])
+            self.assertIn('To: alice@example.com, bob@example.com', data)
+        self.assertIn('Subject: BUDGET: /!\\ LOW BALANCE: Checking (400)', self.server.messages[0][2])
+        self.assertIn('Subject: BUDGET: first line\n', self.server.messages[1][2])
+        self.assertTrue(self.server.messages[1][2].endswith('first line\nsecond line'))
+        # both messages went through one connection, closed once the queue was empty
+        self.assertEqual((self.server.sessions, self.server.quits), (1, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+import unittest, tempfile, shutil, datetime, os, io
+from budgettracker.bank_adapters.ofx import OFXAdapter, iter_ofx_elements
+
+
+SGML_HEADER = """OFXHEADER:100
+DATA:OFXSGML
+VERSION:102
+SECURITY:NONE
+ENCODING:USASCII
+CHARSET:1252
+COMPRESSION:NONE
+OLDFILEUID:NONE
+NEWFILEUID:NONE
+
+"""
+
+SGML_TRANSACTION = """<STMTTRN>
+<TRNTYPE>DEBIT
+<DTPOSTED>%(date)s
+<TRNAMT>%(amount)s
+<FITID>%(id)s
+<NAME>%(name)s
+%(memo)s</STMTTRN>
+"""
+
+SGML_STATEMENT = """<%(rs)s>
+<CURDEF>EUR
+<%(acct)s>
+<BANKID>30004
+<ACCTID>%(account)s
+<ACCTTYPE>%(type)s
+</%(acct)s>
+<BANKTRANLIST>
+<DTSTART>20260101
+<DTEND>20260301
+%(transactions)s</BANKTRANLIST>
+<LEDGERBAL>
+<BALAMT>%(balance)s
+<DTASOF>20260301
+</LEDGERBAL>
+</%(rs)s>
+"""
+
+# dates with timezone offsets (some of them moving the transaction to another day once in UTC),
+# amounts with comma decimals and thousands separators, names with entities and accented characters
+DATES = ['20260105', '20260110120000', '20260131230000[-5:EST]', '20260201013000[+10:AEST]',
+         '20260214093000.123[+1:CET]', '20260228']
+AMOUNTS = ['-12.50', '-12,50', '-1.234,56', '1,234.56', '+2500', '-0,99']
+NAMES = ['CB AMAZON &amp; CO', 'PRLV SEPA &lt;EDF&gt;', 'VIR M. & MME DUPONT', 'CB CAF\xc9 DE LA GARE',
+         'CARTE 4970 MONOPRIX', 'RETRAIT DAB']
+
+
+def make_sgml_ofx(ntransactions=120):
+    statements = []
+    for n, (rs, acct, account, type) in enumerate([('STMTRS', 'BANKACCTFROM', '00012345678', 'CHECKING'),
+                                                  ('CCSTMTRS', 'CCACCTFROM', '4970123412341234', '')]):
+        transactions = []
+        for i in range(ntransactions):
+            transactions.append(SGML_TRANSACTION % {
+                'date': DATES[i % len(DATES)], 'amount': AMOUNTS[i % len(AMOUNTS)], 'id': '%d%05d' % (n, i),
+                'name': NAMES[i % len(NAMES)], 'memo': '<MEMO>REF %d\n' % i if i % 3 else ''})
+        statements.append(SGML_STATEMENT % {'rs': rs, 'acct': acct, 'account': account,
+            'type': type or 'CREDITLINE', 'transactions': ''.join(transactions),
+            'balance': '-1.042,17' if n else '3456.78'})
+    return (SGML_HEADER + "<OFX>\n<BANKMSGSRSV1>\n<STMTTRNRS>\n" + statements[0] +
+        "</STMTTRNRS>\n</BANKMSGSRSV1>\n<CREDITCARDMSGSRSV1>\n<CCSTMTTRNRS>\n" + statements[1] +
+        "</CCSTMTTRNRS>\n</CREDITCARDMSGSRSV1>\n</OFX>\n")
+
+
+class StreamingOFXParserTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'statement.ofx')
+        with open(self.filename, 'wb') as f:
+            f.write(make_sgml_ofx())
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def fetch(self, parser, start_date=None, end_date=None):
+        adapter = OFXAdapter({'ofx_parser': parser}, self.filename)
+        return (adapter.fetch_accounts(),
+            sorted(adapter.fetch_transactions_from_all_accounts(start_date, end_date)))
+
+    def test_same_accounts_and_transactions_as_ofxparse(self):
+        accounts, transactions = self.fetch('streaming')
+        self.assertEqual(len(accounts), 2)
+        self.assertEqual(len(transactions), 240)
+        self.assertEqual((accounts, transactions), self.fetch('ofxparse'))
+
+    def test_same_period_as_ofxparse(self):
+        period = (datetime.date(2026, 2, 1), datetime.date(2026, 3, 1))
+        self.assertEqual(self.fetch('streaming', *period), self.fetch('ofxparse', *period))
+
+    def test_entities_timezones_and_decimals(self):
+        transactions = {tx.id: tx for tx in self.fetch('streaming')[1]}
+        self.assertEqual(transactions['000000'].label, u'CB AMAZON & CO')
+        self.assertEqual(transactions['000001'].label, u'PRLV SEPA <EDF> REF 1')
+        self.assertEqual(transactions['000003'].label, u'CB CAF\xc9 DE LA GARE')
+        # 23:00 at UTC-5 and 01:30 at UTC+10 are on the following and previous day in UTC
+        self.assertEqual(transactions['000002'].date, datetime.date(2026, 2, 1))
+        self.assertEqual(transactions['000003'].date, datetime.date(2026, 1, 31))
+        self.assertEqual([transactions['00000%d' % i].amount for i in range(6)],
+            [-12.5, -12.5, -1234.56, 1234.56, 2500.0, -0.99])
+
+    def test_tags_split_across_chunks(self):
+        # the first 10KB are read at once for the headers, the sample is larger than that
+        with open(self.filename, 'rb') as f:
+            content = f.read()
+        self.assertGreater(len(content), 20000)
+        expected = list(iter_ofx_elements(io.BytesIO(content)))
+        for chunk_size in (1, 7, 4096):
+            self.assertEqual(list(iter_ofx_elements(io.BytesIO(content), chunk_size)), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
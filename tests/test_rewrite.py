@@ -0,0 +1,85 @@
+import unittest, tempfile, shutil, datetime, threading, time
+from budgettracker.data import Transaction
+from budgettracker.rewrite import RemapCategory, RemapAccountId, RematchCategories, rewrite_all_transactions
+from budgettracker.storage import JSONStorage
+
+
+MONTHS = [datetime.date(2025, month, 1) for month in range(1, 13)]
+
+
+def make_month(month):
+    # only odd months have groceries
+    transactions = [Transaction(id='%s-rent' % month.month, label='RENT', date=month, amount=-800.0,
+                                account='ACC1', categories=['Home'], goal=None)]
+    if month.month % 2:
+        transactions.append(Transaction(id='%s-food' % month.month, label='CB MONOPRIX', date=month.replace(day=9),
+                                        amount=-35.0, account='ACC2', categories=['Groceries'], goal=None))
+    return transactions
+
+
+class SlowRemapCategory(RemapCategory):
+    # gives other threads the opportunity to run in the middle of a rewrite
+    def __call__(self, tx):
+        time.sleep(0.001)
+        return super(SlowRemapCategory, self).__call__(tx)
+
+
+class RewriteTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.config = {'storage': 'json', 'storage_dir': self.directory}
+        self.storage = JSONStorage(self.config)
+        for month in MONTHS:
+            self.storage.save_monthly_transactions(month, make_month(month))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def get_mtimes(self):
+        return [self.storage.get_monthly_transactions_mtime(month) for month in MONTHS]
+
+    def test_only_changed_months_are_written(self):
+        mtimes = self.get_mtimes()
+        results = rewrite_all_transactions(self.config, RemapCategory('Groceries', 'Food'), self.storage, workers=1)
+        self.assertEqual(results, {month: 1 for month in MONTHS if month.month % 2})
+        self.assertEqual([m == mtime for m, mtime in zip(self.get_mtimes(), mtimes)],
+                         [bool(month.month % 2 == 0) for month in MONTHS])
+        self.assertEqual(self.storage.load_monthly_transactions(MONTHS[0])[1].categories, ['Food'])
+
+    def test_dry_run(self):
+        mtimes = self.get_mtimes()
+        results = rewrite_all_transactions(self.config, RemapAccountId('ACC1', 'ACC3'), self.storage, dry_run=True)
+        self.assertEqual(results, {month: 1 for month in MONTHS})
+        self.assertEqual(self.get_mtimes(), mtimes)
+
+    def test_process_pool(self):
+        operation = RematchCategories({'categories': [{'name': 'Food', 'keywords': ['MONOPRIX']}]})
+        self.assertEqual(rewrite_all_transactions(self.config, operation, workers=3),
+                         {month: 1 for month in MONTHS if month.month % 2})
+        self.assertEqual(self.storage.load_monthly_transactions(MONTHS[0])[1].categories, ['Groceries', 'Food'])
+        # matched categories are only added once
+        self.assertEqual(rewrite_all_transactions(self.config, operation, workers=3), {})
+
+    def test_concurrent_rewrites_of_two_ledgers(self):
+        # eg. settings saved at the same time in two ledgers of a web process
+        other_directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, other_directory)
+        other_config = {'storage': 'json', 'storage_dir': other_directory}
+        other_storage = JSONStorage(other_config)
+        for month in MONTHS:
+            other_storage.save_monthly_transactions(month, make_month(month))
+
+        def rewrite(config, storage, new_category):
+            rewrite_all_transactions(config, SlowRemapCategory('Home', new_category), storage, workers=1)
+        threads = [threading.Thread(target=rewrite, args=args) for args in
+                   [(self.config, self.storage, 'House'), (other_config, other_storage, 'Flat')]]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(set(self.storage.load_monthly_transactions(m)[0].categories[0] for m in MONTHS), set(['House']))
+        self.assertEqual(set(other_storage.load_monthly_transactions(m)[0].categories[0] for m in MONTHS), set(['Flat']))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import unittest, tempfile, shutil, datetime, threading
+from budgettracker.bank_adapters.base import BankAdapter
+from budgettracker.data import Account, SyncWatermark
+from budgettracker.helpers import update_monthly_transactions, load_sync_watermarks, merge_sync_watermarks
+from budgettracker.storage import JSONStorage
+
+
+class ListingAdapter(BankAdapter):
+    # lists transactions most recent first and stops at the watermark date, like bankin
+    def __init__(self, config, transactions):
+        super(ListingAdapter, self).__init__(config)
+        self.transactions = transactions
+        self.watermarks = []
+
+    def fetch_accounts(self):
+        return [Account(id='ACC1', title='Checking', amount=0)]
+
+    def fetch_transactions(self, account, start_date=None, end_date=None, watermark=None):
+        self.watermarks.append(watermark)
+        return [self.make_transaction(id=id, label=label, date=date, amount=amount, account=account.id)
+                for id, label, date, amount in sorted(self.transactions, key=lambda tx: tx[2], reverse=True)
+                if start_date <= date < end_date and (not watermark or date >= watermark.last_date)]
+
+
+class IncrementalSyncTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.config = {'storage': 'json', 'storage_dir': self.directory}
+        self.storage = JSONStorage(self.config)
+        self.month = datetime.date.today().replace(day=1)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def sync(self, transactions):
+        adapter = ListingAdapter(self.config, transactions)
+        return adapter, update_monthly_transactions(self.storage, adapter, self.month)
+
+    def test_only_transactions_since_the_watermark_are_fetched(self):
+        transactions = [('1', 'RENT', self.month, -800.0), ('2', 'CB MONOPRIX', self.month.replace(day=2), -20.0)]
+        adapter, _ = self.sync(transactions)
+        self.assertEqual(adapter.watermarks, [None])
+        self.assertEqual(load_sync_watermarks(self.storage)['ACC1'].last_date, self.month.replace(day=2))
+
+        # only the last day is fetched again and merged with what is stored
+        adapter, merged = self.sync(transactions)
+        self.assertEqual(adapter.watermarks[0].last_date, self.month.replace(day=2))
+        self.assertEqual(sorted(tx.id for tx in merged), ['1', '2'])
+        # nothing new: the fetched transactions are the ones of the previous sync, storage is not read
+        adapter, merged = self.sync(transactions)
+        self.assertIsNone(merged)
+
+        transactions.append(('3', 'CB SNCF', self.month.replace(day=3), -45.0))
+        adapter, merged = self.sync(transactions)
+        self.assertEqual(sorted(tx.id for tx in merged), ['1', '2', '3'])
+        self.assertEqual(sorted(tx.id for tx in self.storage.load_monthly_transactions(self.month)), ['1', '2', '3'])
+        self.assertEqual(load_sync_watermarks(self.storage)['ACC1'].last_date, self.month.replace(day=3))
+
+    def test_concurrent_syncs_keep_each_others_watermarks(self):
+        def sync(prefix):
+            for i in range(20):
+                merge_sync_watermarks(self.storage, {'%s%d' % (prefix, i): SyncWatermark(
+                    account='%s%d' % (prefix, i), last_date=self.month, hash=str(i))})
+        threads = [threading.Thread(target=sync, args=(prefix,)) for prefix in 'AB']
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(load_sync_watermarks(self.storage)), 40)
+
+
+if __name__ == '__main__':
+    unittest.main()
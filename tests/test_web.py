@@ -0,0 +1,162 @@
+import unittest, tempfile, shutil, datetime, os, json, StringIO
+from collections import OrderedDict
+from budgettracker import web
+from budgettracker.config import save_config
+from budgettracker.data import Transaction
+from budgettracker.ingest import ingest_directory
+from budgettracker.storage import JSONStorage
+from budgettracker.web.ledgers import Ledger
+
+
+def make_transaction(id, label, date, amount, account='ACC1', categories=None):
+    return Transaction(id=id, label=label, date=date, amount=amount, account=account,
+                       categories=categories or [], goal=None)
+
+
+class WebTestCase(unittest.TestCase):
+    # serves a ledger stored in a temporary directory from the app of the process
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.config = {'storage': 'json', 'storage_dir': self.directory,
+                       'categories': [{'name': 'Food', 'keywords': ['MONOPRIX']}]}
+        save_config(self.config, os.path.join(self.directory, 'config.yaml'))
+        self.storage = JSONStorage(self.config)
+        self.month = datetime.date.today().replace(day=1)
+        self.storage.save_monthly_transactions(self.month, [
+            make_transaction('1', 'SALARY', self.month, 2000.0),
+            make_transaction('2', 'CB MONOPRIX', self.month, -20.0, categories=['Food'])])
+
+        self.ledger = Ledger('default', os.path.join(self.directory, 'config.yaml'))
+        registry = web.ledgers
+        self.addCleanup(setattr, registry, 'ledgers', registry.ledgers)
+        self.addCleanup(setattr, registry, 'loaded', registry.loaded)
+        registry.ledgers = OrderedDict([('default', self.ledger)])
+        registry.loaded = OrderedDict()
+        self.client = web.app.test_client()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def url(self, path):
+        return '/%s/%s%s' % (self.month.year, self.month.month, path)
+
+
+class ConditionalResponsesTest(WebTestCase):
+    def test_not_modified_until_a_write(self):
+        response = self.client.get(self.url('/budget.json'))
+        self.assertEqual(response.status_code, 200)
+        etag = response.headers['ETag']
+
+        response = self.client.get(self.url('/budget.json'), headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers['ETag'], etag)
+        self.assertEqual(response.data, '')
+
+        self.client.post(self.url('/2'), data={'categories': ['Food', 'Groceries']})
+        response = self.client.get(self.url('/budget.json'), headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+    def test_etag_depends_on_the_route(self):
+        budget = self.client.get(self.url('/budget.json'))
+        transactions = self.client.get(self.url('/transactions.json'), headers={'If-None-Match': budget.headers['ETag']})
+        self.assertEqual(transactions.status_code, 200)
+        self.assertNotEqual(transactions.headers['ETag'], budget.headers['ETag'])
+
+
+class ViewCacheTest(WebTestCase):
+    def setUp(self):
+        super(ViewCacheTest, self).setUp()
+        self.loads = []
+        load_yearly_budgets_from_config = web.load_yearly_budgets_from_config
+        def load(config, date, *args, **kwargs):
+            self.loads.append(date.year)
+            return load_yearly_budgets_from_config(config, date, *args, **kwargs)
+        self.addCleanup(setattr, web, 'load_yearly_budgets_from_config', load_yearly_budgets_from_config)
+        web.load_yearly_budgets_from_config = load
+
+    def cached_years(self):
+        return sorted(key[1] for key in self.ledger.view_cache if key[0] == 'compute_year_context')
+
+    def test_context_is_reused(self):
+        for i in range(2):
+            self.assertEqual(self.client.get('/%s' % self.month.year).status_code, 200)
+        self.assertEqual(self.loads, [self.month.year])
+
+    def test_invalidated_years_are_dropped(self):
+        year = self.month.year
+        for y in (year - 1, year):
+            self.client.get('/%s' % y)
+        self.assertEqual(self.cached_years(), [year - 1, year])
+
+        self.ledger.invalidate_view_cache([year])
+        self.assertEqual(self.cached_years(), [year - 1])
+        self.client.get('/%s' % year)
+        self.assertEqual(self.loads, [year - 1, year, year])
+
+        self.ledger.invalidate_view_cache()
+        self.assertEqual(len(self.ledger.view_cache), 0)
+
+    def test_updating_a_transaction_drops_its_year(self):
+        year = self.month.year
+        for y in (year - 1, year):
+            self.client.get('/%s' % y)
+        self.client.post(self.url('/2'), data={'categories': ['Food'], 'goal': ''})
+        self.assertEqual(self.cached_years(), [year - 1])
+
+
+class ExportTest(WebTestCase):
+    def setUp(self):
+        super(ExportTest, self).setUp()
+        self.previous_month = self.month - datetime.timedelta(days=1)
+        self.storage.save_monthly_transactions(self.previous_month, [
+            make_transaction('3', 'CB MONOPRIX', self.previous_month, -35.5, 'ACC2', ['Food']),
+            make_transaction('4', 'RENT', self.previous_month.replace(day=1), -800.0)])
+
+    def export(self, **args):
+        args.setdefault('start', self.previous_month.replace(day=1).isoformat())
+        return self.client.get('/export', query_string=args)
+
+    def test_csv_spans_months(self):
+        response = self.export()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'text/csv')
+        self.assertEqual([row.split(',')[0] for row in response.data.splitlines()], ['3', '4', '1', '2'])
+
+    def test_ndjson_with_filters(self):
+        response = self.export(format='ndjson', category='food')
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        self.assertEqual([json.loads(line)['id'] for line in response.data.splitlines()], ['3', '2'])
+        response = self.export(format='ndjson', account='ACC2', end=self.month.isoformat())
+        self.assertEqual([json.loads(line)['amount'] for line in response.data.splitlines()], [-35.5])
+
+    def test_invalid_parameters(self):
+        self.assertEqual(self.client.get('/export').status_code, 400)
+        self.assertEqual(self.export(format='xml').status_code, 400)
+        self.assertEqual(self.export(end=self.previous_month.replace(day=1).isoformat()).status_code, 400)
+
+
+class UploadTest(WebTestCase):
+    def setUp(self):
+        super(UploadTest, self).setUp()
+        self.imports_dir = os.path.join(self.directory, 'imports')
+        save_config(dict(self.config, imports_dir=self.imports_dir), self.ledger.config_filename)
+
+    def test_uploads_kept_in_imports_dir_are_not_ingested_again(self):
+        csv = '3,CB FNAC,%s,-120.0,ACC1\n' % self.month.replace(day=3).isoformat()
+        response = self.client.post(self.url(''), data={'file': (StringIO.StringIO(csv), 'export.csv')},
+                                    headers={'Accept': 'application/json'})
+        self.assertEqual(response.status_code, 202)
+        self.ledger.jobs.queue.join()
+        self.assertEqual(self.ledger.jobs.get(json.loads(response.data)['id'])['status'], 'done')
+        self.assertEqual(os.listdir(self.imports_dir), ['%s-export.csv' % datetime.date.today().isoformat()])
+        self.assertEqual(sorted(tx.id for tx in self.storage.load_monthly_transactions(self.month)), ['1', '2', '3'])
+
+        self.storage.update_transaction(self.month, '3', categories=['Books'])
+        self.assertEqual(ingest_directory(self.config, self.imports_dir, self.storage, settle_delay=0), {})
+        self.assertEqual([tx.categories for tx in self.storage.load_monthly_transactions(self.month) if tx.id == '3'],
+                         [['Books']])
+
+
+if __name__ == '__main__':
+    unittest.main()